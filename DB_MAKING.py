@@ -4,10 +4,15 @@ load_dotenv()
 import os
 os.environ["OPENAI_API_KEY"] = os.getenv("OPENAI_API_KEY")
 
-import glob, json, uuid
-from typing import List, Dict, Any
+import sys, glob, json, time, hashlib, resource
+from itertools import zip_longest
+from typing import List, Dict, Any, Tuple, Iterator, Optional
+import numpy as np
 import chromadb
 from openai import OpenAI
+from bm25_index import BM25Index, BM25_DIR, index_path, stamp_collection
+from vector_store import LocalVectorStore, VEC_DIR, store_path
+from emb_cache import EMB_MODEL   # OpenAI 임베딩 모델 (EMB_MODEL, chunking.py와 같은 값)
 
 ARTIFACT_DIR = os.getenv("ARTIFACT_DIR", "rag/.artifacts").replace("\\","/")
 PERSIST_DIR  = os.getenv("PERSIST_DIR", "rag/.chroma").replace("\\","/")
@@ -19,16 +24,37 @@ EMBS_PATH    = os.getenv("EMBS_PATH", "")
 FILTER_WORKS = [s.strip() for s in os.getenv("FILTER_WORKS","").split(",") if s.strip()]
 FILTER_KINDS = [s.strip() for s in os.getenv("FILTER_KINDS","").split(",") if s.strip()]
 
-EMB_MODEL = "text-embedding-3-small"   # OpenAI 임베딩 모델
+STREAM       = os.getenv("STREAM", "0") == "1"   # 1: 두 파일을 한 줄씩 읽으며 조인 → 메모리 사용량이 배치 크기에 비례
+BATCH        = int(os.getenv("UPSERT_BATCH", "500"))
+SYNC         = os.getenv("SYNC", "0") == "1"     # 1: content_hash로 비교해 바뀐 레코드만 업서트 + 사라진 id 삭제
+BUILD_BM25   = os.getenv("BUILD_BM25", "1") == "1"  # 적재 후 디스크 BM25 인덱스(app.py가 로드) 재생성
+BACKEND      = os.getenv("VECTOR_BACKEND", "chroma") # chroma | local(int8 + mmap, 작품별 파티션. 항상 전체 재생성)
 
-def latest(path_glob: str) -> str:
-    files = sorted(glob.glob(path_glob), key=lambda p: os.path.getmtime(p))
+def latest(*path_globs: str) -> str:
+    files = sorted((p for g in path_globs for p in glob.glob(g)), key=lambda p: os.path.getmtime(p))
     return files[-1] if files else ""
 
 def load_jsonl(path: str) -> List[dict]:
     with open(path, "r", encoding="utf-8") as f:
         return [json.loads(line) for line in f if line.strip()]
 
+def load_embeddings(path: str) -> Tuple[Dict[str, List[int]], np.ndarray]:
+    # id → 행 번호들(같은 id가 여러 번 나오면 등장 순서대로), (N, dim) 행렬. .npy는 memmap이라 실제로 읽는 건 업서트 배치 분량뿐
+    if path.endswith(".npy"):
+        mat = np.load(path, mmap_mode="r")
+        with open(path[:-len(".npy")] + ".ids.txt", "r", encoding="utf-8") as f:
+            ids = [line.rstrip("\n") for line in f if line.strip()]
+        if len(ids) != mat.shape[0]:
+            raise SystemExit(f"[ERROR] id 인덱스({len(ids)})와 행렬 행 수({mat.shape[0]})가 다릅니다: {path}")
+    else:
+        embs = load_jsonl(path)
+        ids = [e["id"] for e in embs]
+        mat = np.asarray([e["embedding"] for e in embs], dtype=np.float32)
+    rows: Dict[str, List[int]] = {}
+    for r, _id in enumerate(ids):
+        rows.setdefault(_id, []).append(r)
+    return rows, mat
+
 def kind_matches(kind: str, patterns: List[str]) -> bool:
     if not patterns:
         return True
@@ -39,64 +65,183 @@ def kind_matches(kind: str, patterns: List[str]) -> bool:
             return True
     return False
 
-def main():
-    chunks_file = CHUNKS_PATH or latest(f"{ARTIFACT_DIR}/chunks_*.jsonl")
-    embs_file   = EMBS_PATH   or latest(f"{ARTIFACT_DIR}/embeddings_*.jsonl")
-    if not chunks_file or not embs_file:
-        raise SystemExit(f"[ERROR] chunks/embeddings 파일을 찾을 수 없음.\n  chunks={chunks_file}\n  embs={embs_file}")
+def iter_jsonl(path: str) -> Iterator[dict]:
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
 
-    chunks = load_jsonl(chunks_file)
-    embs   = load_jsonl(embs_file)
-    emb_map = {e["id"]: e["embedding"] for e in embs}
+def iter_embeddings(path: str) -> Iterator[Tuple[str, Any]]:
+    if path.endswith(".npy"):
+        mat = np.load(path, mmap_mode="r")
+        with open(path[:-len(".npy")] + ".ids.txt", "r", encoding="utf-8") as f:
+            for r, line in enumerate(f):
+                yield line.rstrip("\n"), mat[r]
+    else:
+        for e in iter_jsonl(path):
+            yield e["id"], e["embedding"]
 
-    ids, docs, metas, vecs = [], [], [], []
-    seen = set()
+def iter_joined(chunks_file: str, embs_file: str) -> Iterator[Tuple[dict, Any]]:
+    # chunking.py는 두 파일을 같은 순서로 쓰므로 보통 한 줄씩 바로 짝이 맞음.
+    # 순서가 어긋난 경우에만 pending에 잠시 보관했다가 짝이 나오면 내보냄.
+    pend_c: Dict[str, List[dict]] = {}
+    pend_e: Dict[str, Any] = {}
+    for rec, emb in zip_longest(iter_jsonl(chunks_file), iter_embeddings(embs_file)):
+        if emb is not None:
+            eid, vec = emb
+            if rec is not None and rec["id"] == eid:
+                yield rec, vec
+                continue
+            if eid in pend_c:
+                for r in pend_c.pop(eid):
+                    yield r, vec
+            else:
+                pend_e[eid] = vec
+        if rec is not None:
+            cid = rec["id"]
+            if cid in pend_e:
+                yield rec, pend_e[cid]
+            else:
+                pend_c.setdefault(cid, []).append(rec)
+    if pend_c:
+        print(f"[WARN] 임베딩이 없는 청크 {sum(len(v) for v in pend_c.values())}개는 건너뜀")
 
-    for rec in chunks:
-        base_id  = rec["id"]
-        text = rec["text"]
-        meta = rec.get("metadata", {})
-        work = meta.get("work_id","unknown")
-        kind = meta.get("kind","unknown")
+def in_scope(meta: dict) -> bool:
+    if FILTER_WORKS and meta.get("work_id","unknown") not in FILTER_WORKS:
+        return False
+    # 중복 제거로 흡수된 kind(meta["kinds"])도 필터 대상
+    kinds = [meta.get("kind","unknown")] + [k for k in (meta.get("kinds") or "").split(",") if k]
+    return any(kind_matches(k, FILTER_KINDS) for k in kinds)
 
-        if FILTER_WORKS and work not in FILTER_WORKS:
-            continue
-        if not kind_matches(kind, FILTER_KINDS):
-            continue
+def unique_id(base_id: str, dup: Dict[str, int]) -> str:
+    # 같은 base id가 다시 나오면 등장 순서대로 ::dup1, ::dup2 … → 재실행해도 id가 바뀌지 않음
+    n = dup.get(base_id, 0)
+    dup[base_id] = n + 1
+    return base_id if n == 0 else f"{base_id}::dup{n}"
 
-        vec = emb_map.get(base_id)
-        if vec is None:
+def content_hash(text: str, meta: dict, vec: Any) -> str:
+    # 텍스트/메타 + 임베딩(모델, dtype, 벡터 바이트) → 재임베딩이나 모델/EMB_DTYPE 변경도 SYNC가 감지
+    #   jsonl 임베딩(list)은 load_embeddings와 같이 float32로 맞춰 STREAM 여부와 무관하게 같은 값
+    arr = vec if isinstance(vec, np.ndarray) else np.asarray(vec, dtype=np.float32)
+    meta = {k: v for k, v in meta.items() if k != "content_hash"}
+    raw = "\x1f".join([EMB_MODEL, str(arr.dtype), text, json.dumps(meta, ensure_ascii=False, sort_keys=True)])
+    h = hashlib.sha1(raw.encode("utf-8"))
+    h.update(np.ascontiguousarray(arr).tobytes())
+    return h.hexdigest()
+
+def iter_records(chunks_file: str, embs_file: str, stream: bool = STREAM) -> Iterator[Tuple[str, str, dict, Any]]:
+    if stream:
+        pairs = iter_joined(chunks_file, embs_file)
+    else:
+        emb_rows, emb_mat = load_embeddings(embs_file)
+        # 중복 id는 STREAM 모드(iter_joined)처럼 등장 순서대로 짝지음 → 두 모드의 content_hash가 같음
+        pairs = ((rec, emb_mat[rows.pop(0) if len(rows) > 1 else rows[0]])
+                 for rec in load_jsonl(chunks_file) for rows in [emb_rows.get(rec["id"])] if rows)
+
+    dup: Dict[str, int] = {}
+    for rec, vec in pairs:
+        meta = dict(rec.get("metadata", {}))
+        if not in_scope(meta):
             continue
+        meta["content_hash"] = content_hash(rec["text"], meta, vec)
+        yield unique_id(rec["id"], dup), rec["text"], meta, vec
 
-        # 중복 방지
-        _id = base_id
-        if _id in seen:
-            _id = f"{base_id}::{uuid.uuid4().hex[:6]}"
-        seen.add(_id)
+def fetch_existing(col, page: int = 1000) -> Dict[str, str]:
+    # 필터 범위 안의 기존 레코드만: id → content_hash (문서/벡터는 가져오지 않음)
+    out: Dict[str, str] = {}
+    offset = 0
+    while True:
+        res = col.get(include=["metadatas"], limit=page, offset=offset)
+        ids = res.get("ids") or []
+        for _id, meta in zip(ids, res.get("metadatas") or []):
+            meta = meta or {}
+            if in_scope(meta):
+                out[_id] = meta.get("content_hash", "")
+        if len(ids) < page:
+            return out
+        offset += page
 
+def upsert_records(col, records: Iterator[Tuple[str, str, dict, Any]], batch: int = BATCH,
+                   existing: Optional[Dict[str, str]] = None) -> Dict[str, int]:
+    ids, docs, metas, vecs = [], [], [], []
+    stats = {"total": 0, "upserted": 0, "unchanged": 0, "deleted": 0}
+    live = set()
+
+    def flush():
+        col.upsert(ids=ids, documents=docs, metadatas=metas,
+                   embeddings=np.asarray(vecs, dtype=np.float32))
+        stats["upserted"] += len(ids)
+        ids.clear(); docs.clear(); metas.clear(); vecs.clear()
+
+    for _id, text, meta, vec in records:
+        stats["total"] += 1
+        if existing is not None:
+            live.add(_id)
+            if existing.get(_id) == meta["content_hash"]:
+                stats["unchanged"] += 1
+                continue
         ids.append(_id); docs.append(text); metas.append(meta); vecs.append(vec)
+        if len(ids) >= batch:
+            flush()
+    if ids:
+        flush()
 
-    if not ids:
-        raise SystemExit("[WARN] 업서트할 레코드가 없습니다. 필터나 파일 경로를 확인하세요.")
+    if existing is not None:
+        orphans = [i for i in existing if i not in live]
+        for i in range(0, len(orphans), batch):
+            col.delete(ids=orphans[i:i+batch])
+        stats["deleted"] = len(orphans)
+    return stats
 
-    client = chromadb.PersistentClient(path=PERSIST_DIR)
-    # embedding_function=None → 사전 계산된 벡터만 사용
-    col = client.get_or_create_collection(
-        name=COLLECTION,
-        metadata={"hnsw:space":"cosine"},
-        embedding_function=None
-    )
-
-    # 배치 업서트
-    BATCH = 500
-    for i in range(0, len(ids), BATCH):
-        col.upsert(
-            ids=ids[i:i+BATCH],
-            documents=docs[i:i+BATCH],
-            metadatas=metas[i:i+BATCH],
-            embeddings=vecs[i:i+BATCH],
+def peak_rss_mb() -> float:
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+def main():
+    chunks_file = CHUNKS_PATH or latest(f"{ARTIFACT_DIR}/chunks_*.jsonl")
+    embs_file   = EMBS_PATH   or latest(f"{ARTIFACT_DIR}/embeddings_*.jsonl", f"{ARTIFACT_DIR}/embeddings_*.npy")
+    if not chunks_file or not embs_file:
+        raise SystemExit(f"[ERROR] chunks/embeddings 파일을 찾을 수 없음.\n  chunks={chunks_file}\n  embs={embs_file}")
+
+    t0 = time.perf_counter()
+    if BACKEND == "local":
+        # 로컬 저장소는 임시 디렉터리에 새로 쓰고 교체 → SYNC 비교 없이 전체 재생성
+        dest = store_path(COLLECTION, VEC_DIR)
+        stats = LocalVectorStore.build(dest, iter_records(chunks_file, embs_file, stream=STREAM), collection=COLLECTION)
+        col = LocalVectorStore.open(dest)
+    else:
+        client = chromadb.PersistentClient(path=PERSIST_DIR)
+        # embedding_function=None → 사전 계산된 벡터만 사용
+        col = client.get_or_create_collection(
+            name=COLLECTION,
+            metadata={"hnsw:space":"cosine"},
+            embedding_function=None
         )
-    print(f"[UPSERT] {len(ids)} items → collection='{COLLECTION}' @ {PERSIST_DIR}")
+        existing = fetch_existing(col) if SYNC else None
+        stats = upsert_records(col, iter_records(chunks_file, embs_file, stream=STREAM),
+                               batch=BATCH, existing=existing)
+        if stats["total"]:
+            # 앱 시작 시 BM25 인덱스가 최신인지 O(1)로 확인하도록 (문서 수, 지문)을 컬렉션 메타데이터에 기록
+            count, fp = stamp_collection(col)
+            print(f"[STAMP] count = {count}, fingerprint = {fp[:12]}")
+    n = stats["total"]
+    if not n:
+        raise SystemExit("[WARN] 업서트할 레코드가 없습니다. 필터나 파일 경로를 확인하세요.")
+    dt = time.perf_counter() - t0
+    where = dest if BACKEND == "local" else PERSIST_DIR
+    print(f"[UPSERT] {stats['upserted']}/{n} items → collection='{COLLECTION}' @ {where}  (backend={BACKEND}, stream={int(STREAM)}, sync={int(SYNC)})")
+    if SYNC and BACKEND != "local":
+        print(f"[SYNC] unchanged = {stats['unchanged']}, deleted(orphans) = {stats['deleted']}, collection size = {col.count()}")
+    print(f"[PERF] {dt:.2f}s, {n / dt if dt else 0:.1f} items/s, peak RSS = {peak_rss_mb():.1f} MB")
+
+    if BUILD_BM25:
+        t0 = time.perf_counter()
+        # 이전 인덱스(같은 토크나이저)가 있으면 content_hash가 같은 문서의 토큰을 재사용
+        path = index_path(COLLECTION, BM25_DIR)
+        idx = BM25Index.build_from_collection(col, cache=BM25Index.load(path))
+        idx.save(path)
+        print(f"[BM25] docs = {len(idx)}, terms = {len(idx.vocab)}, tokenizer = {idx.tokenizer}, "
+              f"reused = {idx.manifest['reused_docs']}, {time.perf_counter() - t0:.2f}s → {path}")
 
     client_oa = OpenAI()
     q = "기억과 상실의 주제"
@@ -0,0 +1,120 @@
+import os, re, time, sqlite3, hashlib, threading
+from typing import Any, Dict, List, Optional
+import numpy as np
+
+from emb_cache import pack_vec
+from query_cache import normalize_query
+
+# 같은 작품/인물에게 거의 같은 질문 → 저장된 답을 그대로 반환 (검색 + LLM 호출 생략)
+#   키: (work_id, speak_as, model, 최근 대화 해시) 범위 안에서 질의 임베딩 코사인 ≥ ANSWER_CACHE_SIM
+ANSWER_CACHE         = os.getenv("ANSWER_CACHE", "1") == "1"
+ANSWER_CACHE_SIM     = float(os.getenv("ANSWER_CACHE_SIM", "0.95"))
+ANSWER_CACHE_TTL     = float(os.getenv("ANSWER_CACHE_TTL", str(7 * 86400)))   # 초, 0이면 만료 없음
+ANSWER_CACHE_SIZE    = int(os.getenv("ANSWER_CACHE_SIZE", "5000"))            # 초과 시 오래 안 쓰인 답부터 삭제
+ANSWER_CACHE_HISTORY = int(os.getenv("ANSWER_CACHE_HISTORY", "2"))            # 일치해야 하는 최근 메시지 수
+
+def _norm(s: str) -> str:
+    return re.sub(r"\s+", "", (s or "")).lower()
+
+def history_key(history: Optional[List[Dict[str, Any]]], n: int = ANSWER_CACHE_HISTORY) -> str:
+    # 대화 없음 → "" / 있으면 최근 n개 메시지(role+내용)가 같을 때만 같은 키
+    recent = (history or [])[-n:] if n > 0 else []
+    if history and not recent:
+        return "*"   # 기록이 있는데 비교하지 않는 설정이면 캐시를 쓰지 않도록 별도 키
+    h = hashlib.sha1()
+    for m in recent:
+        h.update(m.get("role", "").encode("utf-8")); h.update(b"\x1f")
+        h.update(normalize_query(m.get("content", "")).encode("utf-8")); h.update(b"\x1e")
+    return h.hexdigest() if recent else ""
+
+class AnswerCache:
+    def __init__(self, path: str, sim: float = ANSWER_CACHE_SIM, ttl: float = ANSWER_CACHE_TTL,
+                 max_items: int = ANSWER_CACHE_SIZE):
+        self.path, self.sim, self.ttl, self.max_items = path, sim, ttl, max_items
+        d = os.path.dirname(path)
+        if d:
+            os.makedirs(d, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS answers ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " work_id TEXT NOT NULL, speak_as TEXT NOT NULL, model TEXT NOT NULL, hist TEXT NOT NULL,"
+            " query TEXT NOT NULL, vec BLOB NOT NULL, answer TEXT NOT NULL,"
+            " created REAL NOT NULL, last_hit REAL NOT NULL, hits INTEGER NOT NULL DEFAULT 0)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS answers_scope ON answers (work_id, speak_as, model, hist)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS answers_lru ON answers (last_hit)")
+        self._conn.commit()
+        self.hits = self.misses = self.stores = self.evictions = 0
+
+    def lookup(self, work_id: str, speak_as: str, model: str, qvec: List[float],
+               history: Optional[List[Dict[str, Any]]] = None) -> Optional[Dict[str, Any]]:
+        hist = history_key(history)
+        if hist == "*" or qvec is None:
+            self.misses += 1
+            return None
+        now = time.time()
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, vec, answer, created, query FROM answers"
+                " WHERE work_id = ? AND speak_as = ? AND model = ? AND hist = ?",
+                (work_id or "", _norm(speak_as), model, hist),
+            ).fetchall()
+            if self.ttl:
+                rows = [r for r in rows if now - r[3] <= self.ttl]
+            best = None
+            if rows:
+                q = np.asarray(qvec, dtype=np.float32)
+                q = q / (np.linalg.norm(q) or 1.0)
+                mat = np.stack([np.frombuffer(r[1], dtype=np.float32) for r in rows])
+                sims = (mat @ q) / np.maximum(np.linalg.norm(mat, axis=1), 1e-12)
+                i = int(np.argmax(sims))
+                if sims[i] >= self.sim:
+                    best = {"answer": rows[i][2], "similarity": min(1.0, float(sims[i])), "query": rows[i][4]}
+                    self._conn.execute("UPDATE answers SET last_hit = ?, hits = hits + 1 WHERE id = ?",
+                                       (now, rows[i][0]))
+                    self._conn.commit()
+        if best is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return best
+
+    def put(self, work_id: str, speak_as: str, model: str, query: str, qvec: List[float], answer: str,
+            history: Optional[List[Dict[str, Any]]] = None) -> None:
+        hist = history_key(history)
+        if hist == "*" or qvec is None or not (answer or "").strip():
+            return
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO answers (work_id, speak_as, model, hist, query, vec, answer, created, last_hit)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (work_id or "", _norm(speak_as), model, hist, query, pack_vec(qvec), answer, now, now),
+            )
+            self.stores += 1
+            if self.ttl:
+                cur = self._conn.execute("DELETE FROM answers WHERE created < ?", (now - self.ttl,))
+                self.evictions += cur.rowcount
+            n = self._conn.execute("SELECT COUNT(*) FROM answers").fetchone()[0]
+            if n > self.max_items:
+                cur = self._conn.execute(
+                    "DELETE FROM answers WHERE id IN (SELECT id FROM answers ORDER BY last_hit LIMIT ?)",
+                    (n - self.max_items,))
+                self.evictions += cur.rowcount
+            self._conn.commit()
+
+    def count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM answers").fetchone()[0]
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "stores": self.stores, "evictions": self.evictions,
+                "hit_rate": self.hits / total if total else 0.0}
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
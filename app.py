@@ -13,146 +13,68 @@ import sqlite3
 from dotenv import load_dotenv
 load_dotenv()
 
-import os, re
-import chromadb
-from rank_bm25 import BM25Okapi
-from openai import OpenAI
-
-BASE_DIR      = os.path.dirname(os.path.abspath(__file__))
-PERSIST_DIR   = os.getenv("PERSIST_DIR") or os.path.join(BASE_DIR, "rag", ".chroma")
-COLLECTION    = os.getenv("COLLECTION", "library-all")
-MODEL         = os.getenv("MODEL", "gpt-4o")
-TOP_K         = int(os.getenv("TOP_K", "6"))
-EMB_MODEL     = "text-embedding-3-small"
-
-os.environ["OPENAI_API_KEY"] = os.getenv("OPENAI_API_KEY")
-oa = OpenAI()
-
-WORK_ID_MAP = {
-    "지구 끝의 온실": "jigu-ggut-onshil",
-    "종의 기원": "jong-ui-giwon",
-    "소년이 온다": "so-nyeon-i-onda"
-}
-
-def tokenize(text: str):
-    # 영문/숫자/한글만 추출 → 소문자 → 토큰 리스트
-    return re.findall(r"[0-9A-Za-z가-힣]+", (text or "").lower())
-
-def reciprocal_rank_fusion(results_lists, k=60):
-    scores = {}
-    for res in results_lists:
-        for rank, doc_id in enumerate(res, start=1):
-            scores[doc_id] = scores.get(doc_id, 0) + 1.0/(k+rank)
-    return sorted(scores.items(), key=lambda x: x[1], reverse=True)
-
-client = chromadb.PersistentClient(path=PERSIST_DIR)
-
-col = client.get_or_create_collection(name=COLLECTION, embedding_function=None)
-
-results = col.get(include=["documents","metadatas"], limit=999_999)
-all_ids   = results.get("ids", []) or []
-all_docs  = results.get("documents", []) or []
-all_metas = results.get("metadatas", []) or []
-
-filtered_ids, filtered_docs, filtered_metas, tokenized_docs = [], [], [], []
-for doc_id, doc, meta in zip(all_ids, all_docs, all_metas):
-    if not isinstance(doc, str):
-        continue
-    if not doc.strip():
-        continue
-    toks = tokenize(doc)
-    if not toks:
-        continue
-    filtered_ids.append(doc_id)
-    filtered_docs.append(doc)
-    filtered_metas.append(meta or {})
-    tokenized_docs.append(toks)
-
-bm25 = None
-if tokenized_docs:
-    bm25 = BM25Okapi(tokenized_docs)
-else:
+import os, json, time
+import httpx
+from chat_core import ChatPipeline, WORK_ID_MAP
+from prompt_builder import RollingMemory
+
+STREAM_OUTPUT = os.getenv("STREAM_OUTPUT", "1") == "1"   # 1: 토큰이 도착하는 대로 말풍선에 출력
+CHAT_API_URL  = os.getenv("CHAT_API_URL", "").rstrip("/")  # 지정 시 server.py에 요청만 보내는 얇은 클라이언트로 동작
+CHAT_API_TIMEOUT = float(os.getenv("CHAT_API_TIMEOUT", "120"))
+
+@st.cache_resource
+def load_pipeline():
+    # 인덱스/캐시/계측을 프로세스 내 모든 세션이 공유 (CHAT_API_URL 모드에서는 로드하지 않음)
+    os.environ["OPENAI_API_KEY"] = os.getenv("OPENAI_API_KEY")
+    return ChatPipeline.open()
+
+@st.cache_resource
+def load_http():
+    return httpx.Client(base_url=CHAT_API_URL, timeout=CHAT_API_TIMEOUT)
+
+pipe = None if CHAT_API_URL else load_pipeline()
+if pipe is not None and not len(pipe.retriever.bm25):
     st.warning("BM25 인덱스를 만들 문서가 없습니다. 데이터 경로 또는 문서 내용을 확인하세요.")
 
-id2doc = {i: (t, m) for i, t, m in zip(filtered_ids, filtered_docs, filtered_metas)}
-
-def hybrid_retrieve(query, top_k, work_id=None):
-    if not query or not query.strip():
-        return []
-
-    emb = oa.embeddings.create(model=EMB_MODEL, input=query).data[0].embedding
-    vec_res = col.query(
-        query_embeddings=[emb],
-        n_results=top_k * 3,
-        where={"work_id": work_id} if work_id else None
-    )
-    vec_ids = vec_res["ids"][0] if vec_res.get("ids") else []
-
-    bm25_ids = []
-    if bm25 is not None:
-        toks = tokenize(query)
-        if toks:
-            scores = bm25.get_scores(toks)
-            ranked = sorted(enumerate(scores), key=lambda x: x[1], reverse=True)[:top_k*3]
-            # ranked의 인덱스는 filtered_docs/tokenized_docs 기준
-            bm25_ids = [
-                filtered_ids[i] for i, _ in ranked
-                if (not work_id or (filtered_metas[i].get("work_id") == work_id))
-            ]
-
-    fused = reciprocal_rank_fusion([vec_ids, bm25_ids])
-
-    hits = []
-    for did, _ in fused:
-        if did in id2doc:
-            txt, meta = id2doc[did]
-            hits.append((did, txt, meta))
-            if len(hits) >= top_k:
-                break
-    return hits
-
-def make_prompt(query, hits, work_id=None, speak_as=None, history=[]):
-    persona_block = ""
-    if speak_as and work_id:
-        persos = []
-        for _id, (txt, meta) in id2doc.items():
-            if meta.get("work_id") == work_id and meta.get("kind") in ["persona", "characters_raw"]:
-                ch = meta.get("character", "") or ""
-                if speak_as in ch:
-                    persos.append(txt)
-        if persos:
-            persona_block = f"[인물 페르소나: {speak_as}]\n{persos[0]}"
-
-    context_cards = []
-    for _, txt, meta in hits:
-        title = meta.get("scene_title") or meta.get("chapter_label") or meta.get("kind")
-        context_cards.append(f"### {title}\n{txt}")
-
-    system = (
-        "당신은 소설 속 인물의 말투를 재현하는 AI입니다.\n"
-        "컨텍스트를 근거로 사용하세요.\n"
-        "당신이 소설 속 등장인물이라고 생각하세요.\n"
-        "대화할 때는 해당 인물의 말투/가치관을 반영해 2~3문장 이내로 대답하세요.\n"
-        "답할때는 대화하듯이 자연스럽게 얘기해"
-    )
-    if persona_block:
-        system += "\n\n" + persona_block
-
-    msgs = [{"role": "system", "content": system}]
-    if history:
-        msgs.extend(history[-6:])  
-
-    user = f"질문: {query}\n\n[컨텍스트]\n" + "\n\n".join(context_cards[:8])
-    msgs.append({"role": "user", "content": user})
-    return msgs
-
-def generate(messages):
-    try:
-        resp = oa.responses.create(model=MODEL, input=messages, temperature=0)
-        return getattr(resp, "output_text", "").strip()
-    except Exception:
-        comp = oa.chat.completions.create(model=MODEL, messages=messages)
-        return comp.choices[0].message.content.strip()
+def sse_events(resp):
+    # text/event-stream → (event, data dict)
+    event, data = "message", []
+    for line in resp.iter_lines():
+        if not line:
+            if data:
+                yield event, json.loads("\n".join(data))
+            event, data = "message", []
+        elif line.startswith("event:"):
+            event = line[6:].strip()
+        elif line.startswith("data:"):
+            data.append(line[5:].strip())
+
+def remote_chat(query, work_id, speak_as, on_delta=None):
+    # server.py에 한 턴 요청 → (answer, timing). on_delta가 있으면 SSE로 받아 조각마다 호출
+    body = {"message": query, "work_id": work_id, "speak_as": speak_as or "",
+            "session_id": st.session_state.get("api_session")}
+    http = load_http()
+    if on_delta is None:
+        r = http.post("/chat", json=body)
+        data = r.json()
+        if r.status_code != 200:
+            raise RuntimeError(data.get("error") or f"HTTP {r.status_code}")
+        st.session_state.api_session = data["session_id"]
+        return data["answer"], data["timing"]
+    with http.stream("POST", "/chat/stream", json=body) as r:
+        if r.status_code != 200:
+            r.read()
+            raise RuntimeError(r.json().get("error") or f"HTTP {r.status_code}")
+        for event, data in sse_events(r):
+            if event == "meta":
+                st.session_state.api_session = data["session_id"]
+            elif event == "delta":
+                on_delta(data["text"])
+            elif event == "error":
+                raise RuntimeError(data["error"])
+            elif event == "done":
+                return data["answer"], data["timing"]
+    raise RuntimeError("응답 스트림이 중간에 끊겼습니다.")
 
 st.markdown("""
 <style>
@@ -170,6 +92,7 @@ html, body, .stApp { background-color: #CFE7FF !important; }
   max-width: 70%; font-size: 15px; line-height: 1.4;
   align-self: flex-start; margin: 6px auto 6px 0;
 }
+.turn-timing { font-size: 11px; color: #555; margin: -2px 0 6px 4px; }
 </style>
 """, unsafe_allow_html=True)
 
@@ -179,6 +102,8 @@ if "work_id" not in st.session_state:
     st.session_state.work_id = None
 if "speak_as" not in st.session_state:
     st.session_state.speak_as = None
+if "memory" not in st.session_state:
+    st.session_state.memory = RollingMemory()
 
 st.title("📚 소설 속 인물과 대화하기")
 
@@ -192,6 +117,7 @@ st.session_state.speak_as = st.text_input("인물 선택 (예: 유진, 동호, 
 if (prev_work and prev_work != st.session_state.work_id) or \
    (prev_speak and prev_speak != st.session_state.speak_as):
     st.session_state.history = []
+    st.session_state.api_session = None
     st.rerun()
 
 st.markdown('<div class="chat-container">', unsafe_allow_html=True)
@@ -200,36 +126,67 @@ for msg in st.session_state.history:
         st.markdown(f'<div class="user-message">{msg["content"]}</div>', unsafe_allow_html=True)
     elif msg["role"] == "assistant":
         st.markdown(f'<div class="bot-message">{msg["content"]}</div>', unsafe_allow_html=True)
+        if msg.get("timing", {}).get("cache") is not None:
+            t = msg["timing"]
+            hits = (f" · 적중 {pipe.answers.hits}/{pipe.answers.hits + pipe.answers.misses}"
+                    if pipe is not None and pipe.answers is not None else "")
+            st.markdown(f'<div class="turn-timing">⏱ 답변 캐시 {t["total"]:.3f}s · 유사도 {t["cache"]:.3f}{hits}</div>',
+                        unsafe_allow_html=True)
+        elif msg.get("timing"):
+            t, r = msg["timing"], msg["timing"].get("retrieval", {})
+            stages = " / ".join(f"{k} {r[k]:.2f}" for k in ("embed", "vector", "bm25", "fetch", "rerank") if k in r)
+            degraded = " · BM25 전용" if r.get("degraded") else ""
+            p = t.get("prompt") or {}
+            ptoks = (f' · 프롬프트 {p["total"]} tok (카드 {p["cards"]}장 {p["context"]} / 대화 {p["history"]}'
+                     f' / 요약 {p["memory"]} / 페르소나 {p["persona"]})') if p else ""
+            st.markdown(f'<div class="turn-timing">⏱ 첫 토큰 {t["ttft"]:.2f}s · 전체 {t["total"]:.2f}s'
+                        f' · 검색 {r.get("total", 0):.2f}s ({stages}){degraded}{ptoks}</div>',
+                        unsafe_allow_html=True)
 st.markdown('</div>', unsafe_allow_html=True)
 
 query = st.text_input("메시지를 입력하세요", key="input")
 
 if st.button("보내기", type="primary") and query.strip():
-    hits = hybrid_retrieve(query, TOP_K, st.session_state.work_id)
-    msgs = make_prompt(query, hits,
-                       work_id=st.session_state.work_id,
-                       speak_as=st.session_state.speak_as,
-                       history=st.session_state.history)
-    ans = generate(msgs)
+    # 사용자가 기다리는 시간 = 보내기 시점부터 (검색 + 생성)
+    t0 = time.perf_counter()
+    work_id, speak_as, history = st.session_state.work_id, st.session_state.speak_as, st.session_state.history
+    bubble, parts, ttft = None, [], None
+
+    def show(delta):
+        global bubble, ttft
+        if bubble is None:
+            st.markdown(f'<div class="user-message">{query}</div>', unsafe_allow_html=True)
+            bubble = st.empty()
+        if ttft is None:
+            ttft = time.perf_counter() - t0
+        parts.append(delta)
+        bubble.markdown(f'<div class="bot-message">{"".join(parts)}▌</div>', unsafe_allow_html=True)
+
+    if pipe is None:
+        try:
+            ans, timing = remote_chat(query, work_id, speak_as, on_delta=show if STREAM_OUTPUT else None)
+        except (httpx.HTTPError, RuntimeError, ValueError) as e:
+            st.error(f"채팅 서버 오류: {e}")
+            st.stop()
+        # 표시는 사용자가 기다린 시간 기준 (서버 측 시간 + 네트워크)
+        timing["total"] = time.perf_counter() - t0
+        timing["ttft"] = ttft if ttft is not None else timing["total"]
+    else:
+        turn = pipe.prepare(query, work_id, speak_as, history, st.session_state.memory)
+        try:
+            if turn.cached:
+                ans = turn.cached["answer"]
+            elif STREAM_OUTPUT:
+                for delta in pipe.stream(turn):
+                    show(delta)
+                ans = "".join(parts).strip()
+            else:
+                ans = pipe.answer(turn)
+            timing = pipe.complete(turn, ans)
+        finally:
+            turn.trace.abort()   # complete()까지 갔으면 아무 일도 안 함
 
     st.session_state.history.append({"role": "user", "content": query})
-    st.session_state.history.append({"role": "assistant", "content": ans})
+    st.session_state.history.append({"role": "assistant", "content": ans, "timing": timing})
 
     st.rerun()
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
@@ -0,0 +1,313 @@
+import os, sys, json, time, shutil, argparse, tempfile, subprocess
+from typing import Any, Dict, List
+
+# 오프라인 검색 벤치마크 + 품질 회귀 체크 (OpenAI 호출 없음)
+#   python benchmark.py                              → bench/results/bench_<stamp>.json
+#   python benchmark.py --compare bench/results/bench_<이전>.json --fail-on-regression
+# 임베딩은 fake_openai.LocalOpenAI(글자 bigram 해싱)로 대체 → 절대 품질이 아니라 커밋 간 비교용 수치
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+QUESTIONS = os.path.join(BENCH_DIR, "bench", "questions.jsonl")
+RESULTS_DIR = os.path.join(BENCH_DIR, "bench", "results")
+STAGES = ["embed", "bm25", "vector", "dense_wait", "fetch", "rerank", "total"]
+
+def percentile(xs: List[float], q: float) -> float:
+    if not xs:
+        return 0.0
+    xs = sorted(xs)
+    pos = (len(xs) - 1) * q / 100.0
+    lo = int(pos)
+    hi = min(lo + 1, len(xs) - 1)
+    return xs[lo] + (xs[hi] - xs[lo]) * (pos - lo)
+
+def summarize(xs: List[float]) -> Dict[str, float]:
+    # 초 → ms
+    return {"p50_ms": percentile(xs, 50) * 1000, "p95_ms": percentile(xs, 95) * 1000,
+            "mean_ms": (sum(xs) / len(xs) * 1000) if xs else 0.0, "n": len(xs)}
+
+def dir_size_mb(path: str) -> float:
+    total = 0
+    for root, _, files in os.walk(path):
+        for f in files:
+            total += os.path.getsize(os.path.join(root, f))
+    return total / (1024 * 1024)
+
+def git_rev() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=BENCH_DIR,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except Exception:
+        return ""
+
+def load_questions(path: str) -> List[dict]:
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def is_relevant(text: str, answers: List[str]) -> bool:
+    # 정답 문자열 중 하나라도 포함한 청크 = 관련 문서 (청크 경계가 바뀌어도 라벨은 유지됨)
+    return any(a in text for a in answers)
+
+def build_index(workdir: str, client, backend: str = "chroma", tokenizer: str = "regex") -> Dict[str, Any]:
+    # chunking → 임베딩 → 벡터 저장소(Chroma 또는 로컬) 적재 → BM25, 실제 파이프라인 코드를 그대로 사용
+    import chunking, DB_MAKING
+    from bm25_index import BM25Index
+    from vector_store import LocalVectorStore
+
+    stats: Dict[str, Any] = {}
+    t = time.perf_counter()
+    chunks = chunking.load_all_chunks()
+    stats["chunk_s"] = time.perf_counter() - t
+    if not chunks:
+        raise SystemExit(f"[ERROR] {chunking.DATA_DIR}에서 로드된 문서가 없습니다.")
+    stats["dedup_s"] = 0.0
+    if chunking.DEDUP:
+        t = time.perf_counter()
+        chunks, rep = chunking.dedup_chunks(chunks, threshold=chunking.DEDUP_THRESHOLD)
+        stats["dedup_s"] = time.perf_counter() - t
+        stats["dedup"] = rep
+
+    t = time.perf_counter()
+    texts = [c.text for c in chunks]
+    vecs: List[List[float]] = [None] * len(texts)
+    for b in chunking.make_batches(texts):
+        resp = client.embeddings.create(model=chunking.EMB_MODEL, input=[texts[i] for i in b])
+        for i, d in zip(b, sorted(resp.data, key=lambda d: d.index)):
+            vecs[i] = d.embedding
+    stats["embed_s"] = time.perf_counter() - t
+
+    chunks_path = os.path.join(workdir, "chunks.jsonl")
+    with open(chunks_path, "w", encoding="utf-8") as f:
+        for c in chunks:
+            f.write(json.dumps({"id": c.id, "text": c.text, "metadata": c.metadata}, ensure_ascii=False) + "\n")
+    embs_path = chunking.save_embeddings_npy(os.path.join(workdir, "embeddings"), [c.id for c in chunks], vecs)
+
+    t = time.perf_counter()
+    records = DB_MAKING.iter_records(chunks_path, embs_path, stream=False)
+    if backend == "local":
+        vec_dir = os.path.join(workdir, "vec")
+        up = LocalVectorStore.build(vec_dir, records, collection="bench")
+        col = LocalVectorStore.open(vec_dir)
+    else:
+        import chromadb
+        vec_dir = os.path.join(workdir, "chroma")
+        col = chromadb.PersistentClient(path=vec_dir).get_or_create_collection(
+            name="bench", metadata={"hnsw:space": "cosine"}, embedding_function=None)
+        up = DB_MAKING.upsert_records(col, records)
+    stats["upsert_s"] = time.perf_counter() - t
+
+    t = time.perf_counter()
+    bm25 = BM25Index.build_from_collection(col, tokenizer=tokenizer)
+    bm25_dir = bm25.save(os.path.join(workdir, "bm25"))
+    stats["bm25_s"] = time.perf_counter() - t
+
+    stats["build_s"] = stats["chunk_s"] + stats["dedup_s"] + stats["embed_s"] + stats["upsert_s"] + stats["bm25_s"]
+    stats["n_chunks"] = len(chunks)
+    stats["n_docs"] = up["total"]
+    stats["n_terms"] = len(bm25.vocab)
+    stats["backend"] = backend
+    stats["vector_mb"] = dir_size_mb(vec_dir)
+    stats["bm25_mb"] = dir_size_mb(bm25_dir)
+    stats["rss_after_build_mb"] = DB_MAKING.peak_rss_mb()
+    return {"col": col, "bm25": bm25, "stats": stats}
+
+def run_queries(retriever, questions: List[dict], top_k: int, repeat: int) -> Dict[str, Any]:
+    stage_times: Dict[str, List[float]] = {s: [] for s in STAGES}
+    degraded = 0
+    ranked: List[List[tuple]] = []
+    cards, chars = [], []
+    for r in range(repeat):
+        for q in questions:
+            timings: Dict[str, Any] = {}
+            hits = retriever.retrieve(q["query"], top_k, work_id=q.get("work_id"), timings=timings)
+            for s in STAGES:
+                if s in timings:
+                    stage_times[s].append(timings[s])
+            degraded += 1 if timings.get("degraded") else 0
+            if r == 0:
+                ranked.append(hits)
+                cards.append(len(hits))
+                chars.append(sum(len(txt) for _, txt, _ in hits))
+
+    # BM25 단독 순위(토크나이저 효과를 융합/재정렬과 분리해서 보기 위함)
+    lexical: List[List[tuple]] = []
+    for q in questions:
+        ids = retriever._bm25_ids(q["query"], top_k, q.get("work_id"))
+        docs = retriever.fetch_docs(ids)
+        lexical.append([(did, docs[did][0], docs[did][1]) for did in ids if did in docs])
+
+    # 같은 질의 묶음을 retrieve_batch 한 번으로
+    batch_total = []
+    for _ in range(repeat):
+        timings = {}
+        retriever.retrieve_batch([q["query"] for q in questions], top_k, [q.get("work_id") for q in questions],
+                                 timings=timings)
+        batch_total.append(timings.get("total", 0.0))
+
+    return {
+        "latency": {s: summarize(v) for s, v in stage_times.items() if v},
+        "batch": {**summarize(batch_total), "per_query_ms": summarize(batch_total)["p50_ms"] / max(1, len(questions))},
+        "degraded": degraded,
+        # 프롬프트에 들어갈 카드 수/글자 수 (하한 컷 효과 확인용)
+        "cards": {"mean": sum(cards) / max(1, len(cards)), "chars_mean": sum(chars) / max(1, len(chars))},
+        "ranked": ranked,
+        "lexical": lexical,
+    }
+
+def score(questions: List[dict], ranked: List[List[tuple]], ks: List[int]) -> Dict[str, Any]:
+    per_q, groups = [], {}
+    for q, hits in zip(questions, ranked):
+        rank = next((i for i, (_, txt, _) in enumerate(hits, start=1) if is_relevant(txt, q["answers"])), None)
+        per_q.append({"work_id": q.get("work_id"), "query": q["query"], "rank": rank,
+                      "top_ids": [did for did, _, _ in hits]})
+        groups.setdefault(q.get("work_id") or "*", []).append(rank)
+    groups["overall"] = [p["rank"] for p in per_q]
+
+    def metrics(ranks):
+        # recall@k: 관련 청크가 top-k 안에 하나라도 있는 질문 비율 / MRR: 첫 관련 청크 순위의 역수 평균
+        out = {f"recall@{k}": sum(1 for r in ranks if r and r <= k) / len(ranks) for k in ks}
+        out["mrr"] = sum(1.0 / r for r in ranks if r) / len(ranks)
+        out["n"] = len(ranks)
+        return out
+
+    return {"by_work": {w: metrics(r) for w, r in groups.items()}, "questions": per_q}
+
+def compare(cur: Dict[str, Any], prev: Dict[str, Any], recall_tol: float, latency_tol: float) -> List[str]:
+    # 품질은 절대 차이, 지연은 p95 상대 증가율로 판단
+    problems = []
+    for w, m in cur["quality"]["by_work"].items():
+        pm = prev.get("quality", {}).get("by_work", {}).get(w)
+        if not pm:
+            continue
+        for key, v in m.items():
+            if key == "n" or key not in pm:
+                continue
+            d = v - pm[key]
+            flag = d < -recall_tol
+            print(f"[CMP] {w:<18} {key:<9} {pm[key]:.3f} → {v:.3f} ({d:+.3f}){'  ← REGRESSION' if flag else ''}")
+            if flag:
+                problems.append(f"{w} {key} {pm[key]:.3f} → {v:.3f}")
+    for s, m in cur["latency"].items():
+        pm = prev.get("latency", {}).get(s)
+        if not pm or not pm.get("p95_ms"):
+            continue
+        ratio = m["p95_ms"] / pm["p95_ms"] - 1.0
+        flag = s == "total" and ratio > latency_tol
+        print(f"[CMP] latency {s:<10} p95 {pm['p95_ms']:.2f} → {m['p95_ms']:.2f} ms ({ratio:+.0%})"
+              f"{'  ← REGRESSION' if flag else ''}")
+        if flag:
+            problems.append(f"total p95 {pm['p95_ms']:.2f} → {m['p95_ms']:.2f} ms")
+    return problems
+
+def main():
+    ap = argparse.ArgumentParser(description="오프라인 검색 벤치마크 / 품질 회귀 체크")
+    ap.add_argument("--data-dir", default=os.getenv("DATA_DIR", "rag/.data"))
+    ap.add_argument("--questions", default=QUESTIONS)
+    ap.add_argument("--top-k", type=int, default=6)
+    ap.add_argument("--ks", default="1,3,6", help="recall@k 목록")
+    ap.add_argument("--repeat", type=int, default=5, help="질문 세트 반복 횟수(지연 분포용)")
+    ap.add_argument("--dim", type=int, default=1536, help="대역 임베딩 차원")
+    ap.add_argument("--emb-latency-ms", type=float, default=0.0, help="임베딩 호출당 인위 지연(네트워크 흉내)")
+    ap.add_argument("--max-chars", type=int, default=None)
+    ap.add_argument("--overlap", type=int, default=None)
+    ap.add_argument("--no-dedup", action="store_true", help="중복 제거 없이 색인(기준선 비교용)")
+    ap.add_argument("--tokenizer", default=None, help="BM25 토크나이저: regex | josa | bigram (기본: BM25_TOKENIZER)")
+    ap.add_argument("--backend", default=os.getenv("VECTOR_BACKEND", "chroma"), choices=["chroma", "local"],
+                    help="벡터 저장소: chroma(HNSW) | local(int8 + mmap 재채점)")
+    ap.add_argument("--rerank", default=None, help="none | score | mmr (기본: RERANK 환경변수)")
+    ap.add_argument("--min-score", type=float, default=None, help="재정렬 결합 점수 하한")
+    ap.add_argument("--mmr-lambda", type=float, default=None)
+    ap.add_argument("--out", default="", help="결과 JSON 경로 (기본 bench/results/bench_<stamp>.json)")
+    ap.add_argument("--compare", default="", help="이전 결과 JSON과 비교")
+    ap.add_argument("--recall-tol", type=float, default=0.0, help="허용하는 recall/MRR 하락폭")
+    ap.add_argument("--latency-tol", type=float, default=0.5, help="허용하는 total p95 증가율")
+    ap.add_argument("--fail-on-regression", action="store_true")
+    ap.add_argument("--keep", action="store_true", help="임시 인덱스 디렉터리를 지우지 않음")
+    args = ap.parse_args()
+
+    # chunking/DB_MAKING은 import 시점에 환경변수를 읽으므로 먼저 설정
+    os.environ["DATA_DIR"] = args.data_dir
+    if args.max_chars is not None:
+        os.environ["MAX_CHARS"] = str(args.max_chars)
+    if args.overlap is not None:
+        os.environ["OVERLAP"] = str(args.overlap)
+    if args.no_dedup:
+        os.environ["DEDUP"] = "0"
+    os.environ.setdefault("OPENAI_API_KEY", "offline")
+
+    from fake_openai import LocalOpenAI
+    from query_cache import QueryEmbedder
+    from retriever import Retriever, EMB_MODEL
+    import rerank
+    from ko_tokenizer import BM25_TOKENIZER
+    import chunking, DB_MAKING
+
+    questions = load_questions(args.questions)
+    ks = [int(k) for k in args.ks.split(",") if k.strip()]
+    client = LocalOpenAI(dim=args.dim, latency_ms=args.emb_latency_ms)
+    workdir = tempfile.mkdtemp(prefix="bench_")
+    try:
+        built = build_index(workdir, client, args.backend, args.tokenizer or BM25_TOKENIZER)
+        b = built["stats"]
+        print(f"[BUILD] chunks = {b['n_chunks']}, terms = {b['n_terms']} ({built['bm25'].tokenizer}), {b['build_s']:.2f}s "
+              f"(chunk {b['chunk_s']:.2f} / dedup {b['dedup_s']:.2f} / embed {b['embed_s']:.2f} / upsert {b['upsert_s']:.2f} / bm25 {b['bm25_s']:.2f})")
+
+        # 질의 임베딩 캐시는 끔(maxsize=0) → 매 질의가 임베딩 단계를 실제로 거침
+        embedder = QueryEmbedder(client, EMB_MODEL, maxsize=0)
+        rr = rerank.Reranker(mode=args.rerank or rerank.RERANK,
+                             lam=rerank.RERANK_LAMBDA if args.mmr_lambda is None else args.mmr_lambda,
+                             min_score=rerank.RERANK_MIN_SCORE if args.min_score is None else args.min_score)
+        retriever = Retriever(built["col"], built["bm25"], embedder, reranker=rr)
+        ran = run_queries(retriever, questions, args.top_k, args.repeat)
+        quality = score(questions, ran["ranked"], ks)
+        quality["bm25_only"] = score(questions, ran["lexical"], ks)["by_work"]["overall"]
+
+        result = {
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "git": git_rev(),
+            "config": {"data_dir": args.data_dir, "questions": os.path.relpath(args.questions, BENCH_DIR),
+                       "n_questions": len(questions), "top_k": args.top_k, "repeat": args.repeat, "dim": args.dim,
+                       "emb_latency_ms": args.emb_latency_ms, "backend": args.backend,
+                       "tokenizer": built["bm25"].tokenizer, "max_chars": chunking.MAX_CHARS,
+                       "overlap": chunking.OVERLAP, "dedup": chunking.DEDUP,
+                       "dedup_threshold": chunking.DEDUP_THRESHOLD, "rerank": rr.mode, "mmr_lambda": rr.lam,
+                       "min_score": rr.min_score, "rerank_weights": rr.weights},
+            "build": b,
+            "latency": ran["latency"],
+            "batch": ran["batch"],
+            "degraded": ran["degraded"],
+            "cards": ran["cards"],
+            "peak_rss_mb": DB_MAKING.peak_rss_mb(),
+            "quality": quality,
+        }
+    finally:
+        if args.keep:
+            print(f"[KEEP] {workdir}")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    for s, m in result["latency"].items():
+        print(f"[LAT] {s:<10} p50 {m['p50_ms']:7.2f} ms   p95 {m['p95_ms']:7.2f} ms")
+    print(f"[LAT] batch      p50 {result['batch']['p50_ms']:7.2f} ms ({result['batch']['per_query_ms']:.2f} ms/query)")
+    print(f"[CARDS] {result['cards']['mean']:.2f} cards/query, {result['cards']['chars_mean']:.0f} chars/query")
+    for w, m in quality["by_work"].items():
+        print(f"[QUAL] {w:<18} " + "  ".join(f"{k} {v:.3f}" for k, v in m.items() if k != "n") + f"  (n={m['n']})")
+    m = quality["bm25_only"]
+    print(f"[QUAL] {'bm25 only':<18} " + "  ".join(f"{k} {v:.3f}" for k, v in m.items() if k != "n") + f"  (n={m['n']})")
+    print(f"[MEM] peak RSS = {result['peak_rss_mb']:.1f} MB, {b['backend']} = {b['vector_mb']:.1f} MB, bm25 = {b['bm25_mb']:.1f} MB")
+
+    out = args.out or os.path.join(RESULTS_DIR, f"bench_{time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+    print(f"[SAVE] {out}")
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            problems = compare(result, json.load(f), args.recall_tol, args.latency_tol)
+        if problems:
+            print("[REGRESSION] " + "; ".join(problems))
+            if args.fail_on_regression:
+                sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,336 @@
+import os, json, time, shutil, hashlib, tempfile
+from typing import List, Dict, Any, Iterable, Optional, Tuple
+import numpy as np
+
+from ko_tokenizer import BM25_TOKENIZER, get_tokenizer, tokenize_regex
+
+INDEX_VERSION = 1
+
+BM25_DIR = os.getenv("BM25_DIR", "rag/.bm25").replace("\\","/")
+K1, B, EPSILON = 1.5, 0.75, 0.25   # rank_bm25.BM25Okapi 기본값과 동일
+
+def tokenize(text: str):
+    # 영문/숫자/한글만 추출 → 소문자 → 토큰 리스트 (재정렬/페르소나/프롬프트의 질의어 커버리지용.
+    # BM25 점수용 토큰화는 인덱스마다 기록된 토크나이저(BM25Index.tokenize)를 씀)
+    return tokenize_regex(text)
+
+def fingerprint(pairs: Iterable[Tuple[str, str]]) -> str:
+    # (id, content_hash) 목록 → 컬렉션 버전 식별자 (순서 무관)
+    h = hashlib.sha1()
+    for _id, ch in sorted(pairs):
+        h.update(_id.encode("utf-8")); h.update(b"\x1f")
+        h.update((ch or "").encode("utf-8")); h.update(b"\x1e")
+    return h.hexdigest()
+
+def iter_collection(col, include: List[str], page: int = 1000):
+    offset = 0
+    while True:
+        res = col.get(include=include, limit=page, offset=offset)
+        ids = res.get("ids") or []
+        docs = res.get("documents") or [None] * len(ids)
+        metas = res.get("metadatas") or [None] * len(ids)
+        for row in zip(ids, docs, metas):
+            yield row
+        if len(ids) < page:
+            return
+        offset += page
+
+def collection_fingerprint(col) -> Tuple[int, str]:
+    pairs = [(i, (m or {}).get("content_hash", "")) for i, _, m in iter_collection(col, ["metadatas"])]
+    return len(pairs), fingerprint(pairs)
+
+def collection_stamp(col) -> Optional[Tuple[int, str]]:
+    # DB_MAKING이 적재 직후 컬렉션 메타데이터에 남긴 (문서 수, 지문) → 시작 시 O(1) 비교. 없으면 None
+    meta = getattr(col, "metadata", None) or {}
+    if "content_fingerprint" not in meta:
+        return None
+    return int(meta.get("content_count", -1)), meta["content_fingerprint"]
+
+def stamp_collection(col) -> Tuple[int, str]:
+    # 적재 후 한 번 전체 메타데이터를 읽어 지문을 계산하고 컬렉션 메타데이터에 기록
+    count, fp = collection_fingerprint(col)
+    meta = {**(col.metadata or {}), "content_count": count, "content_fingerprint": fp}
+    try:
+        col.modify(metadata=meta)
+    except Exception:
+        # 최근 Chroma는 hnsw:* 설정을 configuration에 따로 두고, 메타데이터로 다시 넘기면 거부함
+        col.modify(metadata={k: v for k, v in meta.items() if not k.startswith("hnsw:")})
+    return count, fp
+
+class BM25Index:
+    # 디스크 역색인: 용어별 postings(doc, tf) + 문서 길이. 점수는 BM25Okapi와 동일.
+    # docs[i] = (id, work_id, kind, character, kinds, content_hash) — 필터/페르소나 조회용 최소 메타만 보관
+    #   kinds: 중복 제거로 흡수한 kind까지 포함한 쉼표 목록(이전 인덱스에는 없음 → kind로 대체)
+    #   content_hash: 재생성 시 바뀌지 않은 문서의 토큰(용어 빈도)을 이 인덱스에서 재사용하기 위한 키
+
+    def __init__(self, vocab: List[str], idf: np.ndarray, indptr: np.ndarray, post_doc: np.ndarray,
+                 post_tf: np.ndarray, doc_len: np.ndarray, docs: List[List[str]], manifest: Dict[str, Any]):
+        self.vocab = vocab
+        self.term_index = {t: i for i, t in enumerate(vocab)}
+        self.idf, self.indptr = idf, indptr
+        self.post_doc, self.post_tf = post_doc, post_tf
+        self.doc_len = doc_len
+        self.docs = docs
+        self.ids = [d[0] for d in docs]
+        self.manifest = manifest
+        self.k1 = manifest.get("k1", K1)
+        self.b = manifest.get("b", B)
+        self.avgdl = manifest.get("avgdl", float(doc_len.mean()) if len(doc_len) else 0.0)
+        # 질의는 색인할 때와 같은 토크나이저로
+        self.tokenizer = manifest.get("tokenizer", "regex")
+        self.tokenize = get_tokenizer(self.tokenizer)
+        # work_id/kind 필터를 점수 계산 안에서 적용하기 위한 문서별 코드 배열 / kind 집합
+        self.work_names = sorted({d[1] for d in docs})
+        wi = {w: i for i, w in enumerate(self.work_names)}
+        self.work_code = np.fromiter((wi[d[1]] for d in docs), dtype=np.int32, count=len(docs))
+        self.doc_kinds = [frozenset(((d[4] if len(d) > 4 else "") or d[2]).split(",")) for d in docs]
+        self.kind_names = sorted(set().union(*self.doc_kinds)) if docs else []
+
+    def __len__(self):
+        return len(self.docs)
+
+    def token_bags(self) -> Dict[Tuple[str, str], Dict[str, int]]:
+        # 저장된 postings를 문서 방향으로 뒤집어 (id, content_hash) → {용어: 빈도}. BM25에는 순서가 필요 없으므로
+        # 이것이 곧 캐시된 토큰 스트림 (content_hash가 없는 이전 인덱스는 재사용 불가)
+        if not len(self.docs) or len(self.docs[0]) < 6:
+            return {}
+        terms = np.repeat(np.arange(len(self.vocab)), np.diff(np.asarray(self.indptr)))
+        post_doc = np.asarray(self.post_doc)
+        order = np.argsort(post_doc, kind="stable")
+        bounds = np.searchsorted(post_doc[order], np.arange(len(self.docs) + 1))
+        post_tf = np.asarray(self.post_tf)
+        bags = {}
+        for d, row in enumerate(self.docs):
+            if not row[5]:
+                continue
+            sel = order[bounds[d]:bounds[d + 1]]
+            bags[(row[0], row[5])] = {self.vocab[t]: int(c) for t, c in zip(terms[sel], post_tf[sel])}
+        return bags
+
+    @classmethod
+    def build(cls, rows: Iterable[Tuple[str, str, dict]], collection: str = "", tokenizer: str = BM25_TOKENIZER,
+              cache: Optional["BM25Index"] = None) -> "BM25Index":
+        # cache: 같은 토크나이저로 만든 이전 인덱스 → content_hash가 같은 문서는 다시 토큰화하지 않음
+        tok = get_tokenizer(tokenizer)
+        bags = cache.token_bags() if cache is not None and cache.tokenizer == tokenizer else {}
+        docs, lens, pairs = [], [], []
+        term_index: Dict[str, int] = {}
+        post: List[List[Tuple[int, int]]] = []
+        reused = 0
+        for _id, text, meta in rows:
+            meta = meta or {}
+            ch = meta.get("content_hash", "")
+            pairs.append((_id, ch))
+            if not isinstance(text, str) or not text.strip():
+                continue
+            tf = bags.get((_id, ch)) if ch else None
+            if tf is not None:
+                reused += 1
+            else:
+                tf = {}
+                for t in tok(text):
+                    tf[t] = tf.get(t, 0) + 1
+            if not tf:
+                continue
+            d = len(docs)
+            docs.append([_id, meta.get("work_id", ""), meta.get("kind", ""), meta.get("character", "") or "",
+                         meta.get("kinds", "") or meta.get("kind", ""), ch])
+            lens.append(sum(tf.values()))
+            for t, c in tf.items():
+                ti = term_index.get(t)
+                if ti is None:
+                    ti = term_index[t] = len(post)
+                    post.append([])
+                post[ti].append((d, c))
+
+        n = len(docs)
+        vocab = list(term_index)
+        df = np.array([len(p) for p in post], dtype=np.float64)
+        idf = np.log(n - df + 0.5) - np.log(df + 0.5) if n else np.zeros(0)
+        if len(idf):
+            idf[idf < 0] = EPSILON * (idf.sum() / len(idf))
+        indptr = np.zeros(len(post) + 1, dtype=np.int64)
+        indptr[1:] = np.cumsum(df.astype(np.int64))
+        post_doc = np.fromiter((d for p in post for d, _ in p), dtype=np.int32, count=int(indptr[-1]))
+        post_tf = np.fromiter((c for p in post for _, c in p), dtype=np.float32, count=int(indptr[-1]))
+        doc_len = np.asarray(lens, dtype=np.float32)
+        manifest = {
+            "version": INDEX_VERSION, "collection": collection, "tokenizer": tokenizer, "reused_docs": reused,
+            "count": len(pairs), "fingerprint": fingerprint(pairs),
+            "n_docs": n, "n_terms": len(vocab), "avgdl": sum(lens) / n if n else 0.0,
+            "k1": K1, "b": B, "epsilon": EPSILON, "built_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+        }
+        return cls(vocab, idf, indptr, post_doc, post_tf, doc_len, docs, manifest)
+
+    @classmethod
+    def build_from_collection(cls, col, tokenizer: str = BM25_TOKENIZER,
+                              cache: Optional["BM25Index"] = None) -> "BM25Index":
+        return cls.build(iter_collection(col, ["documents", "metadatas"]), collection=col.name,
+                         tokenizer=tokenizer, cache=cache)
+
+    def save(self, path: str) -> str:
+        # 같은 디렉터리에 고유한 임시 디렉터리 → 여러 프로세스가 동시에 만들어도 서로의 파일을 덮지 않음
+        path = path.rstrip("/")
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp = tempfile.mkdtemp(prefix=os.path.basename(path) + ".", suffix=".tmp", dir=os.path.dirname(path) or ".")
+        try:
+            self._write(tmp)
+            for attempt in range(3):
+                # 교체 직전에 다른 프로세스가 먼저 자리를 채우면 os.replace가 실패 → 지우고 다시
+                shutil.rmtree(path, ignore_errors=True)
+                try:
+                    os.replace(tmp, path)
+                    break
+                except OSError:
+                    if attempt == 2:
+                        raise
+        except BaseException:
+            shutil.rmtree(tmp, ignore_errors=True)
+            raise
+        return path
+
+    def _write(self, tmp: str) -> None:
+        np.save(os.path.join(tmp, "idf.npy"), self.idf)
+        np.save(os.path.join(tmp, "indptr.npy"), self.indptr)
+        np.save(os.path.join(tmp, "post_doc.npy"), self.post_doc)
+        np.save(os.path.join(tmp, "post_tf.npy"), self.post_tf)
+        np.save(os.path.join(tmp, "doc_len.npy"), self.doc_len)
+        with open(os.path.join(tmp, "vocab.json"), "w", encoding="utf-8") as f:
+            json.dump(self.vocab, f, ensure_ascii=False)
+        with open(os.path.join(tmp, "docs.json"), "w", encoding="utf-8") as f:
+            json.dump(self.docs, f, ensure_ascii=False)
+        with open(os.path.join(tmp, "manifest.json"), "w", encoding="utf-8") as f:
+            json.dump(self.manifest, f, ensure_ascii=False, indent=2)
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True) -> Optional["BM25Index"]:
+        mf = os.path.join(path, "manifest.json")
+        if not os.path.exists(mf):
+            return None
+        with open(mf, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        if manifest.get("version") != INDEX_VERSION:
+            return None
+        mode = "r" if mmap else None
+        arr = lambda name: np.load(os.path.join(path, name), mmap_mode=mode)
+        with open(os.path.join(path, "vocab.json"), "r", encoding="utf-8") as f:
+            vocab = json.load(f)
+        with open(os.path.join(path, "docs.json"), "r", encoding="utf-8") as f:
+            docs = json.load(f)
+        return cls(vocab, arr("idf.npy"), arr("indptr.npy"), arr("post_doc.npy"),
+                   arr("post_tf.npy"), arr("doc_len.npy"), docs, manifest)
+
+    def is_stale(self, col, verify: bool = True, tokenizer: Optional[str] = None) -> bool:
+        # 기본: id/content_hash 지문 비교 → 개수가 같은 SYNC 수정/교체도 감지.
+        #   지문은 DB_MAKING이 남긴 컬렉션 스탬프(O(1))를 쓰고, 스탬프가 없거나 문서 수가 어긋나면
+        #   (DB_MAKING 밖에서 바뀐 컬렉션) 메타데이터 전체를 읽어 계산
+        # verify=False면 count만 비교. 토크나이저가 다르면 항상 재생성
+        if self.manifest.get("collection") not in ("", col.name):
+            return True
+        if tokenizer is not None and tokenizer != self.tokenizer:
+            return True
+        if verify:
+            stamp = collection_stamp(col)
+            count, fp = stamp if stamp is not None and stamp[0] == col.count() else collection_fingerprint(col)
+            return count != self.manifest.get("count") or fp != self.manifest.get("fingerprint")
+        return col.count() != self.manifest.get("count")
+
+    def _term_contrib(self, t: int) -> Tuple[np.ndarray, np.ndarray]:
+        # 용어 t의 postings → (문서 번호, BM25 기여도)
+        lo, hi = int(self.indptr[t]), int(self.indptr[t + 1])
+        d = self.post_doc[lo:hi]
+        tf = self.post_tf[lo:hi].astype(np.float64)
+        norm = self.k1 * (1 - self.b + self.b * self.doc_len[d].astype(np.float64) / self.avgdl)
+        return d, self.idf[t] * (tf * (self.k1 + 1) / (tf + norm))
+
+    def get_scores(self, toks: List[str]) -> np.ndarray:
+        scores = np.zeros(len(self.docs))
+        for q in toks:
+            t = self.term_index.get(q)
+            if t is None:
+                continue
+            d, c = self._term_contrib(t)
+            scores[d] += c
+        return scores
+
+    def search(self, toks: List[str], k: int, work_id: Optional[str] = None,
+               kinds: Optional[Iterable[str]] = None) -> List[Tuple[int, float]]:
+        # 질의어를 포함한 문서의 postings만 순회 → 비용은 말뭉치 크기가 아니라 질의어 df에 비례.
+        # 점수는 get_scores와 같고(중복 질의어도 동일하게 누적), 필터는 top-k 선택 전에 적용.
+        return self.search_batch([toks], k, [work_id], kinds=kinds)[0]
+
+    def search_batch(self, toks_list: List[List[str]], k: int, work_ids: Optional[List[Optional[str]]] = None,
+                     kinds: Optional[Iterable[str]] = None) -> List[List[Tuple[int, float]]]:
+        # 여러 질의를 한 번에: 용어별 기여도 배열은 배치 안에서 한 번만 계산해 공유
+        work_ids = work_ids or [None] * len(toks_list)
+        kind_mask = None
+        if kinds:
+            kinds = set(kinds)
+            kind_mask = np.fromiter((bool(ks & kinds) for ks in self.doc_kinds), dtype=bool, count=len(self.docs))
+        contrib_cache: Dict[int, Tuple[np.ndarray, np.ndarray]] = {}
+        out = []
+        for toks, work_id in zip(toks_list, work_ids):
+            terms = [self.term_index[q] for q in toks if q in self.term_index]
+            if not terms or k <= 0 or (work_id and work_id not in self.work_names):
+                out.append([])
+                continue
+            for t in terms:
+                if t not in contrib_cache:
+                    contrib_cache[t] = self._term_contrib(t)
+            docs = np.concatenate([contrib_cache[t][0] for t in terms])
+            contrib = np.concatenate([contrib_cache[t][1] for t in terms])
+            out.append(self._top_k(docs, contrib, k, work_id, kind_mask))
+        return out
+
+    def _top_k(self, docs: np.ndarray, contrib: np.ndarray, k: int, work_id: Optional[str],
+               kind_mask: Optional[np.ndarray]) -> List[Tuple[int, float]]:
+        mask = np.ones(len(docs), dtype=bool)
+        if work_id:
+            mask &= self.work_code[docs] == self.work_names.index(work_id)
+        if kind_mask is not None:
+            mask &= kind_mask[docs]
+        if not mask.all():
+            docs, contrib = docs[mask], contrib[mask]
+        if not len(docs):
+            return []
+
+        uniq, inv = np.unique(docs, return_inverse=True)
+        scores = np.bincount(inv, weights=contrib, minlength=len(uniq))
+        if len(uniq) > k:
+            top = np.argpartition(-scores, k - 1)[:k]
+        else:
+            top = np.arange(len(uniq))
+        top = top[np.lexsort((uniq[top], -scores[top]))]
+        return [(int(uniq[i]), float(scores[i])) for i in top]
+
+def index_path(collection: str, base_dir: str = BM25_DIR) -> str:
+    return os.path.join(base_dir, collection)
+
+def load_or_build(col, base_dir: str = BM25_DIR, verify: bool = True,
+                  tokenizer: str = BM25_TOKENIZER) -> Tuple[BM25Index, str]:
+    path = index_path(col.name, base_dir)
+    old = BM25Index.load(path)
+    if old is not None and not old.is_stale(col, verify=verify, tokenizer=tokenizer):
+        return old, "loaded"
+    idx = BM25Index.build_from_collection(col, tokenizer=tokenizer, cache=old)
+    status = (f"rebuilt(stale, reused {idx.manifest['reused_docs']}/{len(idx)})" if old is not None
+              else "rebuilt(missing)")
+    try:
+        idx.save(path)
+    except OSError as e:
+        print("[BM25] 인덱스 저장 실패:", e)
+    return idx, status
+
+if __name__ == "__main__":
+    # 별도 단계로 실행: python bm25_index.py  (Chroma 컬렉션 → 디스크 BM25 인덱스)
+    from dotenv import load_dotenv
+    load_dotenv()
+    import chromadb
+    persist_dir = os.getenv("PERSIST_DIR", "rag/.chroma").replace("\\","/")
+    collection = os.getenv("COLLECTION", "library-all")
+    col = chromadb.PersistentClient(path=persist_dir).get_or_create_collection(name=collection, embedding_function=None)
+    t0 = time.perf_counter()
+    idx = BM25Index.build_from_collection(col, cache=BM25Index.load(index_path(collection)))
+    path = idx.save(index_path(collection))
+    print(f"[BM25] docs = {len(idx)}, terms = {len(idx.vocab)}, tokenizer = {idx.tokenizer}, "
+          f"reused = {idx.manifest['reused_docs']}, {time.perf_counter() - t0:.2f}s → {path}")
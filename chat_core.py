@@ -0,0 +1,278 @@
+import os, time
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional
+from openai import OpenAI, AsyncOpenAI
+
+from persona_index import PersonaIndex
+from retriever import Retriever
+from prompt_builder import RollingMemory, build_messages, count_tokens
+from answer_cache import AnswerCache, ANSWER_CACHE
+from metrics import METRICS_PORT, NULL_TRACE, start_trace, from_env as metrics_from_env
+
+# Streamlit(app.py)과 HTTP 서비스(server.py)가 함께 쓰는 대화 파이프라인. 프로세스당 한 번 open()
+#   prepare()  : 답변 캐시 조회 → 검색 → 프롬프트 조립 (동기: 인덱스/임베딩 캐시 접근)
+#   stream()/astream()/answer() : LLM 생성 (동기/비동기)
+#   complete() : 답변 캐시 저장 + 턴 계측 마무리 → 말풍선에 붙는 timing dict
+BASE_DIR      = os.path.dirname(os.path.abspath(__file__))
+PERSIST_DIR   = os.getenv("PERSIST_DIR") or os.path.join(BASE_DIR, "rag", ".chroma")
+COLLECTION    = os.getenv("COLLECTION", "library-all")
+MODEL         = os.getenv("MODEL", "gpt-4o")
+TOP_K         = int(os.getenv("TOP_K", "6"))
+BM25_DIR      = os.getenv("BM25_DIR") or os.path.join(BASE_DIR, "rag", ".bm25")
+VEC_DIR       = os.getenv("VEC_DIR") or os.path.join(BASE_DIR, "rag", ".vec")   # VECTOR_BACKEND=local일 때
+PERSONA_CHUNKS = int(os.getenv("PERSONA_CHUNKS", "1"))  # 프롬프트에 넣을 페르소나 청크 수(순위 상위부터)
+ANSWER_CACHE_PATH = os.getenv("ANSWER_CACHE_PATH") or os.path.join(BASE_DIR, "rag", ".artifacts", "answer_cache.sqlite3")
+
+WORK_ID_MAP = {
+    "지구 끝의 온실": "jigu-ggut-onshil",
+    "종의 기원": "jong-ui-giwon",
+    "소년이 온다": "so-nyeon-i-onda"
+}
+
+SYSTEM_PROMPT = (
+    "당신은 소설 속 인물의 말투를 재현하는 AI입니다.\n"
+    "컨텍스트를 근거로 사용하세요.\n"
+    "당신이 소설 속 등장인물이라고 생각하세요.\n"
+    "대화할 때는 해당 인물의 말투/가치관을 반영해 2~3문장 이내로 대답하세요.\n"
+    "답할때는 대화하듯이 자연스럽게 얘기해"
+)
+
+def _usage(u, usage):
+    # API가 돌려준 토큰 수 → usage["in"/"out"] (responses / chat.completions 필드명 모두)
+    if u is None or usage is None:
+        return
+    usage["in"] = getattr(u, "input_tokens", None) or getattr(u, "prompt_tokens", None) or 0
+    usage["out"] = getattr(u, "output_tokens", None) or getattr(u, "completion_tokens", None) or 0
+
+class Turn:
+    # 한 턴의 진행 상태. cached가 있으면 검색/생성 없이 complete()로 바로 마무리
+    __slots__ = ("query", "work_id", "speak_as", "history", "t0", "trace", "qvec", "cached",
+                 "msgs", "ptoks", "rtimings", "usage", "ttft")
+
+    def __init__(self, query: str, work_id: Optional[str], speak_as: Optional[str], history: List[Dict[str, Any]], trace):
+        self.query, self.work_id, self.speak_as, self.history = query, work_id, speak_as, history
+        self.t0, self.trace = time.perf_counter(), trace
+        self.qvec = self.cached = self.msgs = self.ptoks = self.ttft = None
+        self.rtimings: Dict[str, Any] = {}
+        self.usage: Dict[str, int] = {}
+
+class ChatPipeline:
+    def __init__(self, retriever: Retriever, personas: PersonaIndex, answers: Optional[AnswerCache] = None,
+                 metrics=None, client: Optional[OpenAI] = None, model: str = MODEL, top_k: int = TOP_K):
+        self.retriever, self.personas, self.answers, self.metrics = retriever, personas, answers, metrics
+        self.client = client or OpenAI()
+        self.model, self.top_k = model, top_k
+        self._aclient: Optional[AsyncOpenAI] = None
+
+    @classmethod
+    def open(cls, client: Optional[OpenAI] = None, serve_metrics: bool = True) -> "ChatPipeline":
+        # 벡터 컬렉션 + 디스크 BM25(mmap) + 질의 임베딩 캐시 + 페르소나 + 답변 캐시를 한 번 로드
+        client = client or OpenAI()
+        retriever = Retriever.open(PERSIST_DIR, COLLECTION, BM25_DIR, client=client, vec_dir=VEC_DIR)
+        personas = PersonaIndex.build_from_collection(retriever.col)
+        answers = AnswerCache(ANSWER_CACHE_PATH) if ANSWER_CACHE else None
+        metrics = metrics_from_env()
+        if metrics is not None:
+            metrics.gauge("qcache_hit_rate", lambda: retriever.embedder.stats()["hit_rate"])
+            if answers is not None:
+                metrics.gauge("answer_cache_items", answers.count)
+                metrics.gauge("answer_cache_hit_rate", lambda: answers.stats()["hit_rate"])
+            if serve_metrics and METRICS_PORT:
+                metrics.serve(METRICS_PORT)
+        return cls(retriever, personas, answers, metrics, client)
+
+    @property
+    def aclient(self) -> AsyncOpenAI:
+        # 비동기 클라이언트는 서버(이벤트 루프 안)에서만 필요 → 처음 쓸 때 생성
+        if self._aclient is None:
+            self._aclient = AsyncOpenAI()
+        return self._aclient
+
+    def make_prompt(self, query, hits, work_id=None, speak_as=None, history=[], memory="", trace=NULL_TRACE):
+        # 반환: (messages, 섹션별 토큰 내역) — PROMPT_BUDGET 안에서 카드/페르소나/대화를 압축
+        persona_block = ""
+        if speak_as and work_id:
+            with trace.stage("persona"):
+                ranked = self.personas.rank(work_id, speak_as, query=query)
+            if ranked:
+                persos = [self.personas.texts[did] for did, _ in ranked[:PERSONA_CHUNKS]]
+                persona_block = f"[인물 페르소나: {speak_as}]\n" + "\n\n".join(persos)
+
+        context_cards = []
+        for _, txt, meta in hits:
+            title = meta.get("scene_title") or meta.get("chapter_label") or meta.get("kind")
+            context_cards.append((title, txt))
+
+        # 기록에는 응답 시간 등 부가 정보가 붙어 있으므로 role/content만 전달됨
+        with trace.stage("prompt"):
+            return build_messages(SYSTEM_PROMPT, query, context_cards, persona=persona_block,
+                                  history=history, memory=memory)
+
+    # ---- 턴 ----
+    def prepare(self, query: str, work_id: Optional[str], speak_as: Optional[str],
+                history: List[Dict[str, Any]], memory: RollingMemory) -> Turn:
+        trace = start_trace(self.metrics, work_id=work_id, speak_as=speak_as or "", model=self.model,
+                            turn=len(history) // 2)
+        try:
+            with trace.profiling():
+                return self._prepare(Turn(query, work_id, speak_as, history, trace), memory)
+        except BaseException:
+            trace.abort()
+            raise
+
+    def _prepare(self, turn: Turn, memory: RollingMemory) -> Turn:
+        query, work_id, speak_as, history, trace = turn.query, turn.work_id, turn.speak_as, turn.history, turn.trace
+        # 검색(BM25와 질의 임베딩을 겹쳐 실행)이 쓴 질의 벡터로 답변 캐시 조회 → 임베딩 요청은 턴당 한 번.
+        # 같은 작품/인물에게 거의 같은 질문(대화 없음 또는 최근 대화 일치)이면 검색 결과는 버리고 저장된 답 반환
+        hits, qvec = self.retriever.retrieve_with_vector(query, self.top_k, work_id, timings=turn.rtimings)
+        if self.answers is not None and qvec is not None:
+            turn.qvec = qvec
+            with trace.stage("answer_cache"):
+                turn.cached = self.answers.lookup(work_id, speak_as or "", self.model, qvec, history)
+            if turn.cached:
+                return turn
+        memory.update(history)
+        turn.msgs, turn.ptoks = self.make_prompt(query, hits, work_id=work_id, speak_as=speak_as,
+                                                 history=history, memory=memory.text, trace=trace)
+        return turn
+
+    def complete(self, turn: Turn, ans: str) -> Dict[str, Any]:
+        try:
+            with turn.trace.profiling():
+                return self._complete(turn, ans)
+        except BaseException:
+            turn.trace.abort()
+            raise
+
+    def _complete(self, turn: Turn, ans: str) -> Dict[str, Any]:
+        total = time.perf_counter() - turn.t0
+        trace = turn.trace
+        if turn.cached:
+            trace.count("answer_cache_hit")
+            trace.finish(cache="hit", similarity=round(turn.cached["similarity"], 4))
+            return {"ttft": total, "total": total, "retrieval": {}, "cache": turn.cached["similarity"]}
+        timing = {"ttft": turn.ttft if turn.ttft is not None else total,
+                  "total": total, "retrieval": turn.rtimings, "prompt": turn.ptoks}
+        if turn.qvec is not None:
+            with trace.stage("answer_cache"):
+                self.answers.put(turn.work_id, turn.speak_as or "", self.model, turn.query, turn.qvec, ans,
+                                 turn.history)
+        if trace.enabled:
+            r = turn.rtimings
+            trace.add_stages(r, "retrieval.")
+            for k, n in r.get("candidates", {}).items():
+                trace.count(f"candidates_{k}", n)
+            if r.get("degraded"):
+                trace.count("retrieval_degraded")
+            if self.answers is not None:
+                trace.count("answer_cache_miss")
+            # API가 토큰 수를 주지 않으면(스트림 등) 프롬프트 예산 계산값/응답 길이로 추정
+            trace.count("tokens_in", turn.usage.get("in") or turn.ptoks["total"])
+            trace.count("tokens_out", turn.usage.get("out") or count_tokens(ans))
+            trace.finish(cache="miss" if self.answers is not None else "off",
+                         ttft_ms=round(timing["ttft"] * 1000, 2),
+                         prompt={k: v for k, v in turn.ptoks.items() if k != "tokenizer"},
+                         degraded=r.get("degraded"))
+        return timing
+
+    # ---- 생성 (동기: Streamlit) ----
+    def generate(self, messages, usage=None):
+        try:
+            resp = self.client.responses.create(model=self.model, input=messages, temperature=0)
+            _usage(getattr(resp, "usage", None), usage)
+            return getattr(resp, "output_text", "").strip()
+        except Exception:
+            comp = self.client.chat.completions.create(model=self.model, messages=messages)
+            _usage(getattr(comp, "usage", None), usage)
+            return comp.choices[0].message.content.strip()
+
+    def generate_stream(self, messages, usage=None) -> Iterator[str]:
+        # responses 스트리밍 → 첫 토큰 전에 실패하면 chat.completions 스트리밍으로 폴백
+        started = False
+        try:
+            stream = self.client.responses.create(model=self.model, input=messages, temperature=0, stream=True)
+            for ev in stream:
+                if ev.type == "response.output_text.delta" and ev.delta:
+                    started = True
+                    yield ev.delta
+                elif ev.type == "response.completed":
+                    _usage(getattr(ev.response, "usage", None), usage)
+                elif ev.type in ("response.failed", "error"):
+                    raise RuntimeError(f"responses stream {ev.type}")
+            return
+        except Exception:
+            if started:
+                raise
+        stream = self.client.chat.completions.create(model=self.model, messages=messages, stream=True,
+                                                     stream_options={"include_usage": True})
+        for chunk in stream:
+            if getattr(chunk, "usage", None):
+                _usage(chunk.usage, usage)
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+
+    # 생성이 실패하거나 중간에 끊기면(GeneratorExit 포함) complete()가 불리지 않음 → trace.abort()로 프로파일러 정리
+    # 동기 생성은 호출한 스레드에서 끝까지 돌므로 프로파일에 포함, 비동기 생성(astream)은 이벤트 루프를
+    # 다른 요청과 나눠 쓰므로 제외
+    def answer(self, turn: Turn) -> str:
+        try:
+            with turn.trace.stage("generate"), turn.trace.profiling():
+                return self.generate(turn.msgs, turn.usage)
+        except BaseException:
+            turn.trace.abort()
+            raise
+
+    def stream(self, turn: Turn) -> Iterator[str]:
+        t = time.perf_counter()
+        try:
+            with turn.trace.profiling():
+                for delta in self.generate_stream(turn.msgs, turn.usage):
+                    if turn.ttft is None:
+                        turn.ttft = time.perf_counter() - turn.t0
+                    yield delta
+        except BaseException:
+            turn.trace.abort()
+            raise
+        finally:
+            turn.trace.add_stage("generate", time.perf_counter() - t)
+
+    # ---- 생성 (비동기: server.py) ----
+    async def agenerate_stream(self, messages, usage=None) -> AsyncIterator[str]:
+        started = False
+        try:
+            stream = await self.aclient.responses.create(model=self.model, input=messages, temperature=0, stream=True)
+            async for ev in stream:
+                if ev.type == "response.output_text.delta" and ev.delta:
+                    started = True
+                    yield ev.delta
+                elif ev.type == "response.completed":
+                    _usage(getattr(ev.response, "usage", None), usage)
+                elif ev.type in ("response.failed", "error"):
+                    raise RuntimeError(f"responses stream {ev.type}")
+            return
+        except Exception:
+            if started:
+                raise
+        stream = await self.aclient.chat.completions.create(model=self.model, messages=messages, stream=True,
+                                                            stream_options={"include_usage": True})
+        async for chunk in stream:
+            if getattr(chunk, "usage", None):
+                _usage(chunk.usage, usage)
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+
+    async def astream(self, turn: Turn) -> AsyncIterator[str]:
+        t = time.perf_counter()
+        try:
+            async for delta in self.agenerate_stream(turn.msgs, turn.usage):
+                if turn.ttft is None:
+                    turn.ttft = time.perf_counter() - turn.t0
+                yield delta
+        except BaseException:
+            turn.trace.abort()
+            raise
+        finally:
+            turn.trace.add_stage("generate", time.perf_counter() - t)
+
+    def close(self) -> None:
+        if self.answers is not None:
+            self.answers.close()
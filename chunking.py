@@ -1,16 +1,31 @@
-import os, glob, json, re, uuid
+import os, glob, json, re, uuid, time, random
+from collections import deque
 from dataclasses import dataclass
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Callable, Optional, Tuple, Iterator
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
 from datetime import datetime
 from dotenv import load_dotenv
 load_dotenv()
 
+from emb_cache import EmbeddingCache, EMB_MODEL, text_key
+from dedup import dedup_chunks, iter_dedup
+
 DATA_DIR      = os.getenv("DATA_DIR", "rag/.data")
 ARTIFACT_DIR  = os.getenv("ARTIFACT_DIR", "rag/.artifacts")
 MAX_CHARS     = int(os.getenv("MAX_CHARS", "1200"))
 OVERLAP       = int(os.getenv("OVERLAP", "150"))
-EMB_MODEL     = os.getenv("EMB_MODEL", "text-embedding-3-small")
-BATCH_SIZE    = int(os.getenv("BATCH_SIZE", "64"))
+BATCH_SIZE    = int(os.getenv("BATCH_SIZE", "64"))     # 배치당 최대 입력 개수
+BATCH_TOKENS  = int(os.getenv("BATCH_TOKENS", "8000"))  # 배치당 추정 토큰 상한
+EMB_CONCURRENCY = int(os.getenv("EMB_CONCURRENCY", "4"))
+EMB_MAX_RETRIES = int(os.getenv("EMB_MAX_RETRIES", "6"))
+EMB_BACKOFF_BASE = float(os.getenv("EMB_BACKOFF_BASE", "1.0"))
+EMB_BACKOFF_CAP  = float(os.getenv("EMB_BACKOFF_CAP", "30"))
+
+EMB_CACHE_PATH = os.getenv("EMB_CACHE_PATH", os.path.join(ARTIFACT_DIR, "emb_cache.sqlite3"))
+DIRTY_ONLY     = os.getenv("DIRTY_ONLY", "1") == "1"   # 0이면 캐시를 무시하고 전량 재임베딩(캐시는 갱신)
+
+EMB_FORMAT = os.getenv("EMB_FORMAT", "npy")      # npy: 행렬(.npy) + id 인덱스(.ids.txt) / jsonl: 기존 텍스트 포맷
+EMB_DTYPE  = os.getenv("EMB_DTYPE", "float32")   # float32 | float16 (npy 전용)
 
 INCLUDE_SCENES     = os.getenv("INCLUDE_SCENES", "1") == "1"
 INCLUDE_CHAPTERS   = os.getenv("INCLUDE_CHAPTERS", "1") == "1"
@@ -18,6 +33,12 @@ INCLUDE_CHARACTERS = os.getenv("INCLUDE_CHARACTERS", "1") == "1"
 INCLUDE_META       = os.getenv("INCLUDE_META", "1") == "1"
 INCLUDE_FULLTEXT   = os.getenv("INCLUDE_FULLTEXT", "1") == "1"
 
+DEDUP           = os.getenv("DEDUP", "1") == "1"             # 임베딩 전 kind 간 중복 청크 제거
+DEDUP_THRESHOLD = float(os.getenv("DEDUP_THRESHOLD", "0.8"))  # near 중복으로 볼 shingle Jaccard 하한
+
+CHUNK_WORKERS = int(os.getenv("CHUNK_WORKERS", str(min(4, os.cpu_count() or 1))))   # 파일 단위 청킹 프로세스 수
+CHUNK_WINDOW  = int(os.getenv("CHUNK_WINDOW", "0"))   # 동시에 제출해 둘 파일 수, 0이면 워커 수 × 2
+
 os.makedirs(ARTIFACT_DIR, exist_ok=True)
 
 def find_files(pattern: str) -> List[str]:
@@ -39,35 +60,54 @@ def normalize_space(s: str) -> str:
     s = re.sub(r"\n{3,}", "\n\n", s)
     return s.strip()
 
-def sent_split(text: str) -> List[str]:
-  import re
+# 문장 경계: 종결부호 뒤 공백 또는 빈 줄. 전체 텍스트에 정규식 한 번만 적용
+_SENT_GAP_RE = re.compile(r"(?<=[.!?…])\s+|\n{2,}")
+_LINE_GAP_RE = re.compile(r"\n+")
 
-def sent_split(text: str):
-    text = text.replace("\r\n", "\n").strip()
-    text = re.sub(r'([.!?…])\s+', r'\1¶', text)
-    text = re.sub(r'(다\.)\s+', r'\1¶', text)
-    text = re.sub(r'\n{2,}', '¶', text)
-    parts = [p.strip() for p in text.split('¶') if p.strip()]
-    if len(parts) <= 1:
-        parts = [p.strip() for p in re.split(r'\n+', text) if p.strip()]
-    return parts
+def _spans_between(text: str, gap_re) -> List[Tuple[int, int]]:
+    # gap_re 매치 사이 구간을 앞뒤 공백을 뺀 (start, end)로
+    spans, pos = [], 0
+    for m in gap_re.finditer(text):
+        spans.append((pos, m.start()))
+        pos = m.end()
+    spans.append((pos, len(text)))
+    out = []
+    for s, e in spans:
+        while s < e and text[s].isspace(): s += 1
+        while e > s and text[e - 1].isspace(): e -= 1
+        if s < e:
+            out.append((s, e))
+    return out
 
+def sentence_spans(text: str) -> List[Tuple[int, int]]:
+    spans = _spans_between(text, _SENT_GAP_RE)
+    if len(spans) <= 1:
+        spans = _spans_between(text, _LINE_GAP_RE)
+    return spans
 
-def chunk_text(text: str, max_chars: int = MAX_CHARS, overlap: int = OVERLAP) -> List[str]:
-    text = normalize_space(text)
+def chunk_spans(text: str, max_chars: int = MAX_CHARS, overlap: int = OVERLAP) -> List[Tuple[int, int]]:
+    # text(정규화된 원문) 위의 (start, end) 구간만 계산 → 문자열 이어붙이기/복사 없음
+    #   문장을 max_chars까지 채우고, 다음 청크는 직전 청크 끝 overlap 글자부터 시작
     if len(text) <= max_chars:
-        return [text]
-    sents, chunks, buf = sent_split(text), [], ""
-    for s in sents:
-        if not buf:
-            buf = s
-        elif len(buf) + 1 + len(s) <= max_chars:
-            buf = buf + " " + s
+        return [(0, len(text))] if text else []
+    out: List[Tuple[int, int]] = []
+    cur_s = cur_e = -1
+    for s, e in sentence_spans(text):
+        if cur_s < 0:
+            cur_s, cur_e = s, e
+        elif e - cur_s <= max_chars:
+            cur_e = e
         else:
-            chunks.append(buf)
-            buf = (buf[-overlap:] + " " + s) if overlap>0 and len(buf)>overlap else s
-    if buf: chunks.append(buf)
-    return chunks
+            out.append((cur_s, cur_e))
+            cur_s = cur_e - overlap if overlap > 0 and cur_e - cur_s > overlap else s
+            cur_e = e
+    if cur_s >= 0:
+        out.append((cur_s, cur_e))
+    return out
+
+def chunk_text(text: str, max_chars: int = MAX_CHARS, overlap: int = OVERLAP) -> List[str]:
+    text = normalize_space(text)
+    return [text[s:e] for s, e in chunk_spans(text, max_chars, overlap)]
 
 @dataclass
 class Chunk:
@@ -75,137 +115,285 @@ class Chunk:
     text: str
     metadata: Dict[str, Any]
 
-def load_all_chunks() -> List[Chunk]:
+def _row_chunks(txt: str, base_id: str, meta: Dict[str, Any]) -> List[Chunk]:
+    txt = normalize_space(txt)
+    return [Chunk(id=f"{base_id}::{i}", text=txt[s:e], metadata=meta)
+            for i, (s, e) in enumerate(chunk_spans(txt))]
+
+def chunk_scenes_file(p: str) -> List[Chunk]:
+    chunks: List[Chunk] = []
+    for row in read_jsonl(p):
+        txt = row.get("scene_full_text") or row.get("text") or ""
+        if not txt: continue
+        kind = "scene" if row.get("scene_id") != "_BLOCK_RAW_" else "scene_raw_block"
+        meta = {
+            "work_id": row.get("work_id","unknown"),
+            "kind": kind,
+            "scene_id": row.get("scene_id"),
+            "scene_title": row.get("scene_title"),
+            "chapter_id": row.get("chapter_id"),
+            "chapter_label": row.get("chapter_label"),
+            "spoiler_level": row.get("spoiler_level", 3),
+            "source_file": os.path.basename(p),
+        }
+        chunks += _row_chunks(txt, f"{meta['work_id']}::{kind}::{row.get('scene_id','raw')}", meta)
+    return chunks
+
+def chunk_chapters_file(p: str) -> List[Chunk]:
+    chunks: List[Chunk] = []
+    for row in read_jsonl(p):
+        txt = row.get("chapter_full_text") or row.get("text") or ""
+        if not txt: continue
+        meta = {
+            "work_id": row.get("work_id","unknown"),
+            "kind": "chapter",
+            "chapter_id": row.get("chapter_id"),
+            "chapter_label": row.get("chapter_label"),
+            "spoiler_level": row.get("spoiler_level", 3),
+            "source_file": os.path.basename(p),
+        }
+        chunks += _row_chunks(txt, f"{meta['work_id']}::chapter::{row.get('chapter_id','?')}", meta)
+    return chunks
+
+def chunk_characters_file(p: str) -> List[Chunk]:
     chunks: List[Chunk] = []
+    for row in read_jsonl(p):
+        txt = row.get("full_bio") or row.get("text") or ""
+        if not txt: continue
+        char = row.get("character") or "UNKNOWN"
+        kind = "persona" if char != "_SECTION_RAW_" else "characters_raw"
+        meta = {
+            "work_id": row.get("work_id","unknown"),
+            "kind": kind,
+            "character": char,
+            "source_file": os.path.basename(p),
+        }
+        chunks += _row_chunks(txt, f"{meta['work_id']}::{kind}::{char}", meta)
+    return chunks
 
-    if INCLUDE_SCENES:
-        for p in find_files("*_scenes_*.jsonl"):
-            for row in read_jsonl(p):
-                txt = row.get("scene_full_text") or row.get("text") or ""
-                if not txt: continue
-                kind = "scene" if row.get("scene_id") != "_BLOCK_RAW_" else "scene_raw_block"
-                meta = {
-                    "work_id": row.get("work_id","unknown"),
-                    "kind": kind,
-                    "scene_id": row.get("scene_id"),
-                    "scene_title": row.get("scene_title"),
-                    "chapter_id": row.get("chapter_id"),
-                    "chapter_label": row.get("chapter_label"),
-                    "spoiler_level": row.get("spoiler_level", 3),
-                    "source_file": os.path.basename(p),
-                }
-                for i, ch in enumerate(chunk_text(txt)):
-                    chunks.append(Chunk(
-                        id=f"{meta['work_id']}::{kind}::{row.get('scene_id','raw')}::{i}",
-                        text=ch, metadata=meta
-                    ))
-
-    if INCLUDE_CHAPTERS:
-        for p in find_files("*_chapters_*.jsonl"):
-            for row in read_jsonl(p):
-                txt = row.get("chapter_full_text") or row.get("text") or ""
-                if not txt: continue
-                meta = {
-                    "work_id": row.get("work_id","unknown"),
-                    "kind": "chapter",
-                    "chapter_id": row.get("chapter_id"),
-                    "chapter_label": row.get("chapter_label"),
-                    "spoiler_level": row.get("spoiler_level", 3),
-                    "source_file": os.path.basename(p),
-                }
-                for i, ch in enumerate(chunk_text(txt)):
-                    chunks.append(Chunk(
-                        id=f"{meta['work_id']}::chapter::{row.get('chapter_id','?')}::{i}",
-                        text=ch, metadata=meta
-                    ))
-
-    if INCLUDE_CHARACTERS:
-        for p in find_files("*_characters_*.jsonl"):
-            for row in read_jsonl(p):
-                txt = row.get("full_bio") or row.get("text") or ""
-                if not txt: continue
-                char = row.get("character") or "UNKNOWN"
-                kind = "persona" if char != "_SECTION_RAW_" else "characters_raw"
-                meta = {
-                    "work_id": row.get("work_id","unknown"),
-                    "kind": kind,
-                    "character": char,
-                    "source_file": os.path.basename(p),
-                }
-                for i, ch in enumerate(chunk_text(txt)):
-                    chunks.append(Chunk(
-                        id=f"{meta['work_id']}::{kind}::{char}::{i}",
-                        text=ch, metadata=meta
-                    ))
-
-    if INCLUDE_META:
-        for p in find_files("*_meta_*.jsonl"):
-            for row in read_jsonl(p):
-                work = row.get("work_id","unknown")
-                for field in ["overview_raw","chapters_raw","scenes_raw","characters_raw"]:
-                    txt = row.get(field) or ""
-                    if not txt: continue
-                    meta = {
-                        "work_id": work,
-                        "kind": f"meta_{field}",
-                        "source_file": os.path.basename(p),
-                    }
-                    for i, ch in enumerate(chunk_text(txt)):
-                        chunks.append(Chunk(
-                            id=f"{work}::meta::{field}::{i}",
-                            text=ch, metadata=meta
-                        ))
-
-    if INCLUDE_FULLTEXT:
-        for p in find_files("*_fulltext*.jsonl"):
-            for row in read_jsonl(p):
-                txt = row.get("full_text") or row.get("text") or ""
-                if not txt: continue
-                work = row.get("work_id","unknown")
-                meta = {
-                    "work_id": work,
-                    "kind": "fulltext",
-                    "source_file": os.path.basename(p),
-                }
-                for i, ch in enumerate(chunk_text(txt)):
-                    chunks.append(Chunk(
-                        id=f"{work}::fulltext::{i}",
-                        text=ch, metadata=meta
-                    ))
+def chunk_meta_file(p: str) -> List[Chunk]:
+    chunks: List[Chunk] = []
+    for row in read_jsonl(p):
+        work = row.get("work_id","unknown")
+        for field in ["overview_raw","chapters_raw","scenes_raw","characters_raw"]:
+            txt = row.get(field) or ""
+            if not txt: continue
+            meta = {
+                "work_id": work,
+                "kind": f"meta_{field}",
+                "source_file": os.path.basename(p),
+            }
+            chunks += _row_chunks(txt, f"{work}::meta::{field}", meta)
+    return chunks
 
+def chunk_fulltext_file(p: str) -> List[Chunk]:
+    chunks: List[Chunk] = []
+    for row in read_jsonl(p):
+        txt = row.get("full_text") or row.get("text") or ""
+        if not txt: continue
+        work = row.get("work_id","unknown")
+        meta = {
+            "work_id": work,
+            "kind": "fulltext",
+            "source_file": os.path.basename(p),
+        }
+        chunks += _row_chunks(txt, f"{work}::fulltext", meta)
     return chunks
 
-def embed_texts(texts: List[str], model: str = EMB_MODEL, batch_size: int = BATCH_SIZE) -> List[List[float]]:
+# (INCLUDE 플래그, 파일 패턴, 파일 단위 청킹 함수) — 이 순서가 곧 청크 출력 순서
+SOURCES = [
+    (INCLUDE_SCENES,     "*_scenes_*.jsonl",     chunk_scenes_file),
+    (INCLUDE_CHAPTERS,   "*_chapters_*.jsonl",   chunk_chapters_file),
+    (INCLUDE_CHARACTERS, "*_characters_*.jsonl", chunk_characters_file),
+    (INCLUDE_META,       "*_meta_*.jsonl",       chunk_meta_file),
+    (INCLUDE_FULLTEXT,   "*_fulltext*.jsonl",    chunk_fulltext_file),
+]
+
+def _chunk_job(job: Tuple[Callable[[str], List[Chunk]], str]) -> List[Chunk]:
+    fn, path = job
+    return fn(path)
+
+_GROUP_RE = re.compile(r"^(.*?)_(?:scenes|chapters|characters|meta|fulltext)")
+
+def _file_group(path: str) -> str:
+    # "so_nyeon_i_onda_scenes_full.jsonl" → "so_nyeon_i_onda" (작품별 파일 묶음)
+    name = os.path.basename(path)
+    m = _GROUP_RE.match(name)
+    return m.group(1) if m else name
+
+def iter_chunks(workers: int = CHUNK_WORKERS) -> Iterator[Chunk]:
+    # 파일 단위로 프로세스 풀에 나눠 청킹, 결과는 파일 순서대로 하나씩 흘려보냄(id/순서 결정적)
+    #   파일은 작품별로 모아 순서를 정함(작품 안에서는 SOURCES 순서) → iter_dedup이 작품 하나씩 정리
+    #   풀에는 CHUNK_WINDOW개(기본 워커 수 × 2)까지만 앞서 제출 → 메모리는 창 크기만큼의 파일 결과로 제한
+    jobs = [(fn, p) for on, pattern, fn in SOURCES if on for p in find_files(pattern)]
+    jobs.sort(key=lambda j: _file_group(j[1]))
+    if workers <= 1 or len(jobs) <= 1:
+        for job in jobs:
+            yield from _chunk_job(job)
+        return
+    window = CHUNK_WINDOW or workers * 2
+    with ProcessPoolExecutor(max_workers=min(workers, len(jobs))) as pool:
+        pending = iter(jobs)
+        futs = deque(pool.submit(_chunk_job, job) for _, job in zip(range(window), pending))
+        while futs:
+            res = futs.popleft().result()
+            job = next(pending, None)
+            if job is not None:
+                futs.append(pool.submit(_chunk_job, job))
+            yield from res
+            del res
+
+def load_all_chunks() -> List[Chunk]:
+    return list(iter_chunks())
+
+def estimate_tokens(text: str) -> int:
+    # tiktoken 없이 보수적으로 추정: 한글 1글자(3바이트) ≈ 1토큰, 영문 3~4글자 ≈ 1토큰
+    return len(text.encode("utf-8")) // 3 + 1
+
+def make_batches(texts: List[str], max_tokens: int = BATCH_TOKENS, max_items: int = BATCH_SIZE) -> List[List[int]]:
+    batches, cur, cur_tok = [], [], 0
+    for i, t in enumerate(texts):
+        n = estimate_tokens(t)
+        if cur and (cur_tok + n > max_tokens or len(cur) >= max_items):
+            batches.append(cur)
+            cur, cur_tok = [], 0
+        cur.append(i)
+        cur_tok += n
+    if cur: batches.append(cur)
+    return batches
+
+def _retry_delay(err: Exception, attempt: int) -> Optional[float]:
+    import openai
+    status = getattr(err, "status_code", None)
+    retryable = isinstance(err, (openai.RateLimitError, openai.APIConnectionError)) \
+        or (isinstance(err, openai.APIStatusError) and status is not None and status >= 500)
+    if not retryable:
+        return None
+    resp = getattr(err, "response", None)
+    after = resp.headers.get("retry-after") if resp is not None else None
+    try:
+        if after: return min(float(after), EMB_BACKOFF_CAP) + random.uniform(0, 0.5)
+    except ValueError:
+        pass
+    # exponential backoff + jitter
+    return random.uniform(0.5, 1.0) * min(EMB_BACKOFF_CAP, EMB_BACKOFF_BASE * (2 ** attempt))
+
+def _embed_batch(client, model: str, batch: List[str]) -> List[List[float]]:
+    for attempt in range(EMB_MAX_RETRIES + 1):
+        try:
+            resp = client.embeddings.create(model=model, input=batch)
+            return [d.embedding for d in sorted(resp.data, key=lambda d: d.index)]
+        except Exception as e:
+            delay = _retry_delay(e, attempt)
+            if delay is None or attempt >= EMB_MAX_RETRIES:
+                raise
+            print(f"[RETRY] {type(e).__name__} → {delay:.1f}s 후 재시도 ({attempt+1}/{EMB_MAX_RETRIES})")
+            time.sleep(delay)
+
+def embed_texts(texts: List[str], model: str = EMB_MODEL, batch_size: int = BATCH_SIZE,
+                max_tokens: int = BATCH_TOKENS, concurrency: int = EMB_CONCURRENCY,
+                on_batch: Optional[Callable[[List[int], List[List[float]]], None]] = None) -> List[List[float]]:
     from openai import OpenAI
-    client = OpenAI()  # OPENAI_API_KEY 환경변수 필요
-    out: List[List[float]] = []
-    for i in range(0, len(texts), batch_size):
-        batch = texts[i:i+batch_size]
-        resp = client.embeddings.create(model=model, input=batch)
-        out.extend([d.embedding for d in resp.data])
+    client = OpenAI(max_retries=0)  # OPENAI_API_KEY 환경변수 필요, OPENAI_BASE_URL로 로컬 fake 서버 지정 가능
+    batches = make_batches(texts, max_tokens=max_tokens, max_items=batch_size)
+    out: List[Optional[List[float]]] = [None] * len(texts)
+
+    # on_batch: 배치가 끝날 때마다 호출 → 디스크 체크포인트(임베딩 캐시)에 즉시 기록
+    done = 0
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as pool:
+        futs = {pool.submit(_embed_batch, client, model, [texts[i] for i in b]): b for b in batches}
+        try:
+            for fut in as_completed(futs):
+                idxs, vecs = futs[fut], fut.result()
+                for i, v in zip(idxs, vecs):
+                    out[i] = v
+                if on_batch is not None:
+                    on_batch(idxs, vecs)
+                done += 1
+                if done % 10 == 0 or done == len(batches):
+                    print(f"[EMBED] batches {done}/{len(batches)}")
+        except BaseException:
+            pool.shutdown(wait=False, cancel_futures=True)
+            raise
     return out
 
-def main():
-    chunks = load_all_chunks()
-    if not chunks:
-        raise SystemExit(f"[ERROR] {DATA_DIR}에서 로드된 문서가 없습니다. JSONL 패턴을 확인하세요.")
+def embed_with_cache(texts: List[str], cache: EmbeddingCache, model: str = EMB_MODEL,
+                     dirty_only: bool = DIRTY_ONLY) -> List[List[float]]:
+    keys = [text_key(t) for t in texts]
+    uniq = list(dict.fromkeys(keys))
+    cached = cache.get_many(model, uniq) if dirty_only else {}
 
-    print(f"[LOAD] docs(chunks) = {len(chunks)}  | from: {DATA_DIR}")
-    texts = [c.text for c in chunks]
-    vecs  = embed_texts(texts, model=EMB_MODEL, batch_size=BATCH_SIZE)
-    dim   = len(vecs[0]) if vecs else 0
-    print(f"[EMBED] vectors = {len(vecs)}, dim = {dim}, model = {EMB_MODEL}")
+    # 캐시에 없는(새로 생겼거나 바뀐) 청크만 API로 전송, 동일 텍스트는 한 번만
+    todo = {}
+    for k, t in zip(keys, texts):
+        if k not in cached and k not in todo:
+            todo[k] = t
+    print(f"[CACHE] hit = {len(cached)}, miss = {len(todo)}, dup = {len(keys) - len(uniq)}  | {cache.path}")
+
+    if todo:
+        # 완료된 배치는 바로 캐시에 기록되므로, 중단 후 재실행하면 남은 배치부터 이어서 진행
+        todo_keys = list(todo.keys())
+        new_vecs = embed_texts(
+            list(todo.values()), model=model,
+            on_batch=lambda idxs, vecs: cache.put_many(model, ((todo_keys[i], v) for i, v in zip(idxs, vecs))),
+        )
+        cached.update(zip(todo_keys, new_vecs))
+    return [cached[k] for k in keys]
+
+def save_embeddings_npy(base: str, ids: List[str], vecs: List[List[float]], dtype: str = EMB_DTYPE) -> str:
+    # <base>.npy: (N, dim) 행렬 / <base>.ids.txt: i번째 줄 = i번째 행의 id
+    import numpy as np
+    mat = np.asarray(vecs, dtype=np.dtype(dtype))
+    np.save(base + ".npy", mat)
+    with open(base + ".ids.txt", "w", encoding="utf-8") as f:
+        for _id in ids:
+            f.write(_id + "\n")
+    return base + ".npy"
 
+def main():
     stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
     chunks_path = os.path.join(ARTIFACT_DIR, f"chunks_{stamp}.jsonl")
-    embs_path   = os.path.join(ARTIFACT_DIR, f"embeddings_{stamp}.jsonl")
 
+    # 청크는 나오는 대로 파일에 기록, 메모리에는 임베딩에 필요한 id/본문만 유지
+    # (DEDUP=1이면 대표 청크를 고르기 위해 작품 하나 분량씩 모았다가 기록)
+    ids, texts = [], []
+    t0 = time.perf_counter()
+    chunks = iter_chunks()
+    rep: Dict[str, Any] = {}
+    if DEDUP:
+        chunks = iter_dedup(chunks, threshold=DEDUP_THRESHOLD, report=rep)
     with open(chunks_path, "w", encoding="utf-8") as f:
         for c in chunks:
             f.write(json.dumps({"id": c.id, "text": c.text, "metadata": c.metadata}, ensure_ascii=False) + "\n")
-    with open(embs_path, "w", encoding="utf-8") as f:
-        for c, v in zip(chunks, vecs):
-            f.write(json.dumps({"id": c.id, "embedding": v}, ensure_ascii=False) + "\n")
+            ids.append(c.id); texts.append(c.text)
+    if DEDUP:
+        removed = rep["total"] - rep["kept"]
+        print(f"[DEDUP] {rep['kept']}/{rep['total']} kept, removed {removed} "
+              f"({removed / max(1, rep['total']):.0%}; exact {rep['exact']}, near {rep['near']})  "
+              + ", ".join(f"{k} -{n}" for k, n in sorted(rep["removed_by_kind"].items())))
+        if rep["split_works"]:
+            print(f"[WARN] 작품 청크가 연속되지 않아 따로 비교된 구간 {rep['split_works']}개 (파일 이름 규칙 확인)")
+    if not ids:
+        os.remove(chunks_path)
+        raise SystemExit(f"[ERROR] {DATA_DIR}에서 로드된 문서가 없습니다. JSONL 패턴을 확인하세요.")
+
+    print(f"[LOAD] docs(chunks) = {len(ids)}  | from: {DATA_DIR}  ({time.perf_counter() - t0:.2f}s, workers = {CHUNK_WORKERS})")
+    cache = EmbeddingCache(EMB_CACHE_PATH)
+    try:
+        vecs = embed_with_cache(texts, cache, model=EMB_MODEL, dirty_only=DIRTY_ONLY)
+    finally:
+        cache.close()
+    dim   = len(vecs[0]) if vecs else 0
+    print(f"[EMBED] vectors = {len(vecs)}, dim = {dim}, model = {EMB_MODEL}")
+
+    if EMB_FORMAT == "npy":
+        embs_path = save_embeddings_npy(os.path.join(ARTIFACT_DIR, f"embeddings_{stamp}"),
+                                        ids, vecs, dtype=EMB_DTYPE)
+    else:
+        embs_path = os.path.join(ARTIFACT_DIR, f"embeddings_{stamp}.jsonl")
+        with open(embs_path, "w", encoding="utf-8") as f:
+            for _id, v in zip(ids, vecs):
+                f.write(json.dumps({"id": _id, "embedding": v}, ensure_ascii=False) + "\n")
 
     print(f"[SAVE] chunks     → {chunks_path}")
     print(f"[SAVE] embeddings → {embs_path}")
@@ -0,0 +1,132 @@
+import re, zlib
+from typing import Any, Dict, Iterable, Iterator, List, Tuple
+import numpy as np
+
+from emb_cache import text_key
+
+# 같은 문장이 scene/chapter/fulltext/meta_*_raw 로 여러 번 들어오는 것을 임베딩 전에 정리
+#   1) 공백 정규화 텍스트 해시가 같으면 exact 중복
+#   2) 글자 shingle MinHash + LSH 밴드로 후보 → 실제 Jaccard로 확인해 near 중복
+# 대표(canonical) 청크는 KIND_PRIORITY 순으로 고르고, 흡수한 청크의 kind/scene/id를 메타에 남김
+
+KIND_PRIORITY = ["persona", "scene", "chapter", "characters_raw", "scene_raw_block",
+                 "meta_overview_raw", "meta_scenes_raw", "meta_chapters_raw", "meta_characters_raw", "fulltext"]
+
+SHINGLE = 5
+NUM_PERM = 64
+BANDS = 16          # 16밴드 × 4행 → Jaccard 0.5 근처부터 후보로 잡힘
+_PRIME = (1 << 31) - 1
+
+_rng = np.random.RandomState(1234)   # 실행마다 같은 해시 → 같은 결과
+_A = _rng.randint(1, _PRIME, size=NUM_PERM).astype(np.uint64)
+_B = _rng.randint(0, _PRIME, size=NUM_PERM).astype(np.uint64)
+
+def shingles(text: str, k: int = SHINGLE) -> set:
+    s = re.sub(r"\s+", " ", text or "").strip()
+    return {s[i:i+k] for i in range(max(1, len(s) - k + 1))}
+
+def minhash(sh: set) -> np.ndarray:
+    h = np.fromiter((zlib.crc32(x.encode("utf-8")) & 0x7FFFFFFF for x in sh), dtype=np.uint64, count=len(sh))
+    # (a*h + b) mod p 를 순열 NUM_PERM개에 대해 한 번에 → 열 방향 최소값
+    return ((np.outer(_A, h) + _B[:, None]) % _PRIME).min(axis=1)
+
+def jaccard(a: set, b: set) -> float:
+    return len(a & b) / len(a | b) if a or b else 1.0
+
+def _priority(kind: str) -> int:
+    return KIND_PRIORITY.index(kind) if kind in KIND_PRIORITY else len(KIND_PRIORITY)
+
+def _join(vals) -> str:
+    return ",".join(dict.fromkeys(v for v in vals if v))
+
+def dedup_chunks(chunks: List[Any], threshold: float = 0.8) -> Tuple[List[Any], Dict[str, Any]]:
+    # chunks: .id/.text/.metadata 를 가진 객체(chunking.Chunk). 같은 work_id 안에서만 비교.
+    # 우선순위가 높은 청크부터 대표로 등록하고, 이후 청크는 기존 대표와 비교 → 연쇄 병합 없음
+    order = sorted(range(len(chunks)), key=lambda i: (_priority(chunks[i].metadata.get("kind", "")), i))
+    canon_of: Dict[int, int] = {}
+    members: Dict[int, List[int]] = {}
+    by_hash: Dict[Tuple[str, str], int] = {}
+    buckets: Dict[Tuple[str, int, bytes], List[int]] = {}
+    sh: Dict[int, set] = {}
+    report = {"total": len(chunks), "exact": 0, "near": 0, "removed_by_kind": {}}
+    rows = NUM_PERM // BANDS
+
+    for i in order:
+        c = chunks[i]
+        work = c.metadata.get("work_id", "")
+        key = (work, text_key(c.text))
+        target = by_hash.get(key)
+        kind_of = "exact"
+        if target is None:
+            sh[i] = shingles(c.text)
+            sig = minhash(sh[i])
+            bands = [(work, b, sig[b*rows:(b+1)*rows].tobytes()) for b in range(BANDS)]
+            best = 0.0
+            for cand in dict.fromkeys(j for band in bands for j in buckets.get(band, [])):
+                s = jaccard(sh[i], sh[cand])
+                if s >= threshold and s > best:
+                    target, best = cand, s
+            kind_of = "near"
+            if target is None:
+                by_hash[key] = i
+                members[i] = [i]
+                for band in bands:
+                    buckets.setdefault(band, []).append(i)
+                continue
+        canon_of[i] = target
+        members[target].append(i)
+        report[kind_of] += 1
+        k = c.metadata.get("kind", "")
+        report["removed_by_kind"][k] = report["removed_by_kind"].get(k, 0) + 1
+
+    kept = []
+    for i, c in enumerate(chunks):
+        if i in canon_of:
+            continue
+        group = members[i]
+        if len(group) > 1:
+            # 메타 dict는 같은 행의 청크끼리 공유되므로 복사 후 기록
+            meta = dict(c.metadata)
+            kinds = [chunks[j].metadata.get("kind", "") for j in group]
+            meta["kinds"] = _join(kinds)
+            for k in dict.fromkeys(kinds):
+                meta[f"kind_{k}"] = True
+            scene_ids = _join(str(chunks[j].metadata.get("scene_id") or "") for j in group)
+            if scene_ids:
+                meta["scene_ids"] = scene_ids
+            meta["merged_ids"] = _join(chunks[j].id for j in group[1:])
+            c.metadata = meta
+        kept.append(c)
+    report["kept"] = len(kept)
+    return kept, report
+
+def iter_dedup(chunks: Iterable[Any], threshold: float = 0.8, report: Dict[str, Any] = None) -> Iterator[Any]:
+    # 스트림 버전: 같은 work_id가 연달아 나오는 동안 모았다가 작품 단위로 dedup_chunks → 메모리는 작품 하나 분량.
+    # (비교는 어차피 작품 안에서만 하므로 결과는 전체를 모아 돌린 것과 같음.
+    #  chunking.iter_chunks는 작품별로 파일을 모아서 내보냄. 떨어져서 다시 나온 작품은 따로 비교 → split_works)
+    report = {} if report is None else report
+    report.update(total=0, kept=0, exact=0, near=0, removed_by_kind={}, split_works=0)
+    buf: List[Any] = []
+    work, seen = None, set()
+
+    def flush() -> List[Any]:
+        kept, rep = dedup_chunks(buf, threshold=threshold)
+        for k in ("total", "kept", "exact", "near"):
+            report[k] += rep[k]
+        for k, n in rep["removed_by_kind"].items():
+            report["removed_by_kind"][k] = report["removed_by_kind"].get(k, 0) + n
+        return kept
+
+    for c in chunks:
+        w = c.metadata.get("work_id", "")
+        if w != work:
+            if buf:
+                yield from flush()
+                buf = []
+            if w in seen:
+                report["split_works"] += 1
+            seen.add(w)
+            work = w
+        buf.append(c)
+    if buf:
+        yield from flush()
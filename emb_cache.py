@@ -0,0 +1,77 @@
+import os, re, sqlite3, hashlib, threading
+from array import array
+from typing import Dict, Iterable, List, Tuple
+
+# 색인(chunking.py)·적재(DB_MAKING.py)·질의(retriever.py)가 같은 모델을 쓰도록 한 곳에서 읽음
+EMB_MODEL = os.getenv("EMB_MODEL", "text-embedding-3-small")
+
+def normalize_for_key(text: str) -> str:
+    # 공백/줄바꿈 차이만 있는 청크는 같은 키로 취급
+    return re.sub(r"\s+", " ", (text or "")).strip()
+
+def text_key(text: str) -> str:
+    return hashlib.sha1(normalize_for_key(text).encode("utf-8")).hexdigest()
+
+def pack_vec(vec: List[float]) -> bytes:
+    return array("f", vec).tobytes()
+
+def unpack_vec(blob: bytes) -> List[float]:
+    a = array("f")
+    a.frombytes(blob)
+    return a.tolist()
+
+# (모델, 정규화 텍스트 해시) → 벡터(float32) 영속 캐시. SQLite 단일 파일.
+class EmbeddingCache:
+    def __init__(self, path: str):
+        self.path = path
+        d = os.path.dirname(path)
+        if d:
+            os.makedirs(d, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS emb ("
+            " model TEXT NOT NULL, key TEXT NOT NULL, dim INTEGER NOT NULL, vec BLOB NOT NULL,"
+            " PRIMARY KEY (model, key))"
+        )
+        self._conn.commit()
+        self.hits = 0
+        self.misses = 0
+
+    def get_many(self, model: str, keys: Iterable[str]) -> Dict[str, List[float]]:
+        keys = list(dict.fromkeys(keys))
+        out: Dict[str, List[float]] = {}
+        with self._lock:
+            for i in range(0, len(keys), 500):
+                part = keys[i:i+500]
+                marks = ",".join("?" * len(part))
+                rows = self._conn.execute(
+                    f"SELECT key, vec FROM emb WHERE model = ? AND key IN ({marks})",
+                    [model, *part],
+                ).fetchall()
+                for k, blob in rows:
+                    out[k] = unpack_vec(blob)
+        self.hits += len(out)
+        self.misses += len(keys) - len(out)
+        return out
+
+    def put_many(self, model: str, items: Iterable[Tuple[str, List[float]]]) -> None:
+        rows = [(model, k, len(v), pack_vec(v)) for k, v in items]
+        if not rows:
+            return
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO emb (model, key, dim, vec) VALUES (?, ?, ?, ?)", rows
+            )
+            self._conn.commit()
+
+    def count(self, model: str = None) -> int:
+        with self._lock:
+            if model is None:
+                return self._conn.execute("SELECT COUNT(*) FROM emb").fetchone()[0]
+            return self._conn.execute("SELECT COUNT(*) FROM emb WHERE model = ?", (model,)).fetchone()[0]
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
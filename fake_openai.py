@@ -0,0 +1,197 @@
+import os, re, json, math, time, random, hashlib, argparse, threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+from typing import List
+
+# 로컬 테스트용 OpenAI 호환 fake 서버 (네트워크/과금 없음)
+#   python fake_openai.py --port 8765
+#   OPENAI_BASE_URL=http://127.0.0.1:8765/v1 OPENAI_API_KEY=fake python chunking.py
+
+FAKE_DIM        = int(os.getenv("FAKE_DIM", "1536"))
+FAKE_LATENCY_MS = float(os.getenv("FAKE_LATENCY_MS", "0"))
+FAKE_429_RATE   = float(os.getenv("FAKE_429_RATE", "0"))   # 요청 중 429로 거절할 비율
+FAKE_5XX_RATE   = float(os.getenv("FAKE_5XX_RATE", "0"))
+FAKE_TOKEN_MS   = float(os.getenv("FAKE_TOKEN_MS", "0"))   # 스트리밍 토큰 간 지연
+FAKE_NO_RESPONSES = os.getenv("FAKE_NO_RESPONSES", "0") == "1"   # 1: /responses 404 → chat 폴백 경로 테스트
+
+def fake_answer(messages) -> str:
+    # 마지막 user 메시지의 "질문:" 줄을 되받아 말하는 결정적 응답
+    last = next((m for m in reversed(messages or []) if m.get("role") == "user"), {})
+    content = last.get("content") or ""
+    if isinstance(content, list):
+        content = " ".join(c.get("text", "") for c in content if isinstance(c, dict))
+    q = content.split("\n", 1)[0].replace("질문:", "").strip()[:60]
+    return f"음… \"{q}\" 말이지. 그건 나한테도 쉽지 않은 이야기야. 그래도 솔직하게 말해볼게."
+
+def _tokens(text: str) -> List[str]:
+    return re.findall(r"\S+\s*|\s+", text)
+
+def fake_embedding(text: str, dim: int = FAKE_DIM) -> List[float]:
+    # 글자 bigram 해싱 → 결정적이고 어휘가 겹치면 코사인 유사도도 올라감
+    s = re.sub(r"\s+", " ", (text or "").lower()).strip()
+    vec = [0.0] * dim
+    grams = [s[i:i+2] for i in range(max(1, len(s) - 1))]
+    for g in grams:
+        h = int.from_bytes(hashlib.blake2b(g.encode("utf-8"), digest_size=8).digest(), "little")
+        vec[h % dim] += 1.0 if (h >> 63) & 1 else -1.0
+    norm = math.sqrt(sum(v * v for v in vec)) or 1.0
+    return [v / norm for v in vec]
+
+# 네트워크 없이 같은 임베딩을 돌려주는 in-process 대역 (벤치마크/오프라인 평가용)
+#   client.embeddings.create(model=..., input=[...]) 만 흉내 냄
+class LocalOpenAI:
+    def __init__(self, dim: int = FAKE_DIM, latency_ms: float = FAKE_LATENCY_MS):
+        self.dim, self.latency_ms = dim, latency_ms
+        self.calls = 0
+        self.embeddings = self
+
+    def create(self, model: str = "fake", input=None, **_):
+        texts = [input] if isinstance(input, str) else list(input or [])
+        self.calls += 1
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000.0)
+        data = [SimpleNamespace(index=i, embedding=fake_embedding(t, self.dim)) for i, t in enumerate(texts)]
+        return SimpleNamespace(data=data, model=model)
+
+class _Stats:
+    lock = threading.Lock()
+    requests = 0
+    rejected = 0
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, fmt, *args):
+        pass
+
+    def _send_json(self, code: int, body: dict, headers: dict = None):
+        data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _read_json(self) -> dict:
+        n = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(n) or b"{}")
+
+    def _maybe_fail(self) -> bool:
+        r = random.random()
+        if r < FAKE_429_RATE:
+            with _Stats.lock: _Stats.rejected += 1
+            self._send_json(429, {"error": {"message": "rate limited (fake)", "type": "rate_limit_error"}},
+                            headers={"retry-after": "0.2"})
+            return True
+        if r < FAKE_429_RATE + FAKE_5XX_RATE:
+            with _Stats.lock: _Stats.rejected += 1
+            self._send_json(503, {"error": {"message": "unavailable (fake)", "type": "server_error"}})
+            return True
+        return False
+
+    def do_GET(self):
+        if self.path.rstrip("/") == "/stats":
+            return self._send_json(200, {"requests": _Stats.requests, "rejected": _Stats.rejected})
+        self._send_json(404, {"error": {"message": "not found"}})
+
+    def do_POST(self):
+        body = self._read_json()
+        with _Stats.lock: _Stats.requests += 1
+        if FAKE_LATENCY_MS:
+            time.sleep(FAKE_LATENCY_MS / 1000.0)
+        if self._maybe_fail():
+            return
+        if self.path.endswith("/embeddings"):
+            return self._embeddings(body)
+        if self.path.endswith("/chat/completions"):
+            return self._chat(body)
+        if self.path.endswith("/responses") and not FAKE_NO_RESPONSES:
+            return self._responses(body)
+        self._send_json(404, {"error": {"message": f"unsupported path {self.path}"}})
+
+    def _start_sse(self):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+
+    def _sse(self, data: dict, event: str = None):
+        msg = (f"event: {event}\n" if event else "") + "data: " + json.dumps(data, ensure_ascii=False) + "\n\n"
+        self.wfile.write(msg.encode("utf-8"))
+        self.wfile.flush()
+
+    def _chat(self, body: dict):
+        answer = fake_answer(body.get("messages"))
+        model = body.get("model", "fake")
+        if not body.get("stream"):
+            return self._send_json(200, {
+                "id": "chatcmpl-fake", "object": "chat.completion", "created": int(time.time()), "model": model,
+                "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": answer}}],
+                "usage": {"prompt_tokens": 0, "completion_tokens": len(answer), "total_tokens": len(answer)},
+            })
+        self._start_sse()
+        base = {"id": "chatcmpl-fake", "object": "chat.completion.chunk", "created": int(time.time()), "model": model}
+        for tok in _tokens(answer):
+            if FAKE_TOKEN_MS: time.sleep(FAKE_TOKEN_MS / 1000.0)
+            self._sse({**base, "choices": [{"index": 0, "delta": {"content": tok}, "finish_reason": None}]})
+        self._sse({**base, "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]})
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+    def _responses(self, body: dict):
+        inp = body.get("input")
+        messages = [{"role": "user", "content": inp}] if isinstance(inp, str) else inp
+        answer = fake_answer(messages)
+        resp = {
+            "id": "resp_fake", "object": "response", "created_at": int(time.time()), "model": body.get("model", "fake"),
+            "status": "completed", "output": [{
+                "id": "msg_fake", "type": "message", "role": "assistant", "status": "completed",
+                "content": [{"type": "output_text", "text": answer, "annotations": []}],
+            }],
+            "usage": {"input_tokens": 0, "output_tokens": len(answer), "total_tokens": len(answer)},
+        }
+        if not body.get("stream"):
+            return self._send_json(200, resp)
+        self._start_sse()
+        seq = 0
+        self._sse({"type": "response.created", "sequence_number": seq,
+                   "response": {**resp, "status": "in_progress", "output": []}}, "response.created")
+        for tok in _tokens(answer):
+            if FAKE_TOKEN_MS: time.sleep(FAKE_TOKEN_MS / 1000.0)
+            seq += 1
+            self._sse({"type": "response.output_text.delta", "sequence_number": seq, "item_id": "msg_fake",
+                       "output_index": 0, "content_index": 0, "delta": tok, "logprobs": []},
+                      "response.output_text.delta")
+        self._sse({"type": "response.completed", "sequence_number": seq + 1, "response": resp}, "response.completed")
+
+    def _embeddings(self, body: dict):
+        inp = body.get("input")
+        texts = [inp] if isinstance(inp, str) else list(inp or [])
+        dim = int(body.get("dimensions") or FAKE_DIM)
+        data = [{"object": "embedding", "index": i, "embedding": fake_embedding(t, dim)} for i, t in enumerate(texts)]
+        toks = sum(len(t) for t in texts)
+        self._send_json(200, {
+            "object": "list", "data": data, "model": body.get("model", "fake"),
+            "usage": {"prompt_tokens": toks, "total_tokens": toks},
+        })
+
+def serve(host: str = "127.0.0.1", port: int = 8765) -> ThreadingHTTPServer:
+    srv = ThreadingHTTPServer((host, port), FakeOpenAIHandler)
+    srv.daemon_threads = True
+    return srv
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8765)
+    args = ap.parse_args()
+    srv = serve(args.host, args.port)
+    print(f"[FAKE] OpenAI-compatible server on http://{args.host}:{args.port}/v1")
+    try:
+        srv.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,68 @@
+import os, re
+from functools import lru_cache
+from typing import Callable, Dict, List
+
+# BM25용 토크나이저. 색인과 질의에 같은 것을 써야 하므로 이름을 BM25 manifest에 기록하고,
+# 로드한 인덱스의 이름으로 질의를 토큰화함 (BM25_TOKENIZER가 바뀌면 인덱스를 다시 만듦)
+#   regex  : [0-9A-Za-z가-힣]+ 소문자 (기존 동작) — "동호는"/"동호가"가 서로 다른 용어
+#   josa   : regex + 끝에 붙은 조사를 뗀 형태를 함께 냄 ("동호는" → 동호는, 동호)
+#   bigram : 한글 어절은 글자 2-gram ("동호는" → 동호, 호는), 그 외는 regex와 같음
+BM25_TOKENIZER = os.getenv("BM25_TOKENIZER", "josa")
+
+_WORD_RE = re.compile(r"[0-9A-Za-z가-힣]+")
+_HANGUL_RE = re.compile(r"^[가-힣]+$")
+
+# 긴 조사부터 비교 (에게서 → 에게 → 에). 어간이 너무 짧아지지 않도록 1글자 조사는 어간 2글자 이상일 때만
+JOSA = frozenset({
+    "은", "는", "이", "가", "을", "를", "의", "에", "도", "만", "와", "과", "로", "야", "아", "랑", "나",
+    "으로", "에서", "에게", "께서", "한테", "까지", "부터", "보다", "처럼", "이랑", "이나", "이나마",
+    "에게서", "한테서", "으로서", "으로써", "로서", "로써", "조차", "마저", "밖에", "마다", "이며", "이고",
+    "이다", "였다", "이었다", "입니다", "이야", "이에요", "예요", "하고", "든지", "이든지", "라도", "이라도",
+    "께", "엔", "에는", "에서는", "에게는", "으로는", "로는", "과는", "와는", "이랑은", "까지는", "부터는",
+    "에도", "에서도", "에게도", "으로도", "로도", "과도", "와도", "만큼", "만은", "만이", "들", "들은",
+    "들이", "들을", "들의", "들에게", "들과", "들도", "들이랑",
+})
+_JOSA_LENS = sorted({len(j) for j in JOSA}, reverse=True)
+
+def tokenize_regex(text: str) -> List[str]:
+    # 영문/숫자/한글만 추출 → 소문자 → 토큰 리스트
+    return _WORD_RE.findall((text or "").lower())
+
+@lru_cache(maxsize=65536)
+def strip_josa(word: str) -> str:
+    # 어절마다 길이별 접미사 집합 조회 몇 번 + 자주 나오는 어절은 캐시
+    if not _HANGUL_RE.match(word):
+        return word
+    for n in _JOSA_LENS:
+        stem = len(word) - n
+        if stem >= (2 if n == 1 else 1) and word[stem:] in JOSA:
+            return word[:stem]
+    return word
+
+def tokenize_josa(text: str) -> List[str]:
+    # 원형도 남겨 둠 → "고양이"(→고양)와 "고양이가"(→고양이)처럼 한쪽만 잘려도 원형으로 일치
+    out: List[str] = []
+    for w in tokenize_regex(text):
+        out.append(w)
+        s = strip_josa(w)
+        if s != w:
+            out.append(s)
+    return out
+
+def tokenize_bigram(text: str) -> List[str]:
+    out: List[str] = []
+    for w in tokenize_regex(text):
+        if len(w) > 2 and _HANGUL_RE.match(w):
+            out.extend(w[i:i+2] for i in range(len(w) - 1))
+        else:
+            out.append(w)
+    return out
+
+TOKENIZERS: Dict[str, Callable[[str], List[str]]] = {
+    "regex": tokenize_regex, "josa": tokenize_josa, "bigram": tokenize_bigram,
+}
+
+def get_tokenizer(name: str) -> Callable[[str], List[str]]:
+    if name not in TOKENIZERS:
+        raise ValueError(f"알 수 없는 BM25 토크나이저: {name} (가능: {', '.join(TOKENIZERS)})")
+    return TOKENIZERS[name]
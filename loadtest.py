@@ -0,0 +1,127 @@
+import os, sys, json, time, random, asyncio, argparse
+from typing import Any, Dict, List
+import httpx
+
+from benchmark import load_questions, percentile, QUESTIONS
+
+# server.py 부하 테스트: 가상 사용자 N명이 각자 세션으로 여러 턴을 보냄 (SSE 스트리밍 또는 /chat)
+#   python fake_openai.py --port 8765 &
+#   OPENAI_BASE_URL=http://127.0.0.1:8765/v1 OPENAI_API_KEY=fake FAKE_TOKEN_MS=20 python server.py --workers 2 &
+#   python loadtest.py --url http://127.0.0.1:8000 --users 32 --turns 4
+
+async def sse_events(resp: httpx.Response):
+    event, data = "message", []
+    async for line in resp.aiter_lines():
+        if not line:
+            if data:
+                yield event, json.loads("\n".join(data))
+            event, data = "message", []
+        elif line.startswith("event:"):
+            event = line[6:].strip()
+        elif line.startswith("data:"):
+            data.append(line[5:].strip())
+
+async def one_turn(client: httpx.AsyncClient, body: Dict[str, Any], stream: bool) -> Dict[str, Any]:
+    t0 = time.perf_counter()
+    out: Dict[str, Any] = {"ok": False, "ttft": None}
+    if not stream:
+        r = await client.post("/chat", json=body)
+        out["total"] = time.perf_counter() - t0
+        if r.status_code != 200:
+            out["error"] = f"{r.status_code}"
+            return out
+        data = r.json()
+        out.update(ok=True, ttft=out["total"], session_id=data["session_id"], cache=data["timing"].get("cache"))
+        return out
+    async with client.stream("POST", "/chat/stream", json=body) as r:
+        if r.status_code != 200:
+            await r.aread()
+            out.update(total=time.perf_counter() - t0, error=f"{r.status_code}")
+            return out
+        async for event, data in sse_events(r):
+            if event == "meta":
+                out["session_id"] = data["session_id"]
+            elif event == "delta" and out["ttft"] is None:
+                out["ttft"] = time.perf_counter() - t0
+            elif event == "error":
+                out["error"] = str(data.get("status", "error"))
+            elif event == "done":
+                out.update(ok=True, cache=data["timing"].get("cache"))
+    out["total"] = time.perf_counter() - t0
+    return out
+
+async def user(client: httpx.AsyncClient, uid: int, questions: List[dict], turns: int, stream: bool,
+               results: List[Dict[str, Any]], rng: random.Random) -> None:
+    sid = None
+    q0 = rng.choice(questions)
+    for t in range(turns):
+        q = q0 if t == 0 else rng.choice([x for x in questions if x.get("work_id") == q0.get("work_id")] or questions)
+        body = {"message": q["query"], "work_id": q.get("work_id"), "speak_as": q.get("speak_as", ""), "session_id": sid}
+        try:
+            res = await one_turn(client, body, stream)
+        except httpx.HTTPError as e:
+            res = {"ok": False, "error": type(e).__name__, "total": None, "ttft": None}
+        res["user"], res["turn"] = uid, t
+        results.append(res)
+        sid = res.get("session_id") or sid
+
+def summarize_ms(xs: List[float]) -> Dict[str, float]:
+    xs = [x * 1000 for x in xs if x is not None]
+    return {"p50_ms": percentile(xs, 50), "p95_ms": percentile(xs, 95), "max_ms": max(xs) if xs else 0.0, "n": len(xs)}
+
+async def run(args) -> Dict[str, Any]:
+    questions = load_questions(args.questions)
+    rng = random.Random(args.seed)
+    results: List[Dict[str, Any]] = []
+    limits = httpx.Limits(max_connections=args.users, max_keepalive_connections=args.users)
+    async with httpx.AsyncClient(base_url=args.url, timeout=args.timeout, limits=limits) as client:
+        health = (await client.get("/health")).json()
+        t0 = time.perf_counter()
+        await asyncio.gather(*(user(client, u, questions, args.turns, not args.no_stream, results, rng)
+                               for u in range(args.users)))
+        wall = time.perf_counter() - t0
+    ok = [r for r in results if r["ok"]]
+    errors: Dict[str, int] = {}
+    for r in results:
+        if not r["ok"]:
+            errors[r.get("error", "?")] = errors.get(r.get("error", "?"), 0) + 1
+    return {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config": {"url": args.url, "users": args.users, "turns": args.turns, "stream": not args.no_stream},
+        "server": {"docs": health.get("docs")},
+        "requests": len(results), "ok": len(ok), "errors": errors,
+        "cache_hits": sum(1 for r in ok if r.get("cache") is not None),
+        "wall_s": wall, "rps": len(ok) / wall if wall else 0.0,
+        "ttft": summarize_ms([r["ttft"] for r in ok]),
+        "total": summarize_ms([r["total"] for r in ok]),
+    }
+
+def main():
+    ap = argparse.ArgumentParser(description="server.py 부하 테스트 (fake_openai.py와 함께)")
+    ap.add_argument("--url", default=os.getenv("CHAT_API_URL", "http://127.0.0.1:8000"))
+    ap.add_argument("--users", type=int, default=16, help="동시 가상 사용자(세션) 수")
+    ap.add_argument("--turns", type=int, default=3, help="사용자당 턴 수")
+    ap.add_argument("--questions", default=QUESTIONS)
+    ap.add_argument("--no-stream", action="store_true", help="SSE 대신 /chat 사용")
+    ap.add_argument("--timeout", type=float, default=120.0)
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--out", default="", help="결과 JSON 경로")
+    args = ap.parse_args()
+
+    res = asyncio.run(run(args))
+    print(f"[LOAD] {res['ok']}/{res['requests']} ok, {res['rps']:.1f} turns/s over {res['wall_s']:.2f}s "
+          f"(users = {args.users}, turns = {args.turns}, stream = {int(not args.no_stream)}, "
+          f"answer-cache hits = {res['cache_hits']})")
+    for k in ("ttft", "total"):
+        m = res[k]
+        print(f"[LAT] {k:<6} p50 {m['p50_ms']:8.1f} ms   p95 {m['p95_ms']:8.1f} ms   max {m['max_ms']:8.1f} ms")
+    if res["errors"]:
+        print("[ERR] " + ", ".join(f"{k} × {v}" for k, v in res["errors"].items()))
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(res, f, ensure_ascii=False, indent=2)
+        print(f"[SAVE] {args.out}")
+    sys.exit(1 if not res["ok"] else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,300 @@
+import os, re, json, time, random, threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List, Optional
+
+# 턴 단위 계측: 단계별 타이머 + 카운터(토큰, 캐시 적중, 후보 수) → JSONL 한 줄 / Prometheus 텍스트
+#   METRICS=0(기본)이면 NULL_TRACE(아무것도 하지 않는 객체)만 돌려줌 → 호출부 비용은 메서드 호출 몇 번
+#   PROFILE_SLOW_MS>0 이면 PROFILE_SAMPLE 비율의 턴에 프로파일러를 붙이고, 느린 턴의 결과만 저장
+#   프로파일러는 trace.profiling() 구간에서만 그 구간을 실행하는 스레드에 켜짐 → 서버처럼 prepare/complete가
+#   서로 다른 스레드 풀 스레드에서 돌아도 구간마다 켜고 끄며 한 프로파일에 누적
+METRICS         = os.getenv("METRICS", "0") == "1"
+METRICS_PATH    = os.getenv("METRICS_PATH", "rag/.artifacts/metrics.jsonl").replace("\\","/")  # 빈 값이면 JSONL 안 씀
+METRICS_PORT    = int(os.getenv("METRICS_PORT", "0"))         # >0: http://127.0.0.1:<port>/metrics
+PROFILE_SLOW_MS = float(os.getenv("PROFILE_SLOW_MS", "0"))    # 이보다 오래 걸린 턴의 프로파일만 저장, 0이면 끔
+PROFILE_SAMPLE  = float(os.getenv("PROFILE_SAMPLE", "0.1"))   # 프로파일러를 붙일 턴 비율
+PROFILER        = os.getenv("PROFILER", "auto")               # auto(pyinstrument 있으면) | pyinstrument | cprofile
+PROFILE_DIR     = os.getenv("PROFILE_DIR", "rag/.artifacts/profiles").replace("\\","/")
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)   # 초
+
+try:
+    import pyinstrument   # 선택: 샘플링 프로파일러(오버헤드 작음)
+except ImportError:
+    pyinstrument = None
+
+_prof_lock = threading.Lock()   # 프로파일러는 프로세스에 하나만 (cProfile 중첩 불가)
+
+def _metric_name(s: str) -> str:
+    return re.sub(r"[^a-zA-Z0-9_]", "_", s)
+
+class _Stage:
+    __slots__ = ("trace", "name", "t")
+
+    def __init__(self, trace: "Trace", name: str):
+        self.trace, self.name = trace, name
+
+    def __enter__(self):
+        self.t = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.trace.add_stage(self.name, time.perf_counter() - self.t)
+        return False
+
+class _Profiling:
+    __slots__ = ("prof",)
+
+    def __init__(self, prof):
+        self.prof = prof
+
+    def __enter__(self):
+        kind, p = self.prof
+        p.start() if kind == "pyinstrument" else p.enable()
+        return self
+
+    def __exit__(self, *exc):
+        kind, p = self.prof
+        p.stop() if kind == "pyinstrument" else p.disable()
+        return False
+
+class Trace:
+    enabled = True
+
+    def __init__(self, metrics: "Metrics", **fields):
+        self.metrics = metrics
+        self.t0 = time.perf_counter()
+        self.fields: Dict[str, Any] = dict(fields)
+        self.stages: Dict[str, float] = {}
+        self.counts: Dict[str, float] = {}
+        self.done = False
+        self._prof = metrics._start_profile()
+
+    def stage(self, name: str) -> _Stage:
+        return _Stage(self, name)
+
+    def profiling(self):
+        # 이 구간(동기 코드, 한 스레드 안)만 프로파일. 샘플링되지 않은 턴이면 아무것도 안 함
+        if self._prof is None or self.done:
+            return _NULL_STAGE
+        return _Profiling(self._prof)
+
+    def add_stage(self, name: str, seconds: float) -> None:
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def add_stages(self, timings: Dict[str, Any], prefix: str = "") -> None:
+        # Retriever.retrieve가 채운 timings(초) 같은 dict에서 숫자 값만 가져옴
+        for k, v in timings.items():
+            if isinstance(v, (int, float)) and not isinstance(v, bool):
+                self.add_stage(prefix + k, v)
+
+    def count(self, name: str, n: float = 1) -> None:
+        self.counts[name] = self.counts.get(name, 0) + n
+
+    def set(self, **fields) -> None:
+        self.fields.update(fields)
+
+    def abort(self) -> None:
+        # 턴이 예외로 끝났을 때: 기록하지 않고 프로파일러/락만 정리. finish 뒤에 불러도 됨(finally용)
+        if self.done:
+            return
+        self.done = True
+        if self._prof is not None:
+            self.metrics._stop_profile(self._prof, 0.0, save=False)
+
+    def finish(self, **fields) -> Optional[Dict[str, Any]]:
+        # 한 턴에 한 번만 기록 → 두 번째 호출과 abort 뒤 호출은 무시
+        if self.done:
+            return None
+        self.done = True
+        self.fields.update(fields)
+        total = time.perf_counter() - self.t0
+        rec = {"ts": time.strftime("%Y-%m-%dT%H:%M:%S"), "total_ms": round(total * 1000, 2), **self.fields,
+               "stages_ms": {k: round(v * 1000, 2) for k, v in self.stages.items()}, "counts": self.counts}
+        if self._prof is not None:
+            path = self.metrics._stop_profile(self._prof, total)
+            if path:
+                rec["profile"] = path
+        self.metrics.record(rec, total, self.stages, self.counts)
+        return rec
+
+class _NullStage:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_NULL_STAGE = _NullStage()
+
+class _NullTrace:
+    enabled = False
+
+    def stage(self, name: str) -> _NullStage:
+        return _NULL_STAGE
+
+    def profiling(self) -> _NullStage:
+        return _NULL_STAGE
+
+    def add_stage(self, name: str, seconds: float) -> None:
+        pass
+
+    def add_stages(self, timings: Dict[str, Any], prefix: str = "") -> None:
+        pass
+
+    def count(self, name: str, n: float = 1) -> None:
+        pass
+
+    def set(self, **fields) -> None:
+        pass
+
+    def abort(self) -> None:
+        pass
+
+    def finish(self, **fields) -> None:
+        return None
+
+NULL_TRACE = _NullTrace()
+
+class Metrics:
+    def __init__(self, path: str = METRICS_PATH, slow_ms: float = PROFILE_SLOW_MS, sample: float = PROFILE_SAMPLE,
+                 profiler: str = PROFILER, profile_dir: str = PROFILE_DIR):
+        self.path, self.slow_ms, self.sample = path, slow_ms, sample
+        self.profiler, self.profile_dir = profiler, profile_dir
+        if path and os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+        self.turn_hist: List[Any] = [[0] * (len(BUCKETS) + 1), 0.0, 0]   # [버킷별 개수, 합, 개수]
+        self.stage_hist: Dict[str, List[Any]] = {}                       # stage → 같은 형태
+        self.counters: Dict[str, float] = {}
+        self.gauges: Dict[str, Callable[[], float]] = {}
+        self.server: Optional[ThreadingHTTPServer] = None
+
+    def trace(self, **fields) -> Trace:
+        return Trace(self, **fields)
+
+    def gauge(self, name: str, fn: Callable[[], float]) -> None:
+        # 스크랩 시점에 값을 읽는 게이지 (예: 캐시 크기/적중률)
+        self.gauges[name] = fn
+
+    @property
+    def turns(self) -> int:
+        return self.turn_hist[2]
+
+    @staticmethod
+    def _observe(h: List[Any], seconds: float) -> None:
+        buckets = h[0]
+        for i, b in enumerate(BUCKETS):
+            if seconds <= b:
+                buckets[i] += 1
+                break
+        else:
+            buckets[-1] += 1
+        h[1] += seconds
+        h[2] += 1
+
+    def record(self, rec: Dict[str, Any], total: float, stages: Dict[str, float], counts: Dict[str, float]) -> None:
+        line = json.dumps(rec, ensure_ascii=False) if self.path else None
+        with self._lock:
+            self._observe(self.turn_hist, total)
+            for name, sec in stages.items():
+                self._observe(self.stage_hist.setdefault(name, [[0] * (len(BUCKETS) + 1), 0.0, 0]), sec)
+            for name, n in counts.items():
+                self.counters[name] = self.counters.get(name, 0) + n
+            if line is not None:
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(line + "\n")
+
+    def render_prometheus(self) -> str:
+        out: List[str] = []
+
+        def hist(name: str, labels: str, buckets: List[int], total: float, n: int) -> None:
+            acc = 0
+            for b, c in zip(BUCKETS, buckets):
+                acc += c
+                out.append(f'{name}_bucket{{{labels}le="{b}"}} {acc}')
+            out.append(f'{name}_bucket{{{labels}le="+Inf"}} {n}')
+            lab = f"{{{labels.rstrip(',')}}}" if labels else ""
+            out.append(f"{name}_sum{lab} {total:.6f}")
+            out.append(f"{name}_count{lab} {n}")
+
+        with self._lock:
+            out += ["# TYPE chat_turn_seconds histogram"]
+            hist("chat_turn_seconds", "", *self.turn_hist)
+            out += ["# TYPE chat_stage_seconds histogram"]
+            for stage, (b, total, n) in sorted(self.stage_hist.items()):
+                hist("chat_stage_seconds", f'stage="{stage}",', b, total, n)
+            for name, v in sorted(self.counters.items()):
+                m = f"chat_{_metric_name(name)}_total"
+                out += [f"# TYPE {m} counter", f"{m} {v:g}"]
+        for name, fn in sorted(self.gauges.items()):
+            try:
+                v = float(fn())
+            except Exception:
+                continue
+            m = f"chat_{_metric_name(name)}"
+            out += [f"# TYPE {m} gauge", f"{m} {v:g}"]
+        return "\n".join(out) + "\n"
+
+    def serve(self, port: int = METRICS_PORT, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, fmt, *args):
+                pass
+
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = metrics.render_prometheus().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        print(f"[METRICS] http://{host}:{self.server.server_address[1]}/metrics")
+        return self.server
+
+    # ---- 느린 턴 프로파일 ----
+    def _start_profile(self):
+        if self.slow_ms <= 0 or random.random() >= self.sample:
+            return None
+        if not _prof_lock.acquire(blocking=False):
+            return None
+        # 만들기만 하고 켜지는 않음 → Trace.profiling() 구간에서 켜고 끔
+        try:
+            if self.profiler in ("auto", "pyinstrument") and pyinstrument is not None:
+                return ("pyinstrument", pyinstrument.Profiler(async_mode="disabled"))
+            import cProfile
+            return ("cprofile", cProfile.Profile())
+        except Exception:
+            _prof_lock.release()
+            return None
+
+    def _stop_profile(self, prof, total: float, save: bool = True) -> Optional[str]:
+        # 프로파일에는 profiling() 구간만 들어감 (검색 스레드 풀 내부, 비동기 생성 대기는 포함되지 않음)
+        kind, p = prof
+        try:
+            if not save or total * 1000 < self.slow_ms:
+                return None
+            os.makedirs(self.profile_dir, exist_ok=True)
+            base = os.path.join(self.profile_dir, f"turn_{time.strftime('%Y%m%d-%H%M%S')}_{int(total * 1000)}ms")
+            if kind == "pyinstrument":
+                with open(base + ".html", "w", encoding="utf-8") as f:
+                    f.write(p.output_html())
+                return base + ".html"
+            p.dump_stats(base + ".prof")
+            return base + ".prof"
+        finally:
+            _prof_lock.release()
+
+def from_env() -> Optional[Metrics]:
+    return Metrics() if METRICS else None
+
+def start_trace(metrics: Optional[Metrics], **fields):
+    return metrics.trace(**fields) if metrics is not None else NULL_TRACE
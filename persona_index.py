@@ -0,0 +1,145 @@
+import re
+from typing import List, Dict, Tuple, Iterable, Optional
+
+from bm25_index import tokenize
+from query_cache import TTLCache
+
+PERSONA_KINDS = ["persona", "characters_raw"]
+
+# characters_raw 섹션의 "• 동호 – 역할: ..." 같은 인물 항목
+_ENTRY_RE = re.compile(r"^\s*[•\-\*·▪◦]\s*([가-힣A-Za-z][가-힣A-Za-z ]{0,14}?)\s*[–—\-:(（]", re.M)
+_NAME_RE = re.compile(r"^[가-힣]{2,4}$")
+_PARTICLE_RE = re.compile(r"(이?야|아|씨|님|이가|이는|이를|는|은|가|이|을|를)$")
+_ALIAS_MAX = 10   # 이보다 긴 항목은 이름이 아니라 문장 조각("이희수 할머니는 아영이 …")
+_BAD_ALIAS_RE = re.compile(r"[\s\W_]")
+_NOT_NAMES = {"https", "http", "www"}
+_HEAD_RE = re.compile(r"[가-힣A-Za-z]+")
+_MEMO_MAX = 2048   # (work_id, speak_as) 조회 결과 LRU 크기. speak_as는 자유 입력이라 상한 필요
+_SURNAMES = set("김이박최정강조윤장임한오서신권황안송전홍유고문양손배백허남심노하곽성차주우구민류나진지엄채원천방공현함변염여추도소석선설마길연위표명기반왕금옥육인맹탁국은편용예경봉부복태목형피두감호")
+
+def _norm(name: str) -> str:
+    return re.sub(r"\s+", "", name or "")
+
+def _bare(name: str) -> str:
+    return _PARTICLE_RE.sub("", name) if len(name) > 2 else name
+
+def _chunk_no(doc_id: str) -> int:
+    tail = doc_id.rsplit("::", 1)[-1]
+    return int(tail) if tail.isdigit() else 0
+
+def _is_name(part: str) -> bool:
+    # 공백/문장부호가 섞였거나 너무 긴 것, URL 조각은 인물 이름으로 보지 않음
+    return bool(part) and len(part) <= _ALIAS_MAX and part not in _NOT_NAMES and not _BAD_ALIAS_RE.search(part)
+
+def name_aliases(name: str) -> List[str]:
+    # 한유진 → [한유진, 유진], "레이첼(Rachel)" → [레이첼, rachel] …
+    out = []
+    for part in re.split(r"[()（）/,·]", name or ""):
+        part = part.strip().lower()
+        if not _is_name(part):
+            continue
+        out.append(part)
+        if _NAME_RE.match(part) and len(part) == 3 and part[0] in _SURNAMES:
+            out.append(part[1:])   # 성 제외한 이름
+    return list(dict.fromkeys(out))
+
+class PersonaIndex:
+    # work_id → 인물 alias → 정렬된 페르소나 청크 id 목록. 조회는 dict 한 번(부분 일치 결과도 LRU memo)
+
+    def __init__(self, memo_size: int = _MEMO_MAX):
+        self.texts: Dict[str, str] = {}
+        self.kind: Dict[str, str] = {}
+        self.by_work: Dict[str, Dict[str, List[str]]] = {}
+        self._memo = TTLCache(maxsize=memo_size, ttl=0)
+
+    def __len__(self):
+        return len(self.texts)
+
+    def _add(self, work: str, alias: str, doc_id: str):
+        ids = self.by_work.setdefault(work, {}).setdefault(alias, [])
+        if doc_id not in ids:
+            ids.append(doc_id)
+
+    @classmethod
+    def build(cls, rows: Iterable[Tuple[str, str, dict]]) -> "PersonaIndex":
+        idx = cls()
+        rows = sorted(rows, key=lambda r: (r[2].get("kind") != "persona", r[0].rsplit("::", 1)[0], _chunk_no(r[0])))
+        headed: List[Tuple[str, str, str]] = []
+        for doc_id, text, meta in rows:
+            if not isinstance(text, str) or not text.strip():
+                continue
+            work, kind = meta.get("work_id", ""), meta.get("kind", "")
+            idx.texts[doc_id] = text
+            idx.kind[doc_id] = kind
+            if kind == "persona":
+                aliases = name_aliases(meta.get("character", ""))
+                for a in aliases:
+                    idx._add(work, a, doc_id)
+                if not aliases:
+                    headed.append((work, meta.get("character", ""), doc_id))
+            # 통짜 인물 섹션은 본문 속 인물 항목 이름으로 색인
+            for m in _ENTRY_RE.finditer(text):
+                for a in name_aliases(m.group(1)):
+                    idx._add(work, a, doc_id)
+        # 제목이 문장인 persona 청크("레이첼의 말투와 성격")는 첫 낱말이 이미 아는 인물 이름으로 시작하면 그 인물에 붙임
+        for work, header, doc_id in headed:
+            m = _HEAD_RE.match(header.strip())
+            head = m.group(0).lower() if m else ""
+            known = [a for a in idx.by_work.get(work, {}) if len(a) >= 2 and head.startswith(a)]
+            if known:
+                idx._add(work, max(known, key=len), doc_id)
+        return idx
+
+    @classmethod
+    def build_from_collection(cls, col) -> "PersonaIndex":
+        res = col.get(where={"kind": {"$in": PERSONA_KINDS}}, include=["documents", "metadatas"])
+        return cls.build(zip(res.get("ids") or [], res.get("documents") or [],
+                             [m or {} for m in (res.get("metadatas") or [])]))
+
+    def lookup(self, work_id: str, speak_as: str) -> List[str]:
+        key = (work_id, _norm(speak_as).lower())
+        hit = self._memo.get(key)
+        if hit is not None:
+            return hit
+        aliases = self.by_work.get(work_id, {})
+        name = key[1]
+        ids: List[str] = []
+        if name:
+            # 정확 일치 / 호격·조사 제거 후 일치("동호야" → "동호")가 있으면 그것만 씀
+            #   → "동호"가 "동호의어머니" 같은 다른 인물 항목에 부분 일치로 끌려가지 않도록
+            for n in dict.fromkeys((name, _bare(name))):
+                ids += [i for i in aliases.get(n, []) if i not in ids]
+            if not ids:
+                # 부분 일치("동호" ⊂ "강동호", 기존 `speak_as in character` 동작)
+                for a, a_ids in aliases.items():
+                    if name in a:
+                        ids += [i for i in a_ids if i not in ids]
+            if not ids:
+                # alias 뒤에 조사만 붙은 경우("유진이랑" ⊃ "유진"). "동호의 어머니"처럼 뒤가 길면 다른 인물
+                for a, a_ids in aliases.items():
+                    if len(a) >= 2 and name.startswith(a) and len(name) - len(a) <= 2:
+                        ids += [i for i in a_ids if i not in ids]
+        ids.sort(key=lambda i: self.kind.get(i) != "persona")
+        self._memo.put(key, ids)
+        return ids
+
+    def rank(self, work_id: str, speak_as: str, query: Optional[str] = None) -> List[Tuple[str, float]]:
+        # 이름 정확 일치 > 전용 persona 청크 > 인물 섹션 언급, 같은 등급 안에서는 질의어/이름 겹침 → 청크 순서
+        ids = self.lookup(work_id, speak_as)
+        if not ids:
+            return []
+        q = set(tokenize(query or ""))
+        name = _bare(_norm(speak_as))
+        aliases = self.by_work.get(work_id, {})
+        exact = {i for n in (_norm(speak_as).lower(), name.lower()) for i in aliases.get(n, [])}
+        scored = []
+        for rank, did in enumerate(ids):
+            text = self.texts[did]
+            s = 3.0 if did in exact else 0.0
+            s += 2.0 if self.kind.get(did) == "persona" else 0.0
+            s += min(text.count(name), 5) * 0.1 if name else 0.0
+            if q:
+                s += len(q & set(tokenize(text))) / len(q)
+            scored.append((did, s - rank * 1e-3))
+        scored.sort(key=lambda x: x[1], reverse=True)
+        return scored
@@ -0,0 +1,183 @@
+import os, re
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from bm25_index import tokenize
+
+# 토큰 예산 안에서 프롬프트 조립: system(+페르소나) → 이전 대화 요약(memory) → 최근 대화 → 질문 + 컨텍스트 카드
+#   카드는 질의어와 겹치는 문장만 골라 원래 순서대로, 예산이 남는 만큼만 넣음
+PROMPT_BUDGET   = int(os.getenv("PROMPT_BUDGET", "3000"))    # 입력 프롬프트 전체 토큰 상한
+PERSONA_TOKENS  = int(os.getenv("PERSONA_TOKENS", "600"))
+MEMORY_TOKENS   = int(os.getenv("MEMORY_TOKENS", "300"))
+HISTORY_TURNS   = int(os.getenv("HISTORY_TURNS", "6"))      # 원문 그대로 넣을 최근 메시지 수(그 이전은 memory로)
+HISTORY_TOKENS  = int(os.getenv("HISTORY_TOKENS", "800"))
+CARD_MIN_TOKENS = int(os.getenv("CARD_MIN_TOKENS", "120"))  # 카드 한 장에 줄 최소 예산 (이보다 적게 남으면 중단)
+MAX_CARDS       = int(os.getenv("MAX_CARDS", "8"))
+MSG_OVERHEAD    = 4   # 메시지당 role/구분자 토큰
+
+try:
+    import tiktoken   # requirements.txt에 포함. 없거나 인코딩을 못 받으면 어림값(heuristic)으로 계산
+except ImportError:
+    tiktoken = None
+
+_enc = None   # None: 아직 안 정함, False: tiktoken 사용 불가(어림값)
+
+def _encoding():
+    global _enc
+    if _enc is None:
+        _enc = False
+        if tiktoken is not None:
+            try:
+                _enc = tiktoken.encoding_for_model(os.getenv("MODEL", "gpt-4o"))
+            except Exception:
+                try:
+                    _enc = tiktoken.get_encoding("cl100k_base")
+                except Exception:
+                    pass   # 오프라인 등으로 BPE 파일을 못 받음
+        if _enc is False:
+            # 예산이 실제 토큰 수가 아니라 추정치라는 걸 한 번만 알림
+            print("[WARN] tiktoken을 쓸 수 없어 프롬프트 토큰 수를 어림값으로 계산합니다 "
+                  "(PROMPT_BUDGET은 근사치). pip install tiktoken")
+    return _enc or None
+
+def tokenizer_name() -> str:
+    return _encoding().name if _encoding() is not None else "heuristic"
+
+def count_tokens(text: str) -> int:
+    if not text:
+        return 0
+    enc = _encoding()
+    if enc is not None:
+        return len(enc.encode(text, disallowed_special=()))
+    # tiktoken 없을 때: 한글 1글자 ≈ 1토큰, 그 외는 4바이트 ≈ 1토큰 (조금 넉넉하게)
+    hangul = len(re.findall(r"[가-힣]", text))
+    rest = len(text.encode("utf-8")) - hangul * 3
+    return hangul + rest // 4 + 1
+
+_SENT_RE = re.compile(r"[^.!?…\n]+(?:[.!?…]+|\n|$)")
+
+def sentences(text: str) -> List[str]:
+    return [s.strip() for s in _SENT_RE.findall(text or "") if s.strip()]
+
+def trim_to_tokens(text: str, budget: int) -> str:
+    # 앞에서부터 문장 단위로 예산까지 (한 문장도 안 들어가면 글자 단위로 자름)
+    if count_tokens(text) <= budget:
+        return text
+    out, used = [], 0
+    for s in sentences(text):
+        n = count_tokens(s) + 1
+        if used + n > budget:
+            break
+        out.append(s)
+        used += n
+    if out:
+        return " ".join(out)
+    cut = text
+    while cut and count_tokens(cut) > budget:
+        cut = cut[:int(len(cut) * 0.8)]
+    return cut
+
+def extract_relevant(text: str, query: str, budget: int) -> str:
+    # 질의어 커버리지가 높은 문장부터 예산까지 고르고 원래 순서로 이어 붙임
+    if count_tokens(text) <= budget:
+        return text
+    sents = sentences(text)
+    q = set(tokenize(query))
+    def score(s: str) -> float:
+        if not q:
+            return 0.0
+        low = s.lower()
+        return sum(1 for t in q if t in low or (len(t) >= 3 and t[:-1] in low)) / len(q)
+    order = sorted(range(len(sents)), key=lambda i: (-score(sents[i]), i))
+    picked, used = [], 0
+    for i in order:
+        n = count_tokens(sents[i]) + 1
+        if used + n > budget:
+            continue
+        picked.append(i)
+        used += n
+    if not picked:
+        return trim_to_tokens(text, budget)
+    return " … ".join(sents[i] for i in sorted(picked)) if len(picked) < len(sents) else text
+
+class RollingMemory:
+    # 최근 HISTORY_TURNS개 이전의 대화를 한 줄씩 접어 넣는 요약 메모리.
+    #   기본은 추출식(질문 앞부분 + 답의 첫 문장), summarize를 주면 예산 초과 시 그 함수로 다시 압축
+    def __init__(self, budget: int = MEMORY_TOKENS, summarize: Optional[Callable[[str], str]] = None):
+        self.budget, self.summarize = budget, summarize
+        self.lines: List[str] = []
+        self.folded = 0
+
+    @property
+    def text(self) -> str:
+        return "\n".join(self.lines)
+
+    def update(self, history: List[Dict[str, Any]], keep_recent: int = HISTORY_TURNS) -> None:
+        upto = max(0, len(history) - keep_recent)
+        if upto < self.folded:
+            # 대화가 초기화된 경우
+            self.lines, self.folded = [], 0
+        for m in history[self.folded:upto]:
+            first = (sentences(m.get("content", "")) or [""])[0]
+            who = "사용자" if m.get("role") == "user" else "인물"
+            self.lines.append(f"- {who}: {trim_to_tokens(first, 60)}")
+        self.folded = max(self.folded, upto)
+        if count_tokens(self.text) > self.budget:
+            if self.summarize is not None:
+                self.lines = [trim_to_tokens(self.summarize(self.text), self.budget)]
+            while len(self.lines) > 1 and count_tokens(self.text) > self.budget:
+                self.lines.pop(0)
+
+def build_messages(system: str, query: str, cards: List[Tuple[str, str]], persona: str = "",
+                   history: Optional[List[Dict[str, Any]]] = None, memory: str = "",
+                   budget: int = PROMPT_BUDGET) -> Tuple[List[Dict[str, str]], Dict[str, Any]]:
+    # cards: [(제목, 본문)] 순위 순. 반환: (messages, 섹션별 토큰 내역)
+    report: Dict[str, Any] = {"budget": budget, "tokenizer": tokenizer_name()}
+
+    persona = trim_to_tokens(persona, PERSONA_TOKENS) if persona else ""
+    memory = trim_to_tokens(memory, MEMORY_TOKENS) if memory else ""
+    sys_text = system
+    if persona:
+        sys_text += "\n\n" + persona
+    if memory:
+        sys_text += "\n\n[이전 대화 요약]\n" + memory
+    report["system"] = count_tokens(system) + MSG_OVERHEAD
+    report["persona"] = count_tokens(persona)
+    report["memory"] = count_tokens(memory)
+
+    head = f"질문: {query}\n\n[컨텍스트]\n"
+    report["question"] = count_tokens(head) + MSG_OVERHEAD
+    fixed = report["system"] + report["persona"] + report["memory"] + report["question"]
+
+    # 최근 대화: 최신 메시지부터 예산 안에서 (role/content만). 카드 최소 2장 몫은 남겨 둠
+    reserve = min(len(cards), 2) * CARD_MIN_TOKENS
+    hist_budget = min(HISTORY_TOKENS, budget - fixed - reserve)
+    recent: List[Dict[str, str]] = []
+    used = 0
+    for m in reversed((history or [])[-HISTORY_TURNS:] if HISTORY_TURNS > 0 else []):
+        n = count_tokens(m["content"]) + MSG_OVERHEAD
+        if used + n > hist_budget:
+            break
+        recent.insert(0, {"role": m["role"], "content": m["content"]})
+        used += n
+    report["history"] = used
+    left = budget - fixed - used
+
+    # 컨텍스트 카드: 남은 예산을 남은 카드 수로 나눠 한 장씩 압축 (예산이 적으면 상위 카드만)
+    parts, ctx = [], 0
+    cards = cards[:min(MAX_CARDS, max(0, left) // CARD_MIN_TOKENS)]
+    for i, (title, txt) in enumerate(cards):
+        share = (left - ctx) // (len(cards) - i)
+        if share < CARD_MIN_TOKENS:
+            break
+        header = f"### {title}\n"
+        body = extract_relevant(txt, query, share - count_tokens(header) - 2)
+        card = header + body
+        parts.append(card)
+        ctx += count_tokens(card) + 2
+    report["context"] = ctx
+    report["cards"] = len(parts)
+
+    msgs = [{"role": "system", "content": sys_text}] + recent
+    msgs.append({"role": "user", "content": head + "\n\n".join(parts)})
+    report["total"] = sum(count_tokens(m["content"]) + MSG_OVERHEAD for m in msgs)
+    return msgs, report
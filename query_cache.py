@@ -0,0 +1,96 @@
+import re, time, threading
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, List, Optional
+
+from emb_cache import EmbeddingCache, text_key
+
+def normalize_query(text: str) -> str:
+    # "동호는 어떤 사람이야?" / "동호는  어떤 사람이야" → 같은 키
+    s = re.sub(r"\s+", " ", (text or "").strip().lower())
+    return re.sub(r"[\s?!.~…]+$", "", s)
+
+# 크기(LRU) + TTL 제한 인메모리 캐시. 스레드 안전, 적중률 카운터 포함
+class TTLCache:
+    def __init__(self, maxsize: int = 1024, ttl: float = 3600.0):
+        self.maxsize, self.ttl = maxsize, ttl
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        now = time.monotonic()
+        with self._lock:
+            item = self._data.get(key)
+            if item is None or (self.ttl and now - item[0] > self.ttl):
+                if item is not None:
+                    del self._data[key]
+                    self.evictions += 1
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def put(self, key: Hashable, value: Any) -> None:
+        with self._lock:
+            self._data[key] = (time.monotonic(), value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {"size": len(self._data), "hits": self.hits, "misses": self.misses,
+                "evictions": self.evictions, "hit_rate": self.hits / total if total else 0.0}
+
+# 질의 임베딩: 메모리(LRU+TTL) → (선택) 디스크 SQLite → API 순으로 조회
+class QueryEmbedder:
+    def __init__(self, client, model: str, maxsize: int = 1024, ttl: float = 86400.0,
+                 disk_path: Optional[str] = None):
+        self.client, self.model = client, model
+        self.mem = TTLCache(maxsize, ttl)
+        self.disk = EmbeddingCache(disk_path) if disk_path else None
+        self.api_calls = 0
+
+    def embed(self, text: str) -> List[float]:
+        return self.embed_many([text])[0]
+
+    def embed_many(self, texts: List[str]) -> List[List[float]]:
+        norm = [normalize_query(t) for t in texts]
+        out: Dict[str, List[float]] = {}
+        for q in norm:
+            if q not in out:
+                v = self.mem.get((self.model, q))
+                if v is not None:
+                    out[q] = v
+        todo = [q for q in dict.fromkeys(norm) if q not in out]
+        if todo and self.disk is not None:
+            found = self.disk.get_many(self.model, [text_key(q) for q in todo])
+            for q in todo:
+                v = found.get(text_key(q))
+                if v is not None:
+                    out[q] = v
+                    self.mem.put((self.model, q), v)
+            todo = [q for q in todo if q not in out]
+        if todo:
+            # 미스는 한 번의 요청으로 묶어서 임베딩
+            self.api_calls += 1
+            resp = self.client.embeddings.create(model=self.model, input=todo)
+            vecs = [d.embedding for d in sorted(resp.data, key=lambda d: d.index)]
+            for q, v in zip(todo, vecs):
+                out[q] = v
+                self.mem.put((self.model, q), v)
+            if self.disk is not None:
+                self.disk.put_many(self.model, ((text_key(q), v) for q, v in zip(todo, vecs)))
+        return [out[q] for q in norm]
+
+    def stats(self) -> Dict[str, Any]:
+        s = self.mem.stats()
+        s["api_calls"] = self.api_calls
+        if self.disk is not None:
+            s["disk_hits"], s["disk_misses"] = self.disk.hits, self.disk.misses
+        return s
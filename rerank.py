@@ -0,0 +1,138 @@
+import os
+from typing import Callable, Dict, List, Optional, Tuple
+import numpy as np
+
+from bm25_index import tokenize
+from query_cache import TTLCache
+
+# 융합(RRF) 후보 재정렬: 관련도 점수(여러 scorer 가중합) → 하한 컷 → MMR 다양성 선택
+#   RERANK=none  : 기존 동작(RRF 순서 그대로 top_k). 기본값 — 실제 임베딩으로 잰 이득이 없어 켜지 않음
+#   RERANK=score : 관련도 점수 순 + 하한 컷
+#   RERANK=mmr   : 관련도 + 이미 고른 카드와의 유사도 페널티(겹치는 청크 창이 슬롯을 나눠 먹지 않도록)
+#   켜기 전에 benchmark.py --rerank none|score|mmr --min-score ... 로 실제 질문 세트에서 비교할 것
+RERANK           = os.getenv("RERANK", "none")
+RERANK_LAMBDA    = float(os.getenv("RERANK_LAMBDA", "0.7"))     # 1에 가까울수록 관련도, 0에 가까울수록 다양성
+RERANK_MIN_SCORE = float(os.getenv("RERANK_MIN_SCORE", "0"))    # 결합 점수(0~1) 하한, 0이면 컷 없음
+RERANK_POOL      = int(os.getenv("RERANK_POOL", "3"))           # 재정렬 후보 수 = top_k × POOL
+RERANK_WEIGHTS   = os.getenv("RERANK_WEIGHTS", "rrf:1,semantic:1,lexical:0.5")
+RERANK_CACHE     = int(os.getenv("RERANK_CACHE", "4096"))       # 문서 벡터/본문 특징 캐시 크기
+
+class Cand:
+    __slots__ = ("id", "text", "meta", "rrf", "vec")
+
+    def __init__(self, id: str, text: str, meta: dict, rrf: float, vec: Optional[np.ndarray]):
+        self.id, self.text, self.meta, self.rrf, self.vec = id, text, meta, rrf, vec
+
+# scorer(query, qvec, cands) → 후보별 0~1 점수. SCORERS에 함수를 추가하면 RERANK_WEIGHTS로 바로 사용 가능
+Scorer = Callable[[str, Optional[np.ndarray], List[Cand]], Optional[np.ndarray]]
+
+def score_rrf(query: str, qvec, cands: List[Cand]) -> np.ndarray:
+    s = np.array([c.rrf for c in cands], dtype=np.float64)
+    return s / s.max() if len(s) and s.max() > 0 else s
+
+def score_semantic(query: str, qvec, cands: List[Cand]) -> Optional[np.ndarray]:
+    # 저장된 청크 임베딩과 질의 임베딩의 코사인 (질의 임베딩이 없으면 이 scorer는 빠짐)
+    if qvec is None or any(c.vec is None for c in cands):
+        return None
+    q = np.asarray(qvec, dtype=np.float32)
+    q = q / (np.linalg.norm(q) or 1.0)
+    return np.clip(np.stack([c.vec for c in cands]) @ q, 0.0, 1.0).astype(np.float64)
+
+def score_lexical(query: str, qvec, cands: List[Cand]) -> Optional[np.ndarray]:
+    # 질의어 커버리지. 조사 붙은 형태("동호가")도 어간("동호")이 본문에 있으면 인정
+    toks = list(dict.fromkeys(tokenize(query)))
+    if not toks:
+        return None
+    def covered(t: str, text: str) -> bool:
+        return t in text or (len(t) >= 3 and t[:-1] in text)
+    return np.array([sum(covered(t, c.text.lower()) for t in toks) / len(toks) for c in cands], dtype=np.float64)
+
+SCORERS: Dict[str, Scorer] = {"rrf": score_rrf, "semantic": score_semantic, "lexical": score_lexical}
+
+def parse_weights(spec: str) -> Dict[str, float]:
+    out = {}
+    for part in (spec or "").split(","):
+        name, _, w = part.strip().partition(":")
+        if name:
+            out[name] = float(w or 1.0)
+    return out
+
+class Reranker:
+    def __init__(self, mode: str = RERANK, lam: float = RERANK_LAMBDA, min_score: float = RERANK_MIN_SCORE,
+                 pool: int = RERANK_POOL, weights: Optional[Dict[str, float]] = None, cache_size: int = RERANK_CACHE):
+        unknown = set(weights or {}) - set(SCORERS)
+        if mode not in ("none", "score", "mmr") or unknown:
+            raise ValueError(f"알 수 없는 rerank 설정: mode={mode}, scorers={sorted(unknown)}")
+        self.mode, self.lam, self.min_score, self.pool = mode, lam, min_score, pool
+        self.weights = weights if weights is not None else parse_weights(RERANK_WEIGHTS)
+        # 문서 id → 정규화된 임베딩. 같은 청크가 여러 질의의 후보로 반복되므로 Chroma 재조회 생략
+        self.vecs = TTLCache(cache_size, ttl=0)
+
+    @property
+    def needs_vectors(self) -> bool:
+        return self.mode == "mmr" or self.weights.get("semantic", 0) > 0
+
+    def missing_vectors(self, ids: List[str]) -> List[str]:
+        return [i for i in ids if self.vecs.get(i) is None]
+
+    def put_vectors(self, ids: List[str], embs) -> None:
+        for i, v in zip(ids, embs):
+            v = np.asarray(v, dtype=np.float32)
+            self.vecs.put(i, v / (np.linalg.norm(v) or 1.0))
+
+    def scores(self, query: str, qvec, cands: List[Cand]) -> np.ndarray:
+        total, wsum = np.zeros(len(cands)), 0.0
+        for name, w in self.weights.items():
+            if w <= 0:
+                continue
+            s = SCORERS[name](query, qvec, cands)
+            if s is None:
+                continue
+            total += w * s
+            wsum += w
+        return total / wsum if wsum else total
+
+    def rerank(self, query: str, qvec, fused: List[Tuple[str, float]], docs: Dict[str, Tuple[str, dict]],
+               top_k: int) -> List[Tuple[str, str, dict, float]]:
+        cands = [Cand(did, docs[did][0], docs[did][1], rrf, self.vecs.get(did))
+                 for did, rrf in fused if did in docs]
+        if not cands:
+            return []
+        if self.mode == "none":
+            return [(c.id, c.text, c.meta, c.rrf) for c in cands[:top_k]]
+        rel = self.scores(query, qvec, cands)
+        # 하한 컷(최소 1장은 남김)
+        keep = [i for i in range(len(cands)) if rel[i] >= self.min_score] or [int(np.argmax(rel))]
+        if self.mode == "score" or len(keep) <= 1:
+            keep.sort(key=lambda i: -rel[i])
+            return [(cands[i].id, cands[i].text, cands[i].meta, float(rel[i])) for i in keep[:top_k]]
+
+        # MMR: λ·관련도 − (1−λ)·max(이미 고른 카드와의 유사도)
+        sim = self._similarity([cands[i] for i in keep])
+        chosen: List[int] = []
+        left = list(range(len(keep)))
+        max_sim = np.zeros(len(keep))
+        while left and len(chosen) < top_k:
+            best = max(left, key=lambda j: self.lam * rel[keep[j]] - (1 - self.lam) * max_sim[j])
+            chosen.append(best)
+            left.remove(best)
+            max_sim = np.maximum(max_sim, sim[best])
+        return [(cands[keep[j]].id, cands[keep[j]].text, cands[keep[j]].meta, float(rel[keep[j]])) for j in chosen]
+
+    @staticmethod
+    def _similarity(cands: List[Cand]) -> np.ndarray:
+        if all(c.vec is not None for c in cands):
+            m = np.stack([c.vec for c in cands])
+            return np.clip(m @ m.T, 0.0, 1.0)
+        # 벡터가 없으면 토큰 집합 Jaccard로 대체
+        sets = [set(tokenize(c.text)) for c in cands]
+        n = len(sets)
+        out = np.zeros((n, n))
+        for i in range(n):
+            for j in range(i, n):
+                u = len(sets[i] | sets[j])
+                out[i, j] = out[j, i] = len(sets[i] & sets[j]) / u if u else 0.0
+        return out
+
+def from_env() -> Optional[Reranker]:
+    return None if RERANK == "none" else Reranker()
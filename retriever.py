@@ -0,0 +1,259 @@
+import os, sys, json, time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from typing import Any, Dict, List, Optional, Tuple
+
+from bm25_index import BM25Index, load_or_build
+from query_cache import QueryEmbedder
+from emb_cache import EMB_MODEL
+from rerank import Reranker, from_env as reranker_from_env
+
+PERSIST_DIR   = os.getenv("PERSIST_DIR", "rag/.chroma").replace("\\","/")
+COLLECTION    = os.getenv("COLLECTION", "library-all")
+BM25_DIR      = os.getenv("BM25_DIR", "rag/.bm25").replace("\\","/")
+BM25_VERIFY   = os.getenv("BM25_VERIFY", "1") == "1"   # 1: 지문 비교(DB_MAKING 스탬프 → O(1)), 0: 문서 수만 비교
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "chroma")  # chroma | local(vector_store: int8 + mmap 재채점)
+VEC_DIR       = os.getenv("VEC_DIR", "rag/.vec").replace("\\","/")
+
+QCACHE_SIZE   = int(os.getenv("QCACHE_SIZE", "2048"))
+QCACHE_TTL    = float(os.getenv("QCACHE_TTL", "86400"))
+QCACHE_PATH   = os.getenv("QCACHE_PATH", "")   # 지정 시 질의 임베딩을 디스크(SQLite)에도 보존
+EMB_TIMEOUT   = float(os.getenv("EMB_TIMEOUT", "3.0"))    # 질의 임베딩 대기 한도(초) → 초과 시 BM25만 사용
+VEC_TIMEOUT   = float(os.getenv("VEC_TIMEOUT", "2.0"))    # col.query 대기 한도(초)
+RETRIEVAL_WORKERS = int(os.getenv("RETRIEVAL_WORKERS", "8"))
+
+Hit = Tuple[str, str, dict]
+
+def reciprocal_rank_fusion(results_lists, k=60):
+    scores = {}
+    for res in results_lists:
+        for rank, doc_id in enumerate(res, start=1):
+            scores[doc_id] = scores.get(doc_id, 0) + 1.0/(k+rank)
+    return sorted(scores.items(), key=lambda x: x[1], reverse=True)
+
+def chroma_where(work_id: Optional[str] = None, kinds: Optional[List[str]] = None) -> Optional[dict]:
+    # kind 필터는 대표 kind 또는 중복 제거로 흡수한 kind(kind_<k>=True 플래그) 중 하나와 일치하면 통과
+    clauses = []
+    if work_id:
+        clauses.append({"work_id": work_id})
+    if kinds:
+        clauses.append({"$or": [{"kind": {"$in": list(kinds)}}] + [{f"kind_{k}": True} for k in kinds]})
+    if not clauses:
+        return None
+    return clauses[0] if len(clauses) == 1 else {"$and": clauses}
+
+def open_collection(persist_dir: str = PERSIST_DIR, collection: str = COLLECTION,
+                    backend: str = VECTOR_BACKEND, vec_dir: str = VEC_DIR):
+    # 두 백엔드 모두 get/query/count/name을 제공 → 이후 코드는 백엔드를 구분하지 않음
+    if backend == "local":
+        from vector_store import LocalVectorStore, store_path
+        col = LocalVectorStore.open(store_path(collection, vec_dir))
+        if col is None:
+            raise SystemExit(f"[ERROR] 로컬 벡터 저장소가 없습니다: {store_path(collection, vec_dir)} "
+                             f"(VECTOR_BACKEND=local python DB_MAKING.py 로 생성)")
+        return col
+    if backend != "chroma":
+        raise ValueError(f"알 수 없는 VECTOR_BACKEND: {backend}")
+    import chromadb
+    return chromadb.PersistentClient(path=persist_dir).get_or_create_collection(name=collection, embedding_function=None)
+
+def _timed(fn):
+    # 작업 스레드는 (결과, 소요 시간)만 돌려줌 → 호출부가 제시간에 받은 것만 timings에 기록.
+    # 타임아웃 후 늦게 끝난 작업이 이미 반환된 timings를 건드리지 않도록
+    def run(*args, **kwargs):
+        t = time.perf_counter()
+        out = fn(*args, **kwargs)
+        return out, time.perf_counter() - t
+    return run
+
+# 하이브리드(벡터 + BM25) 검색기. Streamlit 없이도 import해서 평가/캐시 예열/배치 처리에 사용
+class Retriever:
+    def __init__(self, col, bm25: BM25Index, embedder: QueryEmbedder, pool: Optional[ThreadPoolExecutor] = None,
+                 emb_timeout: float = EMB_TIMEOUT, vec_timeout: float = VEC_TIMEOUT,
+                 reranker: Optional[Reranker] = None):
+        self.col, self.bm25, self.embedder = col, bm25, embedder
+        self.reranker = reranker
+        self.pool = pool or ThreadPoolExecutor(max_workers=RETRIEVAL_WORKERS)
+        self.emb_timeout, self.vec_timeout = emb_timeout, vec_timeout
+
+    @classmethod
+    def open(cls, persist_dir: str = PERSIST_DIR, collection: str = COLLECTION, bm25_dir: str = BM25_DIR,
+             client=None, backend: str = VECTOR_BACKEND, vec_dir: str = VEC_DIR, **kwargs) -> "Retriever":
+        from openai import OpenAI
+        col = open_collection(persist_dir, collection, backend, vec_dir)
+        bm25, status = load_or_build(col, base_dir=bm25_dir, verify=BM25_VERIFY)
+        print(f"[BM25] {status}: docs = {len(bm25)}, terms = {len(bm25.vocab)}")
+        embedder = QueryEmbedder(client or OpenAI(), EMB_MODEL, maxsize=QCACHE_SIZE, ttl=QCACHE_TTL,
+                                 disk_path=QCACHE_PATH or None)
+        kwargs.setdefault("reranker", reranker_from_env())
+        return cls(col, bm25, embedder, **kwargs)
+
+    def fetch_docs(self, ids) -> Dict[str, Tuple[str, dict]]:
+        # 본문/메타는 필요한 id만 Chroma에서 조회. 재정렬에 쓸 청크 벡터가 캐시에 없으면 같은 요청으로 함께
+        if not ids:
+            return {}
+        ids = list(dict.fromkeys(ids))
+        with_vecs = bool(self.reranker and self.reranker.needs_vectors and self.reranker.missing_vectors(ids))
+        res = self.col.get(ids=ids, include=["documents", "metadatas"] + (["embeddings"] if with_vecs else []))
+        if with_vecs and res.get("embeddings") is not None:
+            self.reranker.put_vectors(res.get("ids") or [], res["embeddings"])
+        out = {}
+        for did, doc, meta in zip(res.get("ids") or [], res.get("documents") or [], res.get("metadatas") or []):
+            if isinstance(doc, str) and doc.strip():
+                out[did] = (doc, meta or {})
+        return out
+
+    def _bm25_ids(self, query: str, n: int, work_id: Optional[str], kinds: Optional[List[str]] = None) -> List[str]:
+        if not len(self.bm25):
+            return []
+        toks = self.bm25.tokenize(query)
+        if not toks:
+            return []
+        # 질의어 postings만 점수화, work_id 필터는 top-k 선택 전에 적용
+        return [self.bm25.ids[i] for i, _ in self.bm25.search(toks, n, work_id=work_id, kinds=kinds)]
+
+    def _pool_size(self, top_k: int) -> int:
+        return top_k * (self.reranker.pool if self.reranker else 2)
+
+    def _select(self, fused, docs: Dict[str, Tuple[str, dict]], top_k: int,
+                query: str = "", qvec=None) -> List[Hit]:
+        if self.reranker is not None:
+            return [(did, txt, meta) for did, txt, meta, _ in self.reranker.rerank(query, qvec, fused, docs, top_k)]
+        hits = []
+        for did, _ in fused:
+            if did in docs:
+                txt, meta = docs[did]
+                hits.append((did, txt, meta))
+                if len(hits) >= top_k:
+                    break
+        return hits
+
+    def retrieve(self, query: str, top_k: int, work_id: Optional[str] = None,
+                 timings: Optional[Dict[str, Any]] = None, kinds: Optional[List[str]] = None) -> List[Hit]:
+        # timings(dict)를 넘기면 단계별 소요 시간(초), 단계별 후보 수(candidates), degraded 여부를 채워 줌
+        return self.retrieve_with_vector(query, top_k, work_id, timings, kinds)[0]
+
+    def retrieve_with_vector(self, query: str, top_k: int, work_id: Optional[str] = None,
+                             timings: Optional[Dict[str, Any]] = None,
+                             kinds: Optional[List[str]] = None) -> Tuple[List[Hit], Optional[List[float]]]:
+        # retrieve와 같고, 검색에 쓴 질의 벡터도 함께 반환(임베딩이 늦거나 실패했으면 None)
+        #   → 답변 캐시처럼 질의 벡터가 필요한 곳이 임베딩을 다시 요청하지 않도록
+        timings = {} if timings is None else timings
+        if not query or not query.strip():
+            return [], None
+        t0 = time.perf_counter()
+
+        # 1) 질의 임베딩(네트워크)을 먼저 띄워 두고
+        emb_fut = self.pool.submit(_timed(self.embedder.embed), query)
+
+        # 2) 그동안 BM25 (임베딩과 무관)
+        t = time.perf_counter()
+        bm25_ids = self._bm25_ids(query, top_k * 3, work_id, kinds)
+        timings["bm25"] = time.perf_counter() - t
+
+        # 3) 임베딩 → 벡터 검색, 단계별 타임아웃. 실패/지연 시 BM25 결과만으로 진행
+        vec_ids, emb = [], None
+        try:
+            emb, timings["embed"] = emb_fut.result(timeout=max(0.0, self.emb_timeout - (time.perf_counter() - t0)))
+            vec_fut = self.pool.submit(_timed(self.col.query),
+                                       query_embeddings=[emb],
+                                       n_results=top_k * 3,
+                                       where=chroma_where(work_id, kinds))
+            vec_res, timings["vector"] = vec_fut.result(timeout=self.vec_timeout)
+            vec_ids = vec_res["ids"][0] if vec_res.get("ids") else []
+        except FutureTimeout:
+            timings["degraded"] = "timeout"
+        except Exception as e:
+            timings["degraded"] = type(e).__name__
+        timings["dense_wait"] = time.perf_counter() - t0 - timings["bm25"]
+
+        fused = reciprocal_rank_fusion([vec_ids, bm25_ids])
+
+        t = time.perf_counter()
+        fused = fused[:self._pool_size(top_k)]
+        docs = self.fetch_docs([did for did, _ in fused])
+        timings["fetch"] = time.perf_counter() - t
+        t = time.perf_counter()
+        hits = self._select(fused, docs, top_k, query, emb)
+        timings["rerank"] = time.perf_counter() - t
+        timings["total"] = time.perf_counter() - t0
+        timings["candidates"] = {"bm25": len(bm25_ids), "vector": len(vec_ids), "fused": len(fused),
+                                 "docs": len(docs), "cards": len(hits)}
+        return hits, emb
+
+    def retrieve_batch(self, queries: List[str], top_k: int, work_ids: Optional[List[Optional[str]]] = None,
+                       timings: Optional[Dict[str, Any]] = None, kinds: Optional[List[str]] = None) -> List[List[Hit]]:
+        # N개 질의: 임베딩 1회 요청, work_id별 다중 임베딩 col.query, BM25 일괄 점수화, 문서 조회 1회
+        timings = {} if timings is None else timings
+        work_ids = list(work_ids) if work_ids is not None else [None] * len(queries)
+        if len(work_ids) != len(queries):
+            raise ValueError("queries와 work_ids 길이가 다릅니다.")
+        live = [i for i, q in enumerate(queries) if q and q.strip()]
+        out: List[List[Hit]] = [[] for _ in queries]
+        if not live:
+            return out
+        t0 = time.perf_counter()
+
+        t = time.perf_counter()
+        embs = self.embedder.embed_many([queries[i] for i in live])
+        timings["embed"] = time.perf_counter() - t
+
+        t = time.perf_counter()
+        vec_ids: Dict[int, List[str]] = {}
+        groups: Dict[Optional[str], List[int]] = {}
+        for j, i in enumerate(live):
+            groups.setdefault(work_ids[i], []).append(j)
+        for work_id, js in groups.items():
+            res = self.col.query(query_embeddings=[embs[j] for j in js], n_results=top_k * 3,
+                                 where=chroma_where(work_id, kinds))
+            for j, ids in zip(js, res.get("ids") or []):
+                vec_ids[live[j]] = ids
+        timings["vector"] = time.perf_counter() - t
+
+        t = time.perf_counter()
+        bm25_ids: Dict[int, List[str]] = {}
+        if len(self.bm25):
+            ranked = self.bm25.search_batch([self.bm25.tokenize(queries[i]) for i in live], top_k * 3,
+                                            [work_ids[i] for i in live], kinds=kinds)
+            for i, r in zip(live, ranked):
+                bm25_ids[i] = [self.bm25.ids[d] for d, _ in r]
+        timings["bm25"] = time.perf_counter() - t
+
+        fused = {i: reciprocal_rank_fusion([vec_ids.get(i, []), bm25_ids.get(i, [])])[:self._pool_size(top_k)]
+                 for i in live}
+        t = time.perf_counter()
+        docs = self.fetch_docs([did for i in live for did, _ in fused[i]])
+        timings["fetch"] = time.perf_counter() - t
+        t = time.perf_counter()
+        for j, i in enumerate(live):
+            out[i] = self._select(fused[i], docs, top_k, queries[i], embs[j])
+        timings["rerank"] = time.perf_counter() - t
+        timings["total"] = time.perf_counter() - t0
+        return out
+
+if __name__ == "__main__":
+    # 오프라인 일괄 검색/캐시 예열: python retriever.py queries.jsonl [top_k]
+    #   입력 한 줄 = {"query": "...", "work_id": "..."} 또는 질의 문자열
+    #   출력 한 줄 = {"query", "work_id", "hits": [{"id", "kind", "title"}]}
+    from dotenv import load_dotenv
+    load_dotenv()
+    if len(sys.argv) < 2:
+        raise SystemExit("usage: python retriever.py queries.jsonl [top_k]")
+    top_k = int(sys.argv[2]) if len(sys.argv) > 2 else 6
+    rows = []
+    with open(sys.argv[1], "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            rows.append(json.loads(line) if line.startswith("{") else {"query": line})
+    r = Retriever.open()
+    timings: Dict[str, Any] = {}
+    results = r.retrieve_batch([x["query"] for x in rows], top_k, [x.get("work_id") for x in rows], timings=timings)
+    for x, hits in zip(rows, results):
+        print(json.dumps({
+            "query": x["query"], "work_id": x.get("work_id"),
+            "hits": [{"id": did, "kind": m.get("kind"), "title": m.get("scene_title") or m.get("chapter_label")}
+                     for did, _, m in hits],
+        }, ensure_ascii=False))
+    print(f"[BATCH] queries = {len(rows)}, " + ", ".join(f"{k} {v:.3f}s" for k, v in timings.items()),
+          file=sys.stderr)
@@ -0,0 +1,199 @@
+from dotenv import load_dotenv
+load_dotenv()
+
+import os, json, time, asyncio, argparse, weakref
+from contextlib import asynccontextmanager, nullcontext
+from typing import Any, AsyncIterator, Dict, Optional, Tuple
+
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.requests import Request
+from starlette.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from starlette.routing import Route
+
+from chat_core import ChatPipeline, Turn, BASE_DIR, WORK_ID_MAP
+from session_store import Session, SessionStore
+
+# Streamlit 없이 쓰는 비동기 채팅 서비스. 워커 프로세스마다 인덱스/캐시를 한 번 로드해 모든 요청이 공유
+#   python server.py --port 8000 --workers 4      (또는 uvicorn server:app --workers 4)
+#   POST /chat         {"message", "work_id" | "work", "speak_as", "session_id"?} → {"session_id", "answer", "timing"}
+#   POST /chat/stream  같은 본문 → SSE: meta(session_id) → delta(text)* → done(answer, timing) | error
+#   GET/DELETE /sessions/{id}, GET /health, GET /metrics(METRICS=1)
+# 검색/프롬프트 조립은 스레드 풀에서, LLM 호출은 AsyncOpenAI로 워커당 LLM_CONCURRENCY개까지만 동시에
+LLM_CONCURRENCY   = int(os.getenv("LLM_CONCURRENCY", "16"))
+LLM_QUEUE_TIMEOUT = float(os.getenv("LLM_QUEUE_TIMEOUT", "30"))   # 생성 자리 대기 한도(초) → 초과 시 503/busy
+SESSION_PATH      = os.getenv("SESSION_PATH") or os.path.join(BASE_DIR, "rag", ".artifacts", "sessions.sqlite3")
+MAX_MESSAGE_CHARS = int(os.getenv("MAX_MESSAGE_CHARS", "2000"))
+
+class Busy(Exception):
+    pass
+
+@asynccontextmanager
+async def lifespan(app: Starlette):
+    # /metrics는 이 앱이 직접 제공 → METRICS_PORT 별도 서버는 띄우지 않음(워커끼리 포트 충돌)
+    app.state.pipe = await run_in_threadpool(ChatPipeline.open, None, False)
+    app.state.sessions = SessionStore(SESSION_PATH)
+    app.state.llm = asyncio.Semaphore(LLM_CONCURRENCY)
+    app.state.locks = weakref.WeakValueDictionary()   # 세션별 직렬화(같은 세션의 턴이 겹치지 않도록)
+    print(f"[SERVER] pid = {os.getpid()}, docs = {len(app.state.pipe.retriever.bm25)}, "
+          f"llm_concurrency = {LLM_CONCURRENCY}")
+    try:
+        yield
+    finally:
+        app.state.pipe.close()
+        app.state.sessions.close()
+
+def _error(status: int, message: str) -> JSONResponse:
+    return JSONResponse({"error": message}, status_code=status)
+
+async def _parse(request: Request) -> Tuple[Optional[Dict[str, Any]], Optional[JSONResponse]]:
+    try:
+        body = await request.json()
+    except Exception:
+        return None, _error(400, "JSON 본문이 필요합니다.")
+    if not isinstance(body, dict):
+        return None, _error(400, "JSON 객체가 필요합니다.")
+    message = str(body.get("message") or "").strip()
+    if not message:
+        return None, _error(400, "message가 비어 있습니다.")
+    if len(message) > MAX_MESSAGE_CHARS:
+        return None, _error(413, f"message는 {MAX_MESSAGE_CHARS}자 이하여야 합니다.")
+    work_id = body.get("work_id") or WORK_ID_MAP.get(body.get("work") or "")
+    if body.get("work") and not work_id:
+        return None, _error(400, f"알 수 없는 작품: {body['work']}")
+    return {"message": message, "work_id": work_id, "speak_as": (body.get("speak_as") or "").strip() or None,
+            "session_id": body.get("session_id") or None}, None
+
+def _lock(app: Starlette, sid: Optional[str]):
+    if not sid:
+        return nullcontext()   # 새 세션은 겹칠 상대가 없음
+    lock = app.state.locks.get(sid)
+    if lock is None:
+        lock = asyncio.Lock()
+        app.state.locks[sid] = lock
+    return lock
+
+async def _begin(app: Starlette, req: Dict[str, Any]) -> Tuple[Session, Turn]:
+    store: SessionStore = app.state.sessions
+    sid = req["session_id"] or store.new_id()
+    sess = await run_in_threadpool(store.get, sid) or Session(sid)
+    sess.switch(req["work_id"], req["speak_as"])
+    turn = await run_in_threadpool(app.state.pipe.prepare, req["message"], sess.work_id, sess.speak_as,
+                                   sess.history, sess.memory)
+    return sess, turn
+
+async def _generate(app: Starlette, turn: Turn) -> AsyncIterator[str]:
+    if turn.cached:
+        yield turn.cached["answer"]
+        return
+    sem: asyncio.Semaphore = app.state.llm
+    t = time.perf_counter()
+    try:
+        await asyncio.wait_for(sem.acquire(), LLM_QUEUE_TIMEOUT)
+    except asyncio.TimeoutError:
+        raise Busy(f"LLM 대기열 초과({LLM_QUEUE_TIMEOUT:.0f}s)")
+    turn.trace.add_stage("llm_queue", time.perf_counter() - t)
+    try:
+        async for delta in app.state.pipe.astream(turn):
+            yield delta
+    finally:
+        sem.release()
+
+async def _finish(app: Starlette, sess: Session, turn: Turn, ans: str) -> Dict[str, Any]:
+    # prepare와 다른 스레드 풀 스레드여도 됨: 느린 턴 프로파일러는 prepare/complete 호출 안에서만 켜졌다 꺼짐
+    timing = await run_in_threadpool(app.state.pipe.complete, turn, ans)
+    sess.history.append({"role": "user", "content": turn.query})
+    sess.history.append({"role": "assistant", "content": ans, "timing": timing})
+    await run_in_threadpool(app.state.sessions.save, sess)
+    return timing
+
+async def chat(request: Request):
+    req, err = await _parse(request)
+    if err:
+        return err
+    app = request.app
+    async with _lock(app, req["session_id"]):
+        sess, turn = await _begin(app, req)
+        try:
+            ans = "".join([d async for d in _generate(app, turn)]).strip()
+            timing = await _finish(app, sess, turn, ans)
+        except Busy as e:
+            return _error(503, str(e))
+        except Exception as e:
+            return _error(502, f"{type(e).__name__}: {e}")
+        finally:
+            turn.trace.abort()   # 실패/취소된 턴의 프로파일러 정리(정상 종료 후에는 무시됨)
+    return JSONResponse({"session_id": sess.id, "answer": ans, "timing": timing})
+
+def _sse(event: str, data: Dict[str, Any]) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+async def chat_stream(request: Request):
+    req, err = await _parse(request)
+    if err:
+        return err
+    app = request.app
+
+    async def events():
+        # 생성 자리는 스트림 안에서 잡음 → 응답 시작 전에 연결이 끊겨도 세마포어가 새지 않음
+        async with _lock(app, req["session_id"]):
+            sess, turn = await _begin(app, req)
+            try:
+                yield _sse("meta", {"session_id": sess.id, "cache": bool(turn.cached)})
+                parts = []
+                try:
+                    async for delta in _generate(app, turn):
+                        parts.append(delta)
+                        yield _sse("delta", {"text": delta})
+                except Busy as e:
+                    yield _sse("error", {"error": str(e), "status": 503})
+                    return
+                except Exception as e:
+                    yield _sse("error", {"error": f"{type(e).__name__}: {e}", "status": 502})
+                    return
+                ans = "".join(parts).strip()
+                timing = await _finish(app, sess, turn, ans)
+                yield _sse("done", {"session_id": sess.id, "answer": ans, "timing": timing})
+            finally:
+                turn.trace.abort()   # 끊긴 연결/실패한 턴의 프로파일러 정리
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+async def get_session(request: Request):
+    sess = await run_in_threadpool(request.app.state.sessions.get, request.path_params["sid"])
+    return JSONResponse(sess.to_dict()) if sess else _error(404, "세션이 없습니다.")
+
+async def delete_session(request: Request):
+    ok = await run_in_threadpool(request.app.state.sessions.delete, request.path_params["sid"])
+    return JSONResponse({"deleted": ok})
+
+async def health(request: Request):
+    pipe: ChatPipeline = request.app.state.pipe
+    return JSONResponse({"status": "ok", "pid": os.getpid(), "docs": len(pipe.retriever.bm25),
+                         "qcache": pipe.retriever.embedder.stats(),
+                         "answer_cache": pipe.answers.stats() if pipe.answers else None})
+
+async def metrics(request: Request):
+    m = request.app.state.pipe.metrics
+    if m is None:
+        return _error(404, "METRICS=1일 때만 제공됩니다.")
+    return PlainTextResponse(m.render_prometheus(), media_type="text/plain; version=0.0.4")
+
+app = Starlette(routes=[
+    Route("/chat", chat, methods=["POST"]),
+    Route("/chat/stream", chat_stream, methods=["POST"]),
+    Route("/sessions/{sid}", get_session, methods=["GET"]),
+    Route("/sessions/{sid}", delete_session, methods=["DELETE"]),
+    Route("/health", health, methods=["GET"]),
+    Route("/metrics", metrics, methods=["GET"]),
+], lifespan=lifespan)
+
+if __name__ == "__main__":
+    import uvicorn
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8000)
+    ap.add_argument("--workers", type=int, default=1, help="워커 프로세스 수(각자 인덱스 1벌)")
+    args = ap.parse_args()
+    uvicorn.run("server:app", host=args.host, port=args.port, workers=args.workers, log_level="warning")
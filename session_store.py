@@ -0,0 +1,95 @@
+import os, json, time, uuid, sqlite3, threading
+from typing import Any, Dict, List, Optional
+
+from prompt_builder import RollingMemory
+
+# HTTP 서비스의 서버 측 대화 기록 (SQLite → 같은 호스트의 여러 워커가 공유, 재시작해도 유지)
+#   세션 = 작품/인물 + 메시지 목록 + 접힌 요약(RollingMemory). 작품/인물이 바뀌면 새 대화로 초기화
+SESSION_TTL      = float(os.getenv("SESSION_TTL", str(86400)))   # 마지막 사용 후 보존 시간(초), 0이면 무기한
+SESSION_MESSAGES = int(os.getenv("SESSION_MESSAGES", "100"))     # 보존할 최근 메시지 수(그 이전은 요약에만 남음)
+
+class Session:
+    __slots__ = ("id", "work_id", "speak_as", "history", "memory")
+
+    def __init__(self, id: str, work_id: Optional[str] = None, speak_as: Optional[str] = None,
+                 history: Optional[List[Dict[str, Any]]] = None, memory: Optional[RollingMemory] = None):
+        self.id, self.work_id, self.speak_as = id, work_id, speak_as
+        self.history = history or []
+        self.memory = memory or RollingMemory()
+
+    def switch(self, work_id: Optional[str], speak_as: Optional[str]) -> bool:
+        # Streamlit과 같은 규칙: 작품이나 인물이 바뀌면 기록 초기화
+        changed = (self.work_id, self.speak_as) != (work_id, speak_as)
+        if changed:
+            self.work_id, self.speak_as = work_id, speak_as
+            self.history, self.memory = [], RollingMemory()
+        return changed
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"session_id": self.id, "work_id": self.work_id, "speak_as": self.speak_as,
+                "history": self.history, "memory": self.memory.text}
+
+class SessionStore:
+    def __init__(self, path: str, ttl: float = SESSION_TTL, max_messages: int = SESSION_MESSAGES):
+        self.path, self.ttl, self.max_messages = path, ttl, max_messages
+        d = os.path.dirname(path)
+        if d:
+            os.makedirs(d, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=10)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            " id TEXT PRIMARY KEY, work_id TEXT, speak_as TEXT, history TEXT NOT NULL,"
+            " memory TEXT NOT NULL, updated REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS sessions_updated ON sessions (updated)")
+        self._conn.commit()
+
+    @staticmethod
+    def new_id() -> str:
+        return uuid.uuid4().hex
+
+    def get(self, sid: str) -> Optional[Session]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT work_id, speak_as, history, memory, updated FROM sessions WHERE id = ?", (sid,)
+            ).fetchone()
+        if row is None or (self.ttl and time.time() - row[4] > self.ttl):
+            return None
+        mem = json.loads(row[3])
+        memory = RollingMemory()
+        memory.lines, memory.folded = mem.get("lines", []), mem.get("folded", 0)
+        return Session(sid, row[0], row[1], json.loads(row[2]), memory)
+
+    def save(self, s: Session) -> None:
+        # 오래된 메시지를 잘라내면 요약이 접은 위치(folded)도 같은 만큼 당김
+        drop = len(s.history) - self.max_messages
+        if drop > 0:
+            s.history = s.history[drop:]
+            s.memory.folded = max(0, s.memory.folded - drop)
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO sessions (id, work_id, speak_as, history, memory, updated)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (s.id, s.work_id, s.speak_as, json.dumps(s.history, ensure_ascii=False),
+                 json.dumps({"lines": s.memory.lines, "folded": s.memory.folded}, ensure_ascii=False), now),
+            )
+            if self.ttl:
+                self._conn.execute("DELETE FROM sessions WHERE updated < ?", (now - self.ttl,))
+            self._conn.commit()
+
+    def delete(self, sid: str) -> bool:
+        with self._lock:
+            cur = self._conn.execute("DELETE FROM sessions WHERE id = ?", (sid,))
+            self._conn.commit()
+        return cur.rowcount > 0
+
+    def count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,65 @@
+from persona_index import PersonaIndex, name_aliases
+
+WORK = "so-nyeon-i-onda"
+
+def _rows():
+    meta = {"work_id": WORK, "kind": "characters_raw"}
+    return [
+        (f"{WORK}::characters_raw::_SECTION_RAW_::0",
+         "주요 등장인물 소개\n• 동호 – 역할: 상무관에서 봉사하는 중학생.\n• 정대 – 역할: 동호의 친구.", meta),
+        (f"{WORK}::characters_raw::_SECTION_RAW_::4",
+         "• 동호의 어머니 – 역할: 아들을 잃은 어머니. 동호를 찾아 헤맨다. 동호, 동호, 동호.", meta),
+        (f"{WORK}::persona::이희수 할머니는 동호가 이사를 가기 전 사라져버렸고::0",
+         "이희수 할머니는 동호가 이사를 가기 전 사라져버렸고 …",
+         {"work_id": WORK, "kind": "persona",
+          "character": "이희수 할머니는 동호가 이사를 가기 전 사라져버렸고"}),
+    ]
+
+def test_exact_name_beats_substring_alias():
+    idx = PersonaIndex.build(_rows())
+    assert idx.lookup(WORK, "동호") == [f"{WORK}::characters_raw::_SECTION_RAW_::0"]
+    ranked = idx.rank(WORK, "동호", query="동호야 어디 있니")
+    assert ranked[0][0] == f"{WORK}::characters_raw::_SECTION_RAW_::0"
+    assert idx.rank(WORK, "동호야")[0][0] == f"{WORK}::characters_raw::_SECTION_RAW_::0"
+
+def test_relation_is_not_the_named_character():
+    idx = PersonaIndex.build(_rows())
+    # "동호의 어머니"는 동호가 아님 → 동호의 섹션으로 떨어지지 않음
+    assert f"{WORK}::characters_raw::_SECTION_RAW_::0" not in idx.lookup(WORK, "동호의 어머니")
+
+def test_sentence_fragments_are_not_aliases():
+    assert name_aliases("https") == []
+    assert name_aliases("이희수 할머니는 동호가 이사를 가기 전") == []
+    assert name_aliases("한유진") == ["한유진", "유진"]
+    idx = PersonaIndex.build(_rows())
+    assert set(idx.by_work[WORK]) == {"동호", "정대"}
+
+def test_persona_chunks_with_sentence_headers_follow_the_name():
+    work = "jigu-ggut-onshil"
+    section = f"{work}::characters_raw::_SECTION_RAW_::0"
+    rows = [
+        (section, "등장인물 분석\n• 레이첼 - 솔라리타 연구소의 식물학자.\n• 지수 - 프림 빌리지의 수리공.",
+         {"work_id": work, "kind": "characters_raw"}),
+        (f"{work}::persona::레이첼의 말투와 성격::0", "레이첼의 말투와 성격",
+         {"work_id": work, "kind": "persona", "character": "레이첼의 말투와 성격"}),
+        (f"{work}::persona::레이첼로서는 매우 이례적으로::0", "레이첼로서는 매우 이례적으로 …",
+         {"work_id": work, "kind": "persona", "character": "레이첼로서는 매우 이례적으로"}),
+        (f"{work}::persona::성격적 특성::0", "성격적 특성: 레이첼은 …",
+         {"work_id": work, "kind": "persona", "character": "성격적 특성"}),
+    ]
+    idx = PersonaIndex.build(rows)
+    # 기존 `speak_as in character` 동작처럼 레이첼 persona 청크가 먼저, 인물 섹션은 그 뒤
+    assert idx.lookup(work, "레이첼") == [
+        f"{work}::persona::레이첼로서는 매우 이례적으로::0",
+        f"{work}::persona::레이첼의 말투와 성격::0",
+        section,
+    ]
+    assert idx.lookup(work, "지수") == [section]
+
+def test_lookup_memo_is_bounded():
+    idx = PersonaIndex.build(_rows())
+    idx._memo.maxsize = 4
+    for i in range(50):
+        idx.lookup(WORK, f"없는이름{i}")
+    assert len(idx._memo) == 4
+    assert idx.lookup(WORK, "동호") == [f"{WORK}::characters_raw::_SECTION_RAW_::0"]
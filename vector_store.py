@@ -0,0 +1,288 @@
+import os, json, mmap, time, shutil, tempfile
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+import numpy as np
+
+from bm25_index import fingerprint
+
+# Chroma 대신 쓸 수 있는 로컬 벡터 저장소 (VECTOR_BACKEND=local)
+#   <dir>/manifest.json          : dim, count, fingerprint, work별 [start, n]
+#   <dir>/ids.json, metas.json   : 전역 행 순서(작품별로 연속)의 id / 메타
+#   <dir>/docs.jsonl + offsets.npy : 본문 (필요한 행만 mmap으로 읽음)
+#   <dir>/parts/<work>/q.npy     : int8 양자화 벡터(행별 scale.npy) → 근사 점수
+#   <dir>/parts/<work>/vec.npy   : 정규화된 float32 벡터(mmap) → 상위 후보만 정확 재채점
+# 검색은 work_id 파티션 안에서만 수행, 나머지 where 조건은 메타로 평가.
+# Retriever/BM25/PersonaIndex가 쓰는 Chroma 컬렉션 API(get/query/count/name) 부분집합을 제공.
+
+STORE_VERSION = 1
+VEC_DIR       = os.getenv("VEC_DIR", "rag/.vec").replace("\\","/")
+RESCORE       = int(os.getenv("VEC_RESCORE", "4"))       # 정확 재채점 후보 수 = n_results × RESCORE
+BLOCK_ROWS    = 8192                                      # 근사 점수 계산 블록(메모리 상한)
+
+def store_path(collection: str, base_dir: str = VEC_DIR) -> str:
+    return os.path.join(base_dir, collection)
+
+def _safe(name: str) -> str:
+    return "".join(ch if ch.isalnum() or ch in "-_." else "_" for ch in name) or "_"
+
+def quantize(mat: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    # 행별 대칭 int8: v ≈ q * scale
+    scale = np.abs(mat).max(axis=1) / 127.0
+    scale[scale == 0] = 1.0
+    q = np.clip(np.rint(mat / scale[:, None]), -127, 127).astype(np.int8)
+    return q, scale.astype(np.float32)
+
+def match_where(meta: dict, where: Optional[dict]) -> bool:
+    # Chroma where 문법 중 이 프로젝트가 쓰는 부분: 값 일치, $eq/$ne/$in/$nin, $and/$or
+    if not where:
+        return True
+    for key, cond in where.items():
+        if key == "$and":
+            if not all(match_where(meta, c) for c in cond): return False
+        elif key == "$or":
+            if not any(match_where(meta, c) for c in cond): return False
+        elif isinstance(cond, dict):
+            v = meta.get(key)
+            for op, arg in cond.items():
+                if op == "$eq" and v != arg: return False
+                if op == "$ne" and v == arg: return False
+                if op == "$in" and v not in arg: return False
+                if op == "$nin" and v in arg: return False
+        elif meta.get(key) != cond:
+            return False
+    return True
+
+def _split_work(where: Optional[dict]) -> Tuple[Optional[str], Optional[dict]]:
+    # where에서 work_id 등호 조건을 떼어 파티션 선택에 사용
+    if not where:
+        return None, None
+    if isinstance(where.get("work_id"), str) and len(where) == 1:
+        return where["work_id"], None
+    if "$and" in where and len(where) == 1:
+        work, rest = None, []
+        for c in where["$and"]:
+            if work is None and isinstance(c.get("work_id"), str) and len(c) == 1:
+                work = c["work_id"]
+            else:
+                rest.append(c)
+        if work is not None:
+            return work, (rest[0] if len(rest) == 1 else {"$and": rest} if rest else None)
+    return None, where
+
+class LocalVectorStore:
+    def __init__(self, path: str):
+        self.path = path
+        with open(os.path.join(path, "manifest.json"), "r", encoding="utf-8") as f:
+            self.manifest = json.load(f)
+        self.name = self.manifest.get("collection", os.path.basename(path.rstrip("/")))
+        # Chroma 컬렉션 메타데이터의 스탬프와 같은 키 (bm25_index.collection_stamp)
+        self.metadata = {"content_count": self.manifest.get("count", 0),
+                         "content_fingerprint": self.manifest.get("fingerprint", "")}
+        with open(os.path.join(path, "ids.json"), "r", encoding="utf-8") as f:
+            self.ids: List[str] = json.load(f)
+        with open(os.path.join(path, "metas.json"), "r", encoding="utf-8") as f:
+            self.metas: List[dict] = json.load(f)
+        self.row = {i: r for r, i in enumerate(self.ids)}
+        self.offsets = np.load(os.path.join(path, "offsets.npy"))
+        self._docs_f = open(os.path.join(path, "docs.jsonl"), "rb")
+        self._docs = mmap.mmap(self._docs_f.fileno(), 0, access=mmap.ACCESS_READ) if len(self.ids) else b""
+        self.parts: Dict[str, Dict[str, Any]] = {}
+        for work, (start, n) in self.manifest["works"].items():
+            d = os.path.join(path, "parts", _safe(work))
+            self.parts[work] = {
+                "start": start, "n": n,
+                "q": np.load(os.path.join(d, "q.npy"), mmap_mode="r"),
+                "scale": np.load(os.path.join(d, "scale.npy")),
+                "vec": np.load(os.path.join(d, "vec.npy"), mmap_mode="r"),
+            }
+        self._masks: Dict[str, np.ndarray] = {}
+
+    @classmethod
+    def open(cls, path: str) -> Optional["LocalVectorStore"]:
+        return cls(path) if os.path.exists(os.path.join(path, "manifest.json")) else None
+
+    @classmethod
+    def build(cls, path: str, records: Iterable[Tuple[str, str, dict, Any]], collection: str = "") -> Dict[str, int]:
+        # 같은 디렉터리의 고유한 임시 디렉터리에 다 쓰고 교체 → 동시에 만들어도 서로의 파일을 덮지 않음
+        path = path.rstrip("/")
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp = tempfile.mkdtemp(prefix=os.path.basename(path) + ".", suffix=".tmp", dir=os.path.dirname(path) or ".")
+        try:
+            stats = cls._write(tmp, records, collection)
+            if stats["total"]:
+                shutil.rmtree(path, ignore_errors=True)
+                os.replace(tmp, path)
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+        return stats
+
+    @staticmethod
+    def _write(tmp: str, records: Iterable[Tuple[str, str, dict, Any]], collection: str) -> Dict[str, int]:
+        # records: (id, text, meta, vec) 스트림. 작품별 임시 파일에 이어 쓰고 마지막에 파티션으로 변환
+        os.makedirs(os.path.join(tmp, "parts"))
+        raw: Dict[str, Any] = {}
+        per_work: Dict[str, List[Tuple[str, dict, int]]] = {}
+        dim, seen = 0, set()
+        for _id, text, meta, vec in records:
+            if _id in seen:
+                continue
+            seen.add(_id)
+            v = np.asarray(vec, dtype=np.float32).ravel()
+            dim = dim or len(v)
+            v = v / (np.linalg.norm(v) or 1.0)
+            work = (meta or {}).get("work_id", "unknown")
+            if work not in raw:
+                raw[work] = (open(os.path.join(tmp, f"{_safe(work)}.f32"), "wb"),
+                             open(os.path.join(tmp, f"{_safe(work)}.docs"), "wb"))
+            fv, fd = raw[work]
+            fv.write(v.tobytes())
+            line = (json.dumps(text, ensure_ascii=False) + "\n").encode("utf-8")
+            fd.write(line)
+            per_work.setdefault(work, []).append((_id, meta or {}, len(line)))
+        for fv, fd in raw.values():
+            fv.close(); fd.close()
+        if not seen:
+            # 레코드가 없으면 기존 저장소를 건드리지 않음
+            return {"total": 0, "upserted": 0, "unchanged": 0, "deleted": 0}
+
+        ids, metas, works = [], [], {}
+        offsets = [0]
+        with open(os.path.join(tmp, "docs.jsonl"), "wb") as docs:
+            for work in sorted(per_work):
+                rows = per_work[work]
+                works[work] = [len(ids), len(rows)]
+                d = os.path.join(tmp, "parts", _safe(work))
+                os.makedirs(d)
+                src = np.memmap(os.path.join(tmp, f"{_safe(work)}.f32"), dtype=np.float32, mode="r",
+                                shape=(len(rows), dim))
+                vec = np.lib.format.open_memmap(os.path.join(d, "vec.npy"), mode="w+", dtype=np.float32,
+                                                shape=(len(rows), dim))
+                q = np.lib.format.open_memmap(os.path.join(d, "q.npy"), mode="w+", dtype=np.int8,
+                                              shape=(len(rows), dim))
+                scale = np.empty(len(rows), dtype=np.float32)
+                for s in range(0, len(rows), BLOCK_ROWS):
+                    blk = np.asarray(src[s:s+BLOCK_ROWS])
+                    vec[s:s+BLOCK_ROWS] = blk
+                    q[s:s+BLOCK_ROWS], scale[s:s+BLOCK_ROWS] = quantize(blk)
+                vec.flush(); q.flush()
+                del src, vec, q
+                np.save(os.path.join(d, "scale.npy"), scale)
+                with open(os.path.join(tmp, f"{_safe(work)}.docs"), "rb") as fd:
+                    shutil.copyfileobj(fd, docs)
+                for _id, meta, size in rows:
+                    ids.append(_id); metas.append(meta)
+                    offsets.append(offsets[-1] + size)
+                os.remove(os.path.join(tmp, f"{_safe(work)}.f32"))
+                os.remove(os.path.join(tmp, f"{_safe(work)}.docs"))
+
+        np.save(os.path.join(tmp, "offsets.npy"), np.asarray(offsets, dtype=np.int64))
+        with open(os.path.join(tmp, "ids.json"), "w", encoding="utf-8") as f:
+            json.dump(ids, f, ensure_ascii=False)
+        with open(os.path.join(tmp, "metas.json"), "w", encoding="utf-8") as f:
+            json.dump(metas, f, ensure_ascii=False)
+        manifest = {
+            "version": STORE_VERSION, "collection": collection, "quant": "int8", "dim": dim,
+            "count": len(ids), "fingerprint": fingerprint((i, m.get("content_hash", "")) for i, m in zip(ids, metas)),
+            "works": works, "built_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+        }
+        with open(os.path.join(tmp, "manifest.json"), "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+        return {"total": len(ids), "upserted": len(ids), "unchanged": 0, "deleted": 0}
+
+    # ---- Chroma 컬렉션 호환 부분 ----
+    def count(self) -> int:
+        return len(self.ids)
+
+    def _doc(self, r: int) -> str:
+        return json.loads(self._docs[int(self.offsets[r]):int(self.offsets[r + 1])])
+
+    def _vec(self, r: int) -> np.ndarray:
+        work = self.metas[r].get("work_id", "unknown")
+        p = self.parts[work]
+        return np.asarray(p["vec"][r - p["start"]])
+
+    def _result(self, rows: List[int], include: List[str]) -> Dict[str, Any]:
+        out: Dict[str, Any] = {"ids": [self.ids[r] for r in rows]}
+        if "documents" in include:
+            out["documents"] = [self._doc(r) for r in rows]
+        if "metadatas" in include:
+            out["metadatas"] = [self.metas[r] for r in rows]
+        if "embeddings" in include:
+            out["embeddings"] = np.stack([self._vec(r) for r in rows]) if rows else np.zeros((0, 0), np.float32)
+        return out
+
+    def get(self, ids: Optional[List[str]] = None, where: Optional[dict] = None,
+            include: Optional[List[str]] = None, limit: Optional[int] = None, offset: int = 0) -> Dict[str, Any]:
+        include = ["documents", "metadatas"] if include is None else include
+        if ids is not None:
+            rows = [self.row[i] for i in ids if i in self.row]
+        else:
+            rows = range(len(self.ids))
+        if where:
+            rows = [r for r in rows if match_where(self.metas[r], where)]
+        rows = list(rows)[offset:(offset + limit) if limit is not None else None]
+        return self._result(rows, include)
+
+    def _mask(self, work: str, where: dict) -> np.ndarray:
+        key = work + "\x1f" + json.dumps(where, sort_keys=True, ensure_ascii=False)
+        m = self._masks.get(key)
+        if m is None:
+            p = self.parts[work]
+            m = np.fromiter((match_where(self.metas[p["start"] + i], where) for i in range(p["n"])),
+                            dtype=bool, count=p["n"])
+            if len(self._masks) > 256:
+                self._masks.clear()
+            self._masks[key] = m
+        return m
+
+    def _search(self, q: np.ndarray, k: int, work: str, where: Optional[dict]) -> List[Tuple[int, float]]:
+        p = self.parts[work]
+        if not p["n"]:
+            return []
+        mask = self._mask(work, where) if where else None
+        # 1) int8 근사 점수(블록 단위) → 2) 상위 k×RESCORE 후보만 float32로 정확 재채점
+        approx = np.empty(p["n"], dtype=np.float32)
+        for s in range(0, p["n"], BLOCK_ROWS):
+            approx[s:s+BLOCK_ROWS] = (p["q"][s:s+BLOCK_ROWS].astype(np.float32) @ q) * p["scale"][s:s+BLOCK_ROWS]
+        if mask is not None:
+            approx[~mask] = -np.inf
+        n_cand = min(p["n"], k * RESCORE)
+        cand = np.argpartition(-approx, n_cand - 1)[:n_cand] if n_cand < p["n"] else np.arange(p["n"])
+        cand = cand[np.isfinite(approx[cand])]
+        if not len(cand):
+            return []
+        cand.sort()
+        exact = np.asarray(p["vec"][cand]) @ q
+        top = np.argsort(-exact, kind="stable")[:k]
+        return [(p["start"] + int(cand[i]), float(exact[i])) for i in top]
+
+    def query(self, query_embeddings: List[Any], n_results: int = 10, where: Optional[dict] = None,
+              include: Optional[List[str]] = None) -> Dict[str, Any]:
+        include = ["distances"] if include is None else include
+        work, rest = _split_work(where)
+        works = [work] if work is not None else list(self.parts)
+        out: Dict[str, List[Any]] = {"ids": [], "distances": []}
+        for key in ("documents", "metadatas"):
+            if key in include:
+                out[key] = []
+        for emb in query_embeddings:
+            q = np.asarray(emb, dtype=np.float32)
+            q = q / (np.linalg.norm(q) or 1.0)
+            hits: List[Tuple[int, float]] = []
+            for w in works:
+                if w in self.parts:
+                    hits += self._search(q, n_results, w, rest)
+            hits.sort(key=lambda x: -x[1])
+            hits = hits[:n_results]
+            rows = [r for r, _ in hits]
+            res = self._result(rows, [k for k in include if k in ("documents", "metadatas")])
+            out["ids"].append(res["ids"])
+            out["distances"].append([1.0 - s for _, s in hits])   # cosine 거리(Chroma hnsw:space=cosine과 동일)
+            for key in ("documents", "metadatas"):
+                if key in include:
+                    out[key].append(res[key])
+        return out
+
+    def close(self) -> None:
+        if isinstance(self._docs, mmap.mmap):
+            self._docs.close()
+        self._docs_f.close()